@@ -38,13 +38,16 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'restapi',
+    'restapi.apps.RestapiConfig',
     'rest_framework',
     'rest_framework_simplejwt.token_blacklist',
 ]
 
 MIDDLEWARE = [
+    'restapi.metrics.MetricsMiddleware',
+    'restapi.querycheck.QueryCheckMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'restapi.replicas.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -84,9 +87,42 @@ DATABASES = {
         'PASSWORD': os.environ.get('POSTGRES_PASSWORD'),
         'HOST': os.environ.get('POSTGRES_HOST'),
         'PORT': os.environ.get('POSTGRES_PORT'),
+        # Seconds to keep a connection per thread (0 - close it after every request)
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+        # Used by pooled backend, see below
+        'POOL': {
+            'MAX_SIZE': int(os.environ.get('DB_POOL_SIZE', 10)),
+            'TIMEOUT': 5,
+            'MAX_AGE': 1800,
+            'PING_AFTER': 1,
+        },
     }
 }
 
+# With DB_POOL=1 requests take connections from a bounded pool per worker process and give them back when finished,
+# instead of opening a new connection for every request (statistics at api/_db_pool).
+if os.environ.get('DB_POOL') == '1':
+    DATABASES['default']['ENGINE'] = 'restapi.db.backends.postgresql'
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+
+# Read replicas, POSTGRES_REPLICAS='host[:port][=weight],...' (aliases replica1, replica2, ...). Reads of safe requests
+# go to a replica chosen by weight, a client reads from the primary for REPLICA_STICKY_SECONDS after a write,
+# a replica failing to connect is skipped for REPLICA_EJECT_SECONDS. The marker of a write is kept in
+# REPLICA_STICKY_CACHE, with replicas it must be shared by all workers (CACHE_BACKEND), not the per process LocMemCache.
+DATABASE_REPLICAS = {}
+for number, replica in enumerate(filter(None, os.environ.get('POSTGRES_REPLICAS', '').split(',')), 1):
+    address, _, weight = replica.partition('=')
+    host, _, port = address.partition(':')
+    alias = 'replica{}'.format(number)
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host, PORT=port or DATABASES['default']['PORT'],
+                            TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS[alias] = int(weight or 1)
+
+DATABASE_ROUTERS = ['restapi.replicas.ReplicaRouter']
+REPLICA_STICKY_SECONDS = 5
+REPLICA_EJECT_SECONDS = 30
+REPLICA_STICKY_CACHE = 'default'
+
 # # Only for tests with venv
 #
 # db creation
@@ -103,6 +139,21 @@ DATABASES = {
 
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Serialized products are cached in this cache for CATALOG_CACHE_TIMEOUT seconds
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = 300
+CATALOG_CACHE_LOCK_TIMEOUT = 10
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -141,15 +192,85 @@ STATIC_URL = '/static/'
 
 AUTH_USER_MODEL = 'restapi.User'
 
+TEST_RUNNER = 'restapi.tests.runner.TestRunner'
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': ('rest_framework.permissions.IsAuthenticated',
                                    ),
     'DEFAULT_AUTHENTICATION_CLASSES': ('rest_framework_simplejwt.authentication.JWTAuthentication',),
+    'DEFAULT_PAGINATION_CLASS': 'restapi.pagination.KeysetPagination',
+    'DEFAULT_THROTTLE_CLASSES': ('restapi.throttling.UserThrottle', 'restapi.throttling.IPThrottle'),
+    'PAGE_SIZE': 50,
+    # Proxies in front of the app appending to X-Forwarded-For; with 0 the header is ignored and IP throttles use
+    # REMOTE_ADDR, otherwise clients could pick their bucket by sending the header
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
 }
 
+# Token bucket limits set per view ('throttle_rates' in restapi/views.py), buckets are kept in this cache; use a
+# shared one (CACHE_BACKEND) with many workers. The test runner turns it off, throttling tests turn it on again.
+THROTTLE_ENABLED = os.environ.get('THROTTLE_ENABLED', '1') == '1'
+THROTTLE_CACHE_ALIAS = 'default'
+
+# Request duration histograms per route at api/_metrics. Phases (auth, permissions, throttling, queries,
+# serialization, rendering) are measured for METRICS_SAMPLE_RATE of requests (0.0 - 1.0) and sent to employees (every
+# client with DEBUG) in Server-Timing header unless SERVER_TIMING_HEADER is off.
+METRICS_ENABLED = True
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1.0))
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', '1') == '1'
+
+# Queries of a request with the same shape run more than QUERY_REPEAT_THRESHOLD times (N+1), or taking longer than
+# QUERY_SLOW_SECONDS, are logged to 'restapi.queries' for QUERY_CHECK_SAMPLE_RATE of requests (0.0 - 1.0). Repeated
+# queries fail tests using restapi.querycheck.QueryCheckMixin, slow ones are logged there too.
+QUERY_REPEAT_THRESHOLD = 5
+QUERY_SLOW_SECONDS = 0.1
+QUERY_CHECK_SAMPLE_RATE = float(os.environ.get('QUERY_CHECK_SAMPLE_RATE', 0.0))
+
+# Stock of a product set through api/products/<pk>/stock is split over STOCK_SHARDS rows unless the request sets
+# another number; orders of one product reserve units from different rows, so more shards let more run at once.
+STOCK_SHARDS = 8
+
+# Side effects of order changes are events of the outbox, handled by 'python manage.py outbox_worker' with the
+# handlers (dotted paths, called with the event and its payload) of their topic. A failing event is retried after
+# OUTBOX_RETRY_DELAY seconds, doubled for every failure up to OUTBOX_MAX_RETRY_DELAY, and given up after
+# OUTBOX_MAX_ATTEMPTS. A worker claims OUTBOX_BATCH_SIZE events at once for OUTBOX_LEASE_SECONDS.
+OUTBOX_HANDLERS = {
+    'order.finished': ['restapi.outbox.log_event'],
+}
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_LEASE_SECONDS = 60
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_DELAY = 1
+OUTBOX_MAX_RETRY_DELAY = 600
+
+# Upper limit for 'page_size' query param of list endpoints
+API_MAX_PAGE_SIZE = 500
+
+# Rows fetched and serialized at once by lists requested with '?stream=1'
+STREAM_CHUNK_SIZE = 2000
+
+# Authenticate with user id and roles from access token claims, without a database lookup.
+# Role changes reach the API within ACCESS_TOKEN_LIFETIME (next refresh).
+if os.environ.get('JWT_STATELESS_AUTH') == '1':
+    REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'] = ('restapi.authentication.RoleTokenAuthentication',)
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=30),
     'REFRESH_TOKEN_LIFETIME': timedelta(hours=8),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
-}
\ No newline at end of file
+}
+
+# Refresh token blacklist is checked through a bloom filter per process, updated with new blacklist rows every
+# BLACKLIST_FILTER_SYNC_SECONDS. Expired tokens are deleted by 'python manage.py compact_token_blacklist'.
+BLACKLIST_FILTER_SYNC_SECONDS = 5
+BLACKLIST_FILTER_ERROR_RATE = 0.001
+
+# Seconds to cache user's group names per process (0 - load them once per request)
+ROLE_CACHE_TTL = int(os.environ.get('ROLE_CACHE_TTL', 0))
+
+# Responses to requests with Idempotency-Key header are replayed for IDEMPOTENCY_KEY_TTL seconds. A retry waits up to
+# IDEMPOTENCY_WAIT_TIMEOUT seconds for the first request, whose key is freed if it didn't finish in
+# IDEMPOTENCY_LOCK_TIMEOUT seconds.
+IDEMPOTENCY_KEY_TTL = 24 * 3600
+IDEMPOTENCY_WAIT_TIMEOUT = 10
+IDEMPOTENCY_LOCK_TIMEOUT = 60
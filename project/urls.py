@@ -1,22 +1,28 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from restapi import views
 from rest_framework.urlpatterns import format_suffix_patterns
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api', views.index, name='index'),
+    path('api/_db_pool', views.DatabasePoolStats.as_view(), name='db-pool'),
+    path('api/_metrics', views.Metrics.as_view(), name='metrics'),
+    path('api/_token_blacklist', views.TokenBlacklistStats.as_view(), name='token-blacklist'),
     path('api/suppliers', views.SupplierList.as_view(), name='supplier-list'),
     path('api/suppliers/<int:pk>', views.SupplierDetail.as_view(), name='supplier-detail'),
     path('api/products', views.ProductList.as_view(), name='product-list'),
+    path('api/products/search', views.ProductSearch.as_view(), name='product-search'),
     path('api/products/<int:pk>', views.ProductDetail.as_view(), name='product-detail'),
+    path('api/products/<int:pk>/stock', views.ProductStock.as_view(), name='product-stock'),
+    re_path(r'^api/sales/(?P<dimension>products|suppliers|categories|days)$', views.SalesReport.as_view(),
+            name='sales-report'),
     path('api/orders', views.OrderList.as_view(), name='order-list'),
     path('api/orders/<int:pk>', views.OrderDetail.as_view(), name='order-detail'),
     path('api/orders/<int:pk>/items', views.OrderItemCreate.as_view(), name='order-item'),
     path('api/orders/<int:pk>/items/<int:item>', views.OrderItemDetail.as_view(), name='order-item-detail'),
-    path('api/token/', TokenObtainPairView.as_view(), name='token'),
-    path('api/token/refresh/', TokenRefreshView.as_view(), name='refresh-token'),
+    path('api/token/', views.TokenObtainView.as_view(), name='token'),
+    path('api/token/refresh/', views.TokenRefreshView.as_view(), name='refresh-token'),
     path('api/api-auth/', include('rest_framework.urls')),
 
 ]
@@ -1,5 +1,21 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.signals import post_migrate
+
+
+def install_search_index(sender, using, **kwargs):
+    """Recreate search triggers after migrations, SQLite drops them when a migration rebuilds a table."""
+    from restapi import search
+    connection = connections[using]
+    if ('restapi', '0006_product_search') in MigrationRecorder(connection).applied_migrations():
+        search.install(connection)
 
 
 class RestapiConfig(AppConfig):
     name = 'restapi'
+
+    def ready(self):
+        post_migrate.connect(install_search_index, sender=self)
+        from restapi import metrics
+        metrics.install()
@@ -0,0 +1,63 @@
+from django.contrib.auth import get_user_model
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from restapi.blacklist import FilteredRefreshToken, blacklist_once
+from restapi.roles import get_roles
+
+'''
+Tokens carry user's group names in 'roles' claim, so RoleTokenAuthentication can authorize requests without a database
+lookup. Roles are read from the database at login and on every refresh, so an access token is never more stale than
+ACCESS_TOKEN_LIFETIME.
+'''
+
+ROLES_CLAIM = 'roles'
+
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token[ROLES_CLAIM] = sorted(get_roles(user))
+        return token
+
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        # Blacklist is checked through the filter of restapi.blacklist
+        refresh = FilteredRefreshToken(attrs['refresh'])
+        user = get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: refresh[api_settings.USER_ID_CLAIM]}) \
+            .prefetch_related('groups').first()
+        if user is None or not user.is_active:
+            raise InvalidToken(_('User not found or inactive'))
+        access = refresh.access_token
+        access[ROLES_CLAIM] = sorted(group.name for group in user.groups.all())
+        data = {'access': str(access)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                blacklist_once(refresh)
+            refresh.set_jti()
+            refresh.set_exp()
+            data['refresh'] = str(refresh)
+        return data
+
+
+class RoleTokenUser(TokenUser):
+    """Stateless user whose roles come from the token instead of the groups table."""
+
+    def __init__(self, token):
+        super().__init__(token)
+        self._role_names = frozenset(token[ROLES_CLAIM])
+
+
+class RoleTokenAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+        if ROLES_CLAIM not in validated_token:
+            raise InvalidToken(_('Token contained no roles, obtain a new one'))
+        return RoleTokenUser(validated_token)
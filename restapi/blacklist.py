@@ -0,0 +1,175 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow, datetime_from_epoch
+
+'''
+Refresh token blacklist checks through a per-process bloom filter of blacklisted token ids: a token id not in the
+filter was never blacklisted, so most refreshes skip the blacklist query. The filter is brought up to date with rows
+added since its last sync every BLACKLIST_FILTER_SYNC_SECONDS and rebuilt from unexpired rows when it gets full.
+A token used for a refresh is blacklisted by inserting a unique row, which fails for a token already used, so a stale
+filter never lets a rotated token in.
+'''
+
+
+class BloomFilter:
+    """Set of strings answering 'maybe' for about 'error_rate' of absent items while it has under 'capacity' items."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing, positions of k hashes from two halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def error_rate(self):
+        """Expected false positive rate with the current number of items."""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class BlacklistFilter:
+    min_capacity = 1024
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filter = None
+        self.last_id = 0
+        self.synced_at = None
+        self.stats = {'checks': 0, 'skipped': 0, 'queries': 0, 'blacklisted': 0, 'syncs': 0, 'rebuilds': 0,
+                      'check_seconds': 0.0, 'max_check_seconds': 0.0}
+
+    def rebuild(self):
+        last_id = BlacklistedToken.objects.aggregate(last=Max('id'))['last'] or 0
+        jtis = list(BlacklistedToken.objects.filter(id__lte=last_id, token__expires_at__gt=aware_utcnow())
+                    .values_list('token__jti', flat=True))
+        self.filter = BloomFilter(max(self.min_capacity, 2 * len(jtis)),
+                                  getattr(settings, 'BLACKLIST_FILTER_ERROR_RATE', 0.001))
+        for jti in jtis:
+            self.filter.add(jti)
+        self.last_id = last_id
+        self.stats['rebuilds'] += 1
+
+    def sync(self):
+        now = time.monotonic()
+        if self.filter is None or self.filter.count > self.filter.capacity:
+            self.rebuild()
+        elif now - self.synced_at >= getattr(settings, 'BLACKLIST_FILTER_SYNC_SECONDS', 5):
+            rows = BlacklistedToken.objects.filter(id__gt=self.last_id).order_by('id').values_list('id', 'token__jti')
+            for row_id, jti in rows:
+                self.filter.add(jti)
+                self.last_id = row_id
+            self.stats['syncs'] += 1
+        else:
+            return
+        self.synced_at = now
+
+    def might_contain(self, jti):
+        with self.lock:
+            self.sync()
+            return jti in self.filter
+
+    def add(self, jti):
+        with self.lock:
+            if self.filter is not None:
+                self.filter.add(jti)
+
+    def record(self, seconds, **counts):
+        with self.lock:
+            self.stats['checks'] += 1
+            self.stats['check_seconds'] += seconds
+            self.stats['max_check_seconds'] = max(self.stats['max_check_seconds'], seconds)
+            for name, count in counts.items():
+                self.stats[name] += count
+
+    def reset(self):
+        with self.lock:
+            self.filter = None
+
+
+blacklist_filter = BlacklistFilter()
+
+
+class FilteredRefreshToken(RefreshToken):
+    def check_blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        start = time.perf_counter()
+        counts = {'skipped': 1}
+        try:
+            if blacklist_filter.might_contain(jti):
+                counts = {'queries': 1}
+                super().check_blacklist()
+        except TokenError:
+            counts['blacklisted'] = 1
+            raise
+        finally:
+            blacklist_filter.record(time.perf_counter() - start, **counts)
+
+
+def blacklist_once(token):
+    """Blacklist the token, raise TokenError if it already was: the unique row decides between concurrent uses."""
+    jti = token[api_settings.JTI_CLAIM]
+    with transaction.atomic():
+        outstanding, _created = OutstandingToken.objects.get_or_create(
+            jti=jti, defaults={'token': str(token), 'expires_at': datetime_from_epoch(token['exp'])})
+        _blacklisted, created = BlacklistedToken.objects.get_or_create(token=outstanding)
+    if not created:
+        raise TokenError(_('Token is blacklisted'))
+    blacklist_filter.add(jti)
+
+
+def compact(batch_size=1000, pause=0.0):
+    """Delete expired outstanding tokens (and their blacklist rows) in short transactions, return their number."""
+    deleted, now = 0, aware_utcnow()
+    while True:
+        ids = list(OutstandingToken.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        with transaction.atomic():
+            BlacklistedToken.objects.filter(token_id__in=ids).delete()
+            deleted += OutstandingToken.objects.filter(id__in=ids).delete()[0]
+        if pause:
+            time.sleep(pause)
+    # Expired ids are still in the filter, drop them with the next rebuild
+    blacklist_filter.reset()
+    return deleted
+
+
+def stats():
+    """Table sizes and blacklist check statistics of this process."""
+    with blacklist_filter.lock:
+        result = dict(blacklist_filter.stats)
+        bloom = blacklist_filter.filter
+    checks, seconds = result['checks'], result.pop('check_seconds')
+    result.update(avg_check_ms=round(seconds / checks * 1000, 3) if checks else 0,
+                  max_check_ms=round(result.pop('max_check_seconds') * 1000, 3),
+                  outstanding_tokens=OutstandingToken.objects.count(),
+                  blacklisted_tokens=BlacklistedToken.objects.count(),
+                  expired_tokens=OutstandingToken.objects.filter(expires_at__lte=aware_utcnow()).count())
+    if bloom is not None:
+        result.update(filter_items=bloom.count, filter_capacity=bloom.capacity,
+                      filter_kb=round(len(bloom.bits) / 1024, 1), filter_error_rate=round(bloom.error_rate(), 6))
+    return result
@@ -0,0 +1,91 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from restapi import replicas
+
+'''
+Cache of serialized catalog (products) responses. Keys contain a catalog version, so a write invalidates every cached
+page at once by bumping the version. Only one worker rebuilds a missing entry, others wait for its result.
+'''
+
+VERSION_KEY = 'catalog:version'
+
+_stats = {'hits': 0, 'misses': 0, 'rebuilds': 0, 'waits': 0}
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def get_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from current time, so entries of a version lost by eviction are never reused
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _bump_version():
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+
+
+def bump_version():
+    """Invalidate the catalog now and once more after commit, so readers can't cache data of an open transaction."""
+    _bump_version()
+    transaction.on_commit(_bump_version)
+
+
+def get_or_build(name, build):
+    """Return cached value of 'name' for the current catalog version, building it by one worker at a time."""
+    cache = get_cache()
+    key = 'catalog:{}:{}'.format(get_version(), name)
+    value = cache.get(key)
+    if value is not None:
+        _count('hits')
+        return value
+    _count('misses')
+
+    lock_key = key + ':lock'
+    lock_timeout = getattr(settings, 'CATALOG_CACHE_LOCK_TIMEOUT', 10)
+    owner = cache.add(lock_key, 1, lock_timeout)
+    if not owner:
+        _count('waits')
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.01)
+            value = cache.get(key)
+            if value is not None:
+                return value
+            if cache.get(lock_key) is None:
+                break
+    _count('rebuilds')
+    try:
+        # Shared by all clients, so never built from a lagging replica
+        with replicas.use_primary():
+            value = build()
+        cache.set(key, value, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+    finally:
+        if owner:
+            cache.delete(lock_key)
+    return value
@@ -0,0 +1,96 @@
+from functools import lru_cache
+
+from django.core.exceptions import ImproperlyConfigured
+
+from rest_framework import fields as drf_fields
+from rest_framework import relations, serializers
+
+'''
+Read-only fast path for ModelSerializers: declared fields are turned into a values() query once per serializer class
+and rows are converted to dicts with precomputed per-field functions. Output is the same as serializer's data, without
+building field objects and calling get_attribute() per instance.
+'''
+
+# Fields whose to_representation() returns database values unchanged
+IDENTITY_FIELDS = (drf_fields.IntegerField, drf_fields.CharField, drf_fields.BooleanField, drf_fields.ChoiceField,
+                   relations.PrimaryKeyRelatedField)
+
+
+class CompiledSerializer:
+    def __init__(self, serializer_class, prefix=''):
+        serializer = serializer_class()
+        self.model = serializer.Meta.model
+        # (output name, values() column, conversion or None, compiled serializer of a nested forward relation),
+        # in declared order so that dicts have the same key order as serializer's data
+        self.fields = []
+        # (output name, compiled serializer of related model, FK name on related model) for reverse relations
+        self.many = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.ListSerializer):
+                relation = self.model._meta.get_field(field.source)
+                self.many.append((name, CompiledSerializer(type(field.child)), relation.field.name))
+                self.fields.append((name, None, None, None))
+            elif isinstance(field, serializers.BaseSerializer):
+                column = prefix + field.source
+                self.fields.append((name, column, None, CompiledSerializer(type(field), prefix=column + '__')))
+            elif isinstance(field, relations.RelatedField) and type(field) is not relations.PrimaryKeyRelatedField:
+                raise ImproperlyConfigured('{} of {} cannot be compiled.'.format(type(field).__name__,
+                                                                                serializer_class.__name__))
+            else:
+                convert = None if type(field) in IDENTITY_FIELDS else field.to_representation
+                self.fields.append((name, prefix + field.source.replace('.', '__'), convert, None))
+
+    def columns(self):
+        columns = []
+        for name, column, convert, nested in self.fields:
+            if column is not None:
+                columns.append(column)
+            if nested is not None:
+                columns += nested.columns()
+        return columns
+
+    def values(self, queryset, *extra):
+        """Queryset of dicts with every column needed by the serializer (and extra ones, e.g. for pagination)."""
+        columns = self.columns()
+        columns += [column for column in extra if column not in columns]
+        pk = self.model._meta.pk.name
+        if self.many and pk not in columns:
+            columns.append(pk)
+        return queryset.values(*columns)
+
+    def convert(self, row):
+        data = {}
+        for name, column, convert, nested in self.fields:
+            value = row[column] if column is not None else None
+            if nested is not None:
+                data[name] = None if value is None else nested.convert(row)
+            elif value is None or convert is None:
+                data[name] = value
+            else:
+                data[name] = convert(value)
+        return data
+
+    def serialize_rows(self, rows):
+        """Rows of values() -> list of dicts equal to serializer(many=True).data."""
+        result = [self.convert(row) for row in rows]
+        if self.many and rows:
+            pk = self.model._meta.pk.name
+            by_pk = {row[pk]: data for row, data in zip(rows, result)}
+            for name, child, fk in self.many:
+                for data in by_pk.values():
+                    data[name] = []
+                related = child.values(child.model.objects.filter(**{fk + '__in': list(by_pk)}), fk)
+                related_rows = list(related.order_by(child.model._meta.pk.name))
+                for row, item in zip(related_rows, child.serialize_rows(related_rows)):
+                    by_pk[row[fk]][name].append(item)
+        return result
+
+    def serialize(self, queryset):
+        return self.serialize_rows(list(self.values(queryset)))
+
+
+@lru_cache(maxsize=None)
+def compile_serializer(serializer_class):
+    return CompiledSerializer(serializer_class)
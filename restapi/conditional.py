@@ -0,0 +1,66 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+'''
+Validators (ETag, Last-Modified) computed from 'updated_at' columns instead of the response body, so conditional
+requests are answered before any serialization. A page of a list is validated by its own rows, read by the keyset
+page query anyway, so validating it costs no query over the whole list.
+'''
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'Resource was modified since you retrieved it.'
+    default_code = 'precondition_failed'
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def instance_validators(instance):
+    return make_etag(instance.pk, instance.updated_at), instance.updated_at
+
+
+def page_validators(rows, pk, *parts):
+    """
+    Validators of a page from its rows (dicts of values() with primary key 'pk' and 'updated_at'): an insert, update
+    or delete within the page changes keys or times of its rows; 'parts' add e.g. the query and the next link.
+    """
+    keys = [(row[pk], row['updated_at']) for row in rows]
+    return make_etag(keys, *parts), max((row['updated_at'] for row in rows), default=None)
+
+
+def queryset_validators(queryset, *parts):
+    """Validators of a whole list: any insert, update or delete changes its row count or latest 'updated_at'."""
+    meta = queryset.order_by().aggregate(count=Count('pk'), last_modified=Max('updated_at'))
+    return make_etag(meta['count'], meta['last_modified'], *parts), meta['last_modified']
+
+
+def conditional_response(request, etag, last_modified):
+    """304 or 412 response if request's conditional headers are satisfied by the validators, otherwise None."""
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def has_preconditions(request):
+    return 'HTTP_IF_MATCH' in request.META or 'HTTP_IF_UNMODIFIED_SINCE' in request.META
+
+
+def check_preconditions(request, etag, last_modified):
+    """Protect PUT/PATCH/DELETE against lost updates with If-Match / If-Unmodified-Since."""
+    response = conditional_response(request, etag, last_modified)
+    if response is not None and response.status_code == status.HTTP_412_PRECONDITION_FAILED:
+        raise PreconditionFailed()
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
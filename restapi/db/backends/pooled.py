@@ -0,0 +1,16 @@
+from restapi.db.pool import get_pool
+
+'''Database wrapper mixin taking connections from the process pool (settings: DATABASES[alias]['POOL']).'''
+
+
+class PooledDatabaseWrapperMixin:
+    def get_pool(self):
+        return get_pool(self.alias, self.settings_dict.get('POOL', {}))
+
+    def get_new_connection(self, conn_params):
+        parent = super()
+        return self.get_pool().checkout(lambda: parent.get_new_connection(conn_params))
+
+    def _close(self):
+        if self.connection is not None:
+            self.get_pool().checkin(self.connection)
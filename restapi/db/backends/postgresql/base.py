@@ -0,0 +1,7 @@
+from django.db.backends.postgresql import base
+
+from restapi.db.backends.pooled import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    pass
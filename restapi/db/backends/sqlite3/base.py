@@ -0,0 +1,7 @@
+from django.db.backends.sqlite3 import base
+
+from restapi.db.backends.pooled import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    """Pooled SQLite, for trying the pool locally."""
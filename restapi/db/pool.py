@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+from collections import deque
+
+from django.db.utils import OperationalError
+
+'''
+Bounded pool of database connections shared by threads of one worker process. Django closes a connection at the end
+of every request (CONN_MAX_AGE = 0); a pooled database backend gives it back to the pool instead, and the next request
+gets a connection that is already open. Connections are checked before they are handed out, broken and expired ones
+are closed and replaced.
+'''
+
+
+class ConnectionPool:
+    def __init__(self, max_size=10, timeout=5.0, max_age=None, ping_after=1.0):
+        """
+        max_size - open connections at most; timeout - seconds to wait for a free one;
+        max_age - seconds after which a connection is replaced (None - never);
+        ping_after - seconds of idleness after which a connection is pinged before reuse (0 - always).
+        """
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.ping_after = ping_after
+        self._condition = threading.Condition()
+        # (connection, created at, returned at), the most recently returned connection is reused first
+        self._idle = deque()
+        self._created = {}
+        self._in_use = 0
+        self._started = time.monotonic()
+        self._stats = {'checkouts': 0, 'waits': 0, 'wait_time': 0.0, 'max_wait_time': 0.0, 'timeouts': 0,
+                       'opened': 0, 'recycled': 0}
+
+    def _expired(self, created, now):
+        return self.max_age is not None and now - created >= self.max_age
+
+    def _is_usable(self, connection, returned, now):
+        if now - returned < self.ping_after:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, connection):
+        self._created.pop(id(connection), None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def checkout(self, connect):
+        """Return an idle connection, or a new one made by 'connect', waiting while the pool is full."""
+        start = time.monotonic()
+        waited = False
+        with self._condition:
+            while not self._idle and self._in_use + len(self._idle) >= self.max_size:
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise OperationalError('No database connection available in {:.1f}s (pool size {}).'.format(
+                        self.timeout, self.max_size))
+                waited = True
+                self._condition.wait(remaining)
+            entry = self._idle.pop() if self._idle else None
+            self._in_use += 1
+            wait_time = time.monotonic() - start
+            self._stats['checkouts'] += 1
+            if waited:
+                self._stats['waits'] += 1
+                self._stats['wait_time'] += wait_time
+                self._stats['max_wait_time'] = max(self._stats['max_wait_time'], wait_time)
+        try:
+            if entry is not None:
+                connection, created, returned = entry
+                now = time.monotonic()
+                if not self._expired(created, now) and self._is_usable(connection, returned, now):
+                    return connection
+                self._discard(connection)
+                with self._condition:
+                    self._stats['recycled'] += 1
+            connection = connect()
+        except BaseException:
+            self._release()
+            raise
+        with self._condition:
+            self._created[id(connection)] = time.monotonic()
+            self._stats['opened'] += 1
+        return connection
+
+    def _release(self):
+        with self._condition:
+            self._in_use -= 1
+            self._condition.notify()
+
+    def checkin(self, connection):
+        """Take a connection back; an open transaction is rolled back, broken or expired connections are closed."""
+        created = self._created.get(id(connection), time.monotonic())
+        try:
+            connection.rollback()
+            reusable = not self._expired(created, time.monotonic())
+        except Exception:
+            reusable = False
+        with self._condition:
+            self._in_use -= 1
+            if reusable:
+                self._idle.append((connection, created, time.monotonic()))
+            else:
+                self._stats['recycled'] += 1
+            self._condition.notify()
+        if not reusable:
+            self._discard(connection)
+
+    def discard(self, connection):
+        """Close a checked out connection which can't be used any more."""
+        self._discard(connection)
+        with self._condition:
+            self._stats['recycled'] += 1
+        self._release()
+
+    def close_all(self):
+        with self._condition:
+            idle, self._idle = list(self._idle), deque()
+        for connection, created, returned in idle:
+            self._discard(connection)
+
+    def stats(self):
+        with self._condition:
+            stats, in_use, idle = dict(self._stats), self._in_use, len(self._idle)
+        waits = stats['waits']
+        return {'in_use': in_use, 'idle': idle, 'max_size': self.max_size, 'opened': stats['opened'],
+                'recycled': stats['recycled'], 'checkouts': stats['checkouts'],
+                'checkouts_per_sec': round(stats['checkouts'] / (time.monotonic() - self._started), 2),
+                'waits': waits, 'timeouts': stats['timeouts'],
+                'avg_wait_ms': round(stats['wait_time'] * 1000 / waits, 3) if waits else 0.0,
+                'max_wait_ms': round(stats['max_wait_time'] * 1000, 3)}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, options):
+    """Pool of the database alias in this process; a forked worker starts with its own pools."""
+    key = (os.getpid(), alias)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(max_size=options.get('MAX_SIZE', 10), timeout=options.get('TIMEOUT', 5.0),
+                                         max_age=options.get('MAX_AGE'), ping_after=options.get('PING_AFTER', 1.0))
+        return _pools[key]
+
+
+def stats():
+    """Statistics of pools of this process by database alias."""
+    with _pools_lock:
+        pools = {alias: pool for (pid, alias), pool in _pools.items() if pid == os.getpid()}
+    return {alias: pool.stats() for alias, pool in pools.items()}
@@ -1,9 +1,20 @@
+import io
+from functools import lru_cache
+from itertools import islice, repeat
+
 import factory
 from restapi.models import Supplier, Product, Order, User, ProductsInOrders
+from restapi.roles import CUSTOMER, EMPLOYEE
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import Group
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
 import factory.fuzzy
 from datetime import datetime
 
+DEFAULT_PASSWORD = 'abc123'
+
 
 class GroupFactory (factory.django.DjangoModelFactory):
     class Meta:
@@ -15,7 +26,7 @@ class UserFactory(factory.django.DjangoModelFactory):
         model = User
 
     username = factory.Sequence(lambda n: 'User%d' % (n + 1))
-    password = factory.PostGenerationMethodCall('set_password', 'abc123')
+    password = factory.PostGenerationMethodCall('set_password', DEFAULT_PASSWORD)
     # password = 'abc123'
 
     # @classmethod
@@ -71,4 +82,119 @@ class ProductsInOrdersFactory(factory.django.DjangoModelFactory):
     pr_id = factory.SubFactory(UserFactory)
     amount = factory.fuzzy.FuzzyInteger(1, 1000)
 
-
+    @classmethod
+    def _create(cls, model_class, *args, **kwargs):
+        item = super()._create(model_class, *args, **kwargs)
+        Order.add_item_totals(item.or_id_id, item.line_price, 1)
+        return item
+
+
+# Bulk generation: instances are built in memory in batches and written with one query per batch, instead of saving
+# rows one by one. Primary key sequences of factories continue after the largest existing key, so foreign keys can be
+# set from known keys without reading rows back.
+
+
+@lru_cache(maxsize=None)
+def password_hash(password=DEFAULT_PASSWORD):
+    return make_password(password)
+
+
+class BulkUserFactory(UserFactory):
+    """Users sharing one precomputed password hash, instead of running the password hasher for every user."""
+    id = factory.Sequence(lambda n: n + 1)
+    password = factory.LazyFunction(password_hash)
+
+
+def continue_sequence(factory_class):
+    """Make the factory's primary key sequence continue after the largest key in the table."""
+    model = factory_class._meta.model
+    factory_class.reset_sequence(model.objects.aggregate(last=Max('pk'))['last'] or 0, force=True)
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy(model, instances):
+    """Insert instances with PostgreSQL COPY, the fastest way of loading rows."""
+    fields = [field for field in model._meta.concrete_fields
+              if not (field.primary_key and all(instance.pk is None for instance in instances))]
+    data = io.StringIO()
+    for instance in instances:
+        values = (field.get_db_prep_save(field.pre_save(instance, True), connection) for field in fields)
+        data.write('\t'.join(_copy_value(value) for value in values) + '\n')
+    data.seek(0)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert('COPY {} ({}) FROM STDIN'.format(connection.ops.quote_name(model._meta.db_table), columns),
+                           data)
+
+
+def bulk_create(factory_class, rows, batch_size=1000, **kwargs):
+    """
+    Build an instance of the factory for every dict of attributes in 'rows' (together with 'kwargs')
+    and insert them 'batch_size' at a time. Return primary keys set by the factory.
+    """
+    model = factory_class._meta.model
+    continue_sequence(factory_class)
+    rows = iter(rows)
+    pks = []
+    while True:
+        batch = [factory_class.build(**dict(kwargs, **row)) for row in islice(rows, batch_size)]
+        if not batch:
+            break
+        if connection.vendor == 'postgresql':
+            _copy(model, batch)
+        else:
+            model.objects.bulk_create(batch)
+        pks += [instance.pk for instance in batch if instance.pk is not None]
+    # Keys were set explicitly, so the database sequence has to be moved past them
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+            cursor.execute(sql)
+    return pks
+
+
+def bulk_users(count, group_name, batch_size=1000):
+    pks = bulk_create(BulkUserFactory, repeat({}, count), batch_size)
+    group, _ = Group.objects.get_or_create(name=group_name)
+    User.groups.through.objects.bulk_create([User.groups.through(user_id=pk, group_id=group.pk) for pk in pks],
+                                            batch_size=batch_size)
+    return pks
+
+
+def bulk_orders(user_pks, count, product_pks, lines, batch_size=1000):
+    """Orders spread evenly over users, each with 'lines' items of different random products, and their totals."""
+    users = [User(pk=pk) for pk in user_pks]
+    pks = bulk_create(OrderFactory, repeat({}, count), batch_size, or_username=factory.Iterator(users))
+    rng = factory.random.randgen
+    products = [Product(pk=pk) for pk in product_pks]
+    items = ({'or_id': order, 'pr_id': product}
+             for order in map(Order, pks) for product in rng.sample(products, min(lines, len(products))))
+    bulk_create(ProductsInOrdersFactory, items, batch_size)
+    if pks and lines:
+        for start in range(0, len(pks), batch_size):
+            Order.recalculate_totals(Order.objects.filter(pk__in=pks[start:start + batch_size]))
+    return pks
+
+
+def seed_dataset(seed=0, suppliers=100, products=1000, customers=100, employees=1, orders=10000, lines=5,
+                 batch_size=1000):
+    """
+    Insert a dataset for benchmarks. The same seed gives the same rows when started from the same database state.
+    Return primary keys of created rows by kind.
+    """
+    factory.random.reseed_random(seed)
+    with transaction.atomic():
+        result = {'employees': bulk_users(employees, EMPLOYEE, batch_size),
+                  'customers': bulk_users(customers, CUSTOMER, batch_size),
+                  'suppliers': bulk_create(SupplierFactory, repeat({}, suppliers), batch_size)}
+        supplier_stubs = [Supplier(pk=pk) for pk in result['suppliers']]
+        result['products'] = bulk_create(ProductFactory, repeat({}, products), batch_size,
+                                         pr_sup=factory.fuzzy.FuzzyChoice(supplier_stubs))
+        result['orders'] = bulk_orders(result['customers'], orders, result['products'], lines, batch_size)
+    return result
@@ -0,0 +1,70 @@
+import sys
+
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+'''
+Query param filters of list views. Each filter validates its param with a serializer field and adds one lookup;
+lists declare them in 'filters' and every supported combination is backed by an index of the model.
+'''
+
+
+class Filter:
+    def __init__(self, param, lookup, field):
+        self.param = param
+        self.lookup = lookup
+        self.field = field
+
+    def apply(self, queryset, value):
+        return queryset.filter(**{self.lookup: value})
+
+
+class PrefixFilter(Filter):
+    """
+    Values starting with the given text. The range lets the database seek in a b-tree index on the column,
+    which plain LIKE 'text%' doesn't do on every backend; startswith keeps the exact meaning under any collation.
+    """
+
+    def apply(self, queryset, value):
+        lookups = {self.lookup + '__startswith': value}
+        code = ord(value[-1]) + 1
+        if code == 0xD800:
+            code = 0xE000  # surrogates can't be encoded, the first character after them bounds the range
+        # The highest code point has no successor, such values are filtered by startswith alone
+        if code <= sys.maxunicode:
+            lookups.update({self.lookup + '__gte': value, self.lookup + '__lt': value[:-1] + chr(code)})
+        return queryset.filter(**lookups)
+
+
+def decimal_field():
+    return serializers.DecimalField(max_digits=None, decimal_places=None)
+
+
+def datetime_field():
+    """ISO 8601 datetime or a date, which means its midnight."""
+    return serializers.DateTimeField(input_formats=['iso-8601', '%Y-%m-%d'])
+
+
+def apply_filters(queryset, query_params, filters):
+    """Filter queryset by every filter present in query params, errors of all params are raised together."""
+    errors = {}
+    for query_filter in filters:
+        if query_filter.param not in query_params:
+            continue
+        try:
+            value = query_filter.field.run_validation(query_params[query_filter.param])
+        except ValidationError as exc:
+            errors[query_filter.param] = exc.detail
+        else:
+            queryset = query_filter.apply(queryset, value)
+    if errors:
+        raise ValidationError(errors)
+    return queryset
+
+
+class QueryParamFilterBackend(BaseFilterBackend):
+    """Filters declared in view's 'filters'."""
+
+    def filter_queryset(self, request, queryset, view):
+        return apply_filters(queryset, request.query_params, getattr(view, 'filters', ()))
@@ -0,0 +1,137 @@
+import functools
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from restapi.models import IdempotencyKey
+
+'''
+Idempotency-Key header for creating endpoints: the first response to a key is stored per user and returned again to
+retries with the same key, without running validation or writes again. A retry arriving while the first request is
+still processed waits for its response. Keys expire after IDEMPOTENCY_KEY_TTL seconds.
+'''
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05
+
+
+class KeyInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is still being processed, try again later.'
+    default_code = 'idempotency_key_in_progress'
+
+
+class KeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used for a different request.'
+    default_code = 'idempotency_key_reused'
+
+
+def get_ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 3600))
+
+
+def fingerprint(request):
+    return hashlib.sha256(b'\n'.join([request.method.encode(), request.path.encode(), request.body])).hexdigest()
+
+
+def purge_expired():
+    """Delete expired keys, return their number."""
+    return IdempotencyKey.objects.filter(created_at__lt=timezone.now() - get_ttl()).delete()[0]
+
+
+def claim(user_id, key, request_fingerprint):
+    """
+    Record of the key, and whether it was created for this request (which must store the response). Takes the id of
+    the user, request.user of stateless token authentication is no model instance.
+    """
+    now = timezone.now()
+    # Expired keys, and keys of requests which never finished (e.g. a killed worker), are free again
+    lock_timeout = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 60))
+    abandoned = Q(created_at__lt=now - get_ttl()) | Q(status_code=None, created_at__lt=now - lock_timeout)
+    IdempotencyKey.objects.filter(abandoned, user_id=user_id, key=key).delete()
+    while True:
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(user_id=user_id, key=key, fingerprint=request_fingerprint,
+                                                     created_at=now), True
+        except IntegrityError:
+            try:
+                return IdempotencyKey.objects.get(user_id=user_id, key=key), False
+            except IdempotencyKey.DoesNotExist:
+                # Released by a failed first request in the meantime
+                continue
+
+
+def wait_for_response(record):
+    """Record with the stored response, waiting for the first request up to IDEMPOTENCY_WAIT_TIMEOUT seconds."""
+    deadline = time.monotonic() + getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 10)
+    while record.status_code is None:
+        if time.monotonic() >= deadline:
+            raise KeyInProgress()
+        time.sleep(POLL_INTERVAL)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+        if record is None:
+            # First request failed without a response worth replaying, this one may run
+            raise KeyInProgress()
+    return record
+
+
+def replay(record):
+    response = Response(json.loads(record.response) if record.response else None, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def is_stored(response):
+    """Server errors and conflicts may succeed when retried, so they are not replayed."""
+    return response.status_code < 500 and response.status_code != status.HTTP_409_CONFLICT
+
+
+def idempotent(method):
+    """Make a view method idempotent for requests sent with Idempotency-Key header."""
+
+    @functools.wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if key is None:
+            return method(view, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise ValidationError({'Idempotency-Key': ['Expected 1 to {} characters.'.format(MAX_KEY_LENGTH)]})
+        request_fingerprint = fingerprint(request)
+        record, created = claim(request.user.id, key, request_fingerprint)
+        if not created:
+            if record.fingerprint != request_fingerprint:
+                raise KeyReused()
+            return replay(wait_for_response(record))
+        try:
+            # The response is stored in the transaction of the writes, so a created order always has it
+            with transaction.atomic():
+                try:
+                    response = method(view, request, *args, **kwargs)
+                except APIException as exc:
+                    # Validation errors are replayed too
+                    response = view.handle_exception(exc)
+                if is_stored(response):
+                    body = json.dumps(response.data, cls=JSONEncoder) if response.data is not None else ''
+                    IdempotencyKey.objects.filter(pk=record.pk).update(status_code=response.status_code,
+                                                                       response=body)
+        except Exception:
+            record.delete()
+            raise
+        if not is_stored(response):
+            record.delete()
+        return response
+
+    return wrapper
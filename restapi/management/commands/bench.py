@@ -0,0 +1,300 @@
+import json
+import math
+import time
+import tracemalloc
+from collections import OrderedDict
+from itertools import repeat
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from restapi import cache as catalog_cache
+from restapi import sales
+from restapi.authentication import RoleTokenObtainPairSerializer
+from restapi.factories import DEFAULT_PASSWORD, SupplierFactory, ProductFactory, bulk_create, bulk_orders, seed_dataset
+from restapi.models import Supplier, Product, Order, ProductsInOrders, User
+from restapi.roles import CUSTOMER, EMPLOYEE
+
+'''
+Benchmark of every API route: a dataset is seeded into the configured database, every endpoint is requested in-process
+with real JWTs and the database changes are rolled back at the end. Results are written as JSON and compared with
+a stored baseline, so a slower endpoint or one doing more queries fails the command.
+'''
+
+PREFIX = 'Bench '
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values."""
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Seed a dataset, benchmark every API endpoint and compare results with a baseline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the generated dataset.')
+        parser.add_argument('--suppliers', type=int, default=50)
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--customers', type=int, default=20)
+        parser.add_argument('--orders', type=int, default=1000, help='Number of orders, spread over customers.')
+        parser.add_argument('--lines', type=int, default=5, help='Number of items in every order.')
+        parser.add_argument('--requests', type=int, default=200, help='Number of timed requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=10, help='Number of untimed requests per endpoint.')
+        parser.add_argument('--endpoint', action='append', help='Run only endpoints with this name (repeatable).')
+        parser.add_argument('--output', help='Write results as JSON to this file.')
+        parser.add_argument('--baseline', help='JSON file of earlier results to compare with.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative change of latency, requests/sec and memory (default 0.25).')
+
+    # Dataset
+
+    def seed(self, options):
+        pks = seed_dataset(options['seed'], options['suppliers'], options['products'], options['customers'], 1,
+                           options['orders'], options['lines'])
+        self.employee = User.objects.get(pk=pks['employees'][0])
+        self.customers = list(User.objects.filter(pk__in=pks['customers']).order_by('pk'))
+        self.suppliers = list(Supplier.objects.filter(pk__in=pks['suppliers']).order_by('pk'))
+        self.products = list(Product.objects.filter(pk__in=pks['products']).order_by('pk'))
+        self.lines = min(options['lines'], len(self.products))
+
+    def create_orders(self, users, count, lines):
+        pks = bulk_orders([user.pk for user in users], count, [product.pk for product in self.products], lines)
+        return [Order(pk=pk) for pk in pks]
+
+    def create_suppliers(self, count):
+        """Suppliers without products, which can be deleted."""
+        return [Supplier(pk=pk) for pk in bulk_create(SupplierFactory, repeat({}, count))]
+
+    def create_products(self, count):
+        """Products not in any order, which can be deleted."""
+        return [Product(pk=pk) for pk in bulk_create(ProductFactory, repeat({}, count), pr_sup=self.suppliers[0])]
+
+    # Endpoints
+
+    def endpoints(self):
+        """(name, method, role, function returning (url, data) of n requests) of every route in project/urls.py."""
+        customer, products, lines = self.customers[0], self.products, self.lines
+        own_orders = list(Order.objects.filter(or_username=customer).order_by('pk'))
+        supplier_data = {'sup_status': 'Active', 'sup_email': 'bench@example.com', 'sup_phone_number': 500000000,
+                         'sup_postal_code': '00-001', 'sup_city': 'Warsaw', 'sup_address': 'Bench street'}
+        product = products[0]
+        dimensions = list(sales.DIMENSIONS)
+
+        def cycle(items, n):
+            return [items[i % len(items)] for i in range(n)]
+
+        def order_items(n):
+            orders = self.create_orders([customer], n, 0)
+            return [(reverse('order-item', args=[order.pk]), {'pr_id': product.pk, 'amount': 2}) for order in orders]
+
+        def order_items_bulk(n):
+            orders = self.create_orders([customer], n, 0)
+            data = [{'pr_id': item.pk, 'amount': 2} for item in products[:lines]]
+            return [(reverse('order-item', args=[order.pk]), data) for order in orders]
+
+        def order_lines(orders, **fields):
+            data = OrderedDict((order.pk, []) for order in orders)
+            for order_id, product_id in ProductsInOrders.objects.filter(or_id__in=orders).order_by(
+                    'pk').values_list('or_id', 'pr_id'):
+                data[order_id].append(dict(fields, pr_id=product_id))
+            return [(reverse('order-item', args=[order_id]), lines) for order_id, lines in data.items()]
+
+        def item_detail(n, new_orders):
+            if new_orders:
+                items = ProductsInOrders.objects.filter(or_id__in=self.create_orders([customer], n, 1))
+            else:
+                items = cycle(ProductsInOrders.objects.filter(or_id__in=own_orders).order_by('pk'), n)
+            return [(reverse('order-item-detail', args=[item.or_id_id, item.pk]), {'amount': i % 7 + 1})
+                    for i, item in enumerate(items)]
+
+        return [
+            ('index', 'get', None, lambda n: [(reverse('index'), None)] * n),
+            ('token', 'post', None,
+             lambda n: [(reverse('token'), {'username': customer.username, 'password': DEFAULT_PASSWORD})] * n),
+            # Refresh tokens are rotated and blacklisted, so every request needs a new one
+            ('refresh-token', 'post', None,
+             lambda n: [(reverse('refresh-token'), {'refresh': str(RoleTokenObtainPairSerializer.get_token(customer))})
+                        for _ in range(n)]),
+            ('db-pool', 'get', EMPLOYEE, lambda n: [(reverse('db-pool'), None)] * n),
+            ('metrics', 'get', EMPLOYEE, lambda n: [(reverse('metrics'), None)] * n),
+            ('token-blacklist', 'get', EMPLOYEE, lambda n: [(reverse('token-blacklist'), None)] * n),
+            ('supplier-list', 'get', EMPLOYEE, lambda n: [(reverse('supplier-list'), None)] * n),
+            ('supplier-list-stream', 'get', EMPLOYEE, lambda n: [(reverse('supplier-list') + '?stream=1', None)] * n),
+            ('supplier-detail', 'get', EMPLOYEE,
+             lambda n: [(reverse('supplier-detail', args=[item.pk]), None) for item in cycle(self.suppliers, n)]),
+            ('product-list', 'get', CUSTOMER, lambda n: [(reverse('product-list'), None)] * n),
+            ('product-detail', 'get', CUSTOMER,
+             lambda n: [(reverse('product-detail', args=[item.pk]), None) for item in cycle(products, n)]),
+            ('product-stock', 'get', CUSTOMER,
+             lambda n: [(reverse('product-stock', args=[item.pk]), None) for item in cycle(products, n)]),
+            ('product-search', 'get', CUSTOMER,
+             lambda n: [(reverse('product-search') + '?q=product{}'.format(i % 100), None) for i in range(n)]),
+            ('sales-report', 'get', EMPLOYEE,
+             lambda n: [(reverse('sales-report', args=[dimension]), None) for dimension in cycle(dimensions, n)]),
+            ('order-list', 'get', CUSTOMER, lambda n: [(reverse('order-list'), None)] * n),
+            ('order-list-employee', 'get', EMPLOYEE,
+             lambda n: [(reverse('order-list') + '?ordering=-or_total_price', None)] * n),
+            ('order-detail', 'get', CUSTOMER,
+             lambda n: [(reverse('order-detail', args=[order.pk]), None) for order in cycle(own_orders, n)]),
+            ('supplier-create', 'post', EMPLOYEE,
+             lambda n: [(reverse('supplier-list'), dict(supplier_data, sup_name=PREFIX + 'new supplier {}'.format(i)))
+                        for i in range(n)]),
+            ('supplier-update', 'put', EMPLOYEE,
+             lambda n: [(reverse('supplier-detail', args=[item.pk]), dict(supplier_data, sup_name=item.sup_name))
+                        for item in cycle(self.suppliers, n)]),
+            ('supplier-delete', 'delete', EMPLOYEE,
+             lambda n: [(reverse('supplier-detail', args=[item.pk]), None) for item in self.create_suppliers(n)]),
+            ('product-create', 'post', EMPLOYEE,
+             lambda n: [(reverse('product-list'), {'pr_name': PREFIX + 'new product', 'pr_cat': Product.PIPES,
+                                                   'pr_price': '10.00', 'pr_sup': product.pr_sup_id})] * n),
+            ('product-update', 'put', EMPLOYEE,
+             lambda n: [(reverse('product-detail', args=[item.pk]),
+                         {'pr_name': item.pr_name, 'pr_cat': item.pr_cat, 'pr_price': str(item.pr_price + i % 2),
+                          'pr_sup': item.pr_sup_id}) for i, item in enumerate(cycle(products, n))]),
+            ('product-delete', 'delete', EMPLOYEE,
+             lambda n: [(reverse('product-detail', args=[item.pk]), None) for item in self.create_products(n)]),
+            ('product-stock-update', 'put', EMPLOYEE,
+             lambda n: [(reverse('product-stock', args=[item.pk]), {'quantity': 100000 + i})
+                        for i, item in enumerate(cycle(products, n))]),
+            ('order-create', 'post', CUSTOMER, lambda n: [(reverse('order-list'), {})] * n),
+            ('order-update', 'put', CUSTOMER,
+             lambda n: [(reverse('order-detail', args=[order.pk]), None)
+                        for order in self.create_orders([customer], n, lines)]),
+            ('order-delete', 'delete', CUSTOMER,
+             lambda n: [(reverse('order-detail', args=[order.pk]), None)
+                        for order in self.create_orders([customer], n, 0)]),
+            ('order-item-create', 'post', CUSTOMER, order_items),
+            ('order-item-create-bulk', 'post', CUSTOMER, order_items_bulk),
+            ('order-item-update-bulk', 'patch', CUSTOMER, lambda n: cycle(order_lines(own_orders, amount=3), n)),
+            ('order-item-delete-bulk', 'delete', CUSTOMER,
+             lambda n: order_lines(self.create_orders([customer], n, lines))),
+            ('order-item-update', 'put', CUSTOMER, lambda n: item_detail(n, new_orders=False)),
+            ('order-item-delete', 'delete', CUSTOMER, lambda n: item_detail(n, new_orders=True)),
+            # Last, the order item endpoints above reserve stock set by product-stock-update
+            ('product-stock-delete', 'delete', EMPLOYEE,
+             lambda n: [(reverse('product-stock', args=[item.pk]), None) for item in cycle(products, n)]),
+        ]
+
+    # Measurement
+
+    def request(self, client, method, url, data, header):
+        kwargs = {'HTTP_AUTHORIZATION': header} if header else {}
+        if data is not None:
+            kwargs.update(data=data, format='json')
+        response = getattr(client, method)(url, **kwargs)
+        if response.status_code >= 400:
+            raise CommandError('{} {} returned {}: {}'.format(method.upper(), url, response.status_code,
+                                                              getattr(response, 'data', '')))
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def measure(self, client, method, requests, header, warmup):
+        """Latencies, SQL queries and time of timed requests; peak memory of the last request."""
+        sql = {'queries': 0, 'time': 0.0}
+
+        def count_query(execute, query, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(query, params, many, context)
+            finally:
+                sql['queries'] += 1
+                sql['time'] += time.perf_counter() - start
+
+        for url, data in requests[:warmup]:
+            self.request(client, method, url, data, header)
+        latencies = []
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            for url, data in requests[warmup:-1]:
+                start = time.perf_counter()
+                self.request(client, method, url, data, header)
+                latencies.append(time.perf_counter() - start)
+        elapsed = time.perf_counter() - started
+
+        url, data = requests[-1]
+        tracemalloc.start()
+        try:
+            self.request(client, method, url, data, header)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        latencies.sort()
+        count = len(latencies)
+        return OrderedDict([
+            ('p50_ms', round(percentile(latencies, 50) * 1000, 3)),
+            ('p95_ms', round(percentile(latencies, 95) * 1000, 3)),
+            ('p99_ms', round(percentile(latencies, 99) * 1000, 3)),
+            ('rps', round(count / elapsed, 1)),
+            ('queries', round(sql['queries'] / count, 2)),
+            ('sql_ms', round(sql['time'] * 1000 / count, 3)),
+            ('peak_kb', round(peak / 1024, 1)),
+        ])
+
+    def compare(self, results, baseline, tolerance):
+        """Lines describing regressions of results against baseline."""
+        regressions = []
+        for name, result in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            checks = (('p95_ms', result['p95_ms'] > base['p95_ms'] * (1 + tolerance)),
+                      ('rps', result['rps'] < base['rps'] * (1 - tolerance)),
+                      ('queries', result['queries'] > base['queries']),
+                      ('peak_kb', result['peak_kb'] > base['peak_kb'] * (1 + tolerance)))
+            for metric, failed in checks:
+                if failed:
+                    regressions.append('{}: {} {} -> {}'.format(name, metric, base[metric], result[metric]))
+        for name in baseline:
+            if name not in results and not self.selected:
+                self.stderr.write('{}: not run, skipped in comparison'.format(name))
+        return regressions
+
+    # Requests of one user would be throttled
+    @override_settings(THROTTLE_ENABLED=False)
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be at least 1.')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)['endpoints']
+
+        results, self.selected = OrderedDict(), options['endpoint']
+        with transaction.atomic():
+            self.seed(options)
+            # Catalog entries cached by an earlier run belong to rolled back rows
+            catalog_cache.bump_version()
+            client = APIClient()
+            tokens = {}
+            for role, user in ((CUSTOMER, self.customers[0]), (EMPLOYEE, self.employee)):
+                response = client.post(reverse('token'), {'username': user.username, 'password': DEFAULT_PASSWORD})
+                tokens[role] = 'Bearer ' + response.data['access']
+
+            self.stdout.write('{:<24} {:>9} {:>9} {:>9} {:>9} {:>8} {:>8} {:>9}'.format(
+                'endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries', 'sql ms', 'peak kB'))
+            count = options['warmup'] + options['requests'] + 1
+            for name, method, role, requests in self.endpoints():
+                if self.selected and name not in self.selected:
+                    continue
+                result = self.measure(client, method, requests(count), tokens.get(role), options['warmup'])
+                results[name] = result
+                self.stdout.write('{:<24} {:>9} {:>9} {:>9} {:>9} {:>8} {:>8} {:>9}'.format(name, *result.values()))
+            transaction.set_rollback(True)
+
+        if options['output']:
+            dataset = {key: options[key] for key in ('seed', 'suppliers', 'products', 'customers', 'orders', 'lines',
+                                                     'requests', 'warmup')}
+            with open(options['output'], 'w') as file:
+                json.dump({'dataset': dataset, 'endpoints': results}, file, indent=2)
+        if baseline is not None:
+            regressions = self.compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('{} regression(s) against {}:\n{}'.format(
+                    len(regressions), options['baseline'], '\n'.join(regressions)))
+            self.stdout.write('No regressions against {}.'.format(options['baseline']))
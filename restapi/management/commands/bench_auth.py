@@ -0,0 +1,52 @@
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from restapi.authentication import RoleTokenAuthentication
+
+
+class Command(BaseCommand):
+    help = 'Compare requests/sec of database-backed and token-claims JWT authentication on one endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('password')
+        parser.add_argument('--url', default='/api/orders', help='Endpoint requested with GET.')
+        parser.add_argument('--requests', type=int, default=500, help='Number of timed requests per authenticator.')
+
+    def run(self, client, url, header, count):
+        queries = []
+
+        def count_query(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        client.get(url, HTTP_AUTHORIZATION=header)
+        with connection.execute_wrapper(count_query):
+            response = client.get(url, HTTP_AUTHORIZATION=header)
+        if response.status_code != 200:
+            raise CommandError('GET {} returned {}'.format(url, response.status_code))
+        start = time.perf_counter()
+        for _ in range(count):
+            client.get(url, HTTP_AUTHORIZATION=header)
+        return count / (time.perf_counter() - start), len(queries)
+
+    # Requests of one user would be throttled
+    @override_settings(THROTTLE_ENABLED=False)
+    def handle(self, *args, **options):
+        client = APIClient()
+        response = client.post(reverse('token'), {'username': options['username'], 'password': options['password']})
+        if response.status_code != 200:
+            raise CommandError('Cannot obtain a token: {}'.format(response.data))
+        header = 'Bearer ' + response.data['access']
+        for name, authentication in (('database', JWTAuthentication), ('token claims', RoleTokenAuthentication)):
+            with mock.patch.object(APIView, 'authentication_classes', [authentication]):
+                rps, queries = self.run(client, options['url'], header, options['requests'])
+            self.stdout.write('{:<14} {:>9.1f} req/s {:>4} queries/request'.format(name, rps, queries))
@@ -0,0 +1,113 @@
+import io
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from restapi.db import pool as db_pool
+from restapi.management.commands.bench import percentile
+
+POOLED_ENGINES = {'django.db.backends.postgresql': 'restapi.db.backends.postgresql',
+                  'django.db.backends.sqlite3': 'restapi.db.backends.sqlite3'}
+
+
+class Command(BaseCommand):
+    help = ('Compare latency of requests opening a new database connection, keeping one per thread and taking one '
+            'from the pool. Requests go through the whole WSGI request cycle, which closes connections.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('password')
+        parser.add_argument('--url', default='/api/orders', help='Endpoint requested with GET.')
+        parser.add_argument('--requests', type=int, default=500, help='Number of timed requests per mode.')
+        parser.add_argument('--threads', type=int, default=4, help='Number of concurrent client threads.')
+        parser.add_argument('--pool-size', type=int, default=2, help='Pool size, less than threads shows waiting.')
+
+    def environ(self, url, header):
+        parts = urlsplit(url)
+        return {'REQUEST_METHOD': 'GET', 'PATH_INFO': parts.path, 'QUERY_STRING': parts.query, 'SCRIPT_NAME': '',
+                'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': 'testserver', 'HTTP_AUTHORIZATION': header, 'wsgi.version': (1, 0),
+                'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+                'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False}
+
+    def request(self, handler, url, header):
+        statuses = []
+        response = handler(self.environ(url, header), lambda status, headers: statuses.append(status))
+        try:
+            b''.join(response)
+        finally:
+            # Sends request_finished, which closes (or gives back) the database connection
+            response.close()
+        if not statuses[0].startswith('200'):
+            raise CommandError('GET {} returned {}'.format(url, statuses[0]))
+
+    def run(self, engine, max_age, options, header):
+        settings_dict = connections.databases[DEFAULT_DB_ALIAS]
+        saved = dict(settings_dict)
+        # Connection wrappers are created per thread from these settings, so new threads use the mode
+        settings_dict.update(ENGINE=engine, CONN_MAX_AGE=max_age,
+                             POOL=dict(settings_dict.get('POOL', {}), MAX_SIZE=options['pool_size']))
+        handler = WSGIHandler()
+        latencies, errors, lock = [], [], threading.Lock()
+        per_thread = max(1, options['requests'] // options['threads'])
+
+        def work():
+            timed = []
+            try:
+                self.request(handler, options['url'], header)
+                for _ in range(per_thread):
+                    start = time.perf_counter()
+                    self.request(handler, options['url'], header)
+                    timed.append(time.perf_counter() - start)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+                with lock:
+                    latencies.extend(timed)
+
+        threads = [threading.Thread(target=work) for _ in range(options['threads'])]
+        try:
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            settings_dict.clear()
+            settings_dict.update(saved)
+        if errors:
+            raise CommandError(errors[0])
+        latencies.sort()
+        return percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000, len(latencies) / elapsed
+
+    # Requests of one user would be throttled
+    @override_settings(THROTTLE_ENABLED=False)
+    def handle(self, *args, **options):
+        client = APIClient()
+        response = client.post(reverse('token'), {'username': options['username'], 'password': options['password']})
+        if response.status_code != 200:
+            raise CommandError('Cannot obtain a token: {}'.format(response.data))
+        header = 'Bearer ' + response.data['access']
+
+        engine = connections.databases[DEFAULT_DB_ALIAS]['ENGINE']
+        engine = {pooled: base for base, pooled in POOLED_ENGINES.items()}.get(engine, engine)
+        if engine not in POOLED_ENGINES:
+            raise CommandError('No pooled backend for {}.'.format(engine))
+        modes = (('new connection', engine, 0), ('persistent', engine, None), ('pooled', POOLED_ENGINES[engine], 0))
+        self.stdout.write('{:<16} {:>9} {:>9} {:>9}'.format('mode', 'p50 ms', 'p95 ms', 'req/s'))
+        for name, mode_engine, max_age in modes:
+            result = self.run(mode_engine, max_age, options, header)
+            self.stdout.write('{:<16} {:>9.3f} {:>9.3f} {:>9.1f}'.format(name, *result))
+        stats = db_pool.stats().get(DEFAULT_DB_ALIAS, {})
+        self.stdout.write('pool: ' + ', '.join('{} {}'.format(key, value) for key, value in stats.items()))
+        db_pool.get_pool(DEFAULT_DB_ALIAS, {}).close_all()
@@ -0,0 +1,60 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from restapi.compiled import compile_serializer
+from restapi.models import Supplier, Product, Order, ProductsInOrders, User
+from restapi.serializers import SupplierSerializer, ProductSerializer, OrderSerializer, OrderGetSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare rows/sec of ModelSerializers and compiled serializers on temporary rows (rolled back).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Number of suppliers, products and orders.')
+        parser.add_argument('--items', type=int, default=3, help='Number of items in every order.')
+
+    def seed(self, rows, items):
+        Supplier.objects.bulk_create(
+            [Supplier(sup_name='Bench supplier {}'.format(n), sup_email='bench{}@example.com'.format(n),
+                      sup_phone_number=500000000 + n, sup_postal_code='00-001', sup_city='Warsaw',
+                      sup_address='Bench street {}'.format(n)) for n in range(rows)], batch_size=500)
+        suppliers = list(Supplier.objects.filter(sup_name__startswith='Bench supplier '))
+        Product.objects.bulk_create(
+            [Product(pr_name='Bench product {}'.format(n), pr_cat=Product.PIPES, pr_price=Decimal(n % 1000) + 1,
+                     pr_sup=suppliers[n]) for n in range(rows)], batch_size=500)
+        products = list(Product.objects.filter(pr_name__startswith='Bench product '))
+        user = User.objects.create(username='bench-serializers')
+        Order.objects.bulk_create([Order(or_username=user) for _ in range(rows)], batch_size=500)
+        orders = list(Order.objects.filter(or_username=user))
+        ProductsInOrders.objects.bulk_create(
+            [ProductsInOrders(or_id=order, pr_id=products[(n + i) % rows], amount=i + 1)
+             for n, order in enumerate(orders) for i in range(items)], batch_size=500)
+
+    def measure(self, render):
+        start = time.perf_counter()
+        content = JSONRenderer().render(render())
+        return time.perf_counter() - start, content
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with transaction.atomic():
+            self.seed(rows, min(options['items'], rows))
+            cases = ((SupplierSerializer, Supplier.objects.order_by('pk')[:rows]),
+                     (ProductSerializer, Product.objects.order_by('pk')[:rows]),
+                     (OrderSerializer, Order.objects.order_by('pk')[:rows]),
+                     (OrderGetSerializer, Order.objects.prefetch_related('items_in_order__pr_id').order_by('pk')[:rows]))
+            self.stdout.write('{:<20} {:>14} {:>14} {:>8}'.format('serializer', 'model rows/s', 'compiled rows/s',
+                                                                  'speedup'))
+            for serializer_class, queryset in cases:
+                model_time, expected = self.measure(lambda: serializer_class(queryset, many=True).data)
+                compiled_time, content = self.measure(lambda: compile_serializer(serializer_class).serialize(
+                    queryset.model.objects.order_by('pk')[:rows]))
+                if content != expected:
+                    raise CommandError('{} output differs from compiled output.'.format(serializer_class.__name__))
+                self.stdout.write('{:<20} {:>14.0f} {:>14.0f} {:>7.1f}x'.format(
+                    serializer_class.__name__, rows / model_time, rows / compiled_time, model_time / compiled_time))
+            transaction.set_rollback(True)
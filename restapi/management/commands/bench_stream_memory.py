@@ -0,0 +1,47 @@
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from restapi.models import Supplier
+from restapi.serializers import SupplierSerializer
+from restapi.streaming import stream_list
+
+
+class Command(BaseCommand):
+    help = 'Compare peak memory of rendering a whole supplier list at once and streaming it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 50000],
+                            help='Numbers of suppliers to render; rows are inserted temporarily and rolled back.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def measure(self, render):
+        tracemalloc.start()
+        try:
+            render()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def render_at_once(self, queryset):
+        return len(JSONRenderer().render(SupplierSerializer(queryset, many=True).data))
+
+    def render_streaming(self, queryset, chunk_size):
+        return sum(len(chunk) for chunk in stream_list(queryset, SupplierSerializer, chunk_size).streaming_content)
+
+    def handle(self, *args, **options):
+        self.stdout.write('{:>8} {:>16} {:>16}'.format('rows', 'at once [MB]', 'streamed [MB]'))
+        for rows in options['rows']:
+            with transaction.atomic():
+                Supplier.objects.bulk_create(
+                    (Supplier(sup_name='Bench supplier {}'.format(n), sup_email='bench{}@example.com'.format(n),
+                              sup_phone_number=500000000 + n, sup_postal_code='00-001', sup_city='Warsaw',
+                              sup_address='Bench street {}'.format(n)) for n in range(rows)),
+                    batch_size=500)
+                queryset = Supplier.objects.order_by('pk')
+                at_once = self.measure(lambda: self.render_at_once(queryset))
+                streamed = self.measure(lambda: self.render_streaming(queryset, options['chunk_size']))
+                self.stdout.write('{:>8} {:>16.1f} {:>16.1f}'.format(rows, at_once / 2 ** 20, streamed / 2 ** 20))
+                transaction.set_rollback(True)
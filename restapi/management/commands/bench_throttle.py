@@ -0,0 +1,52 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework.exceptions import Throttled
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from restapi.models import User
+from restapi.roles import CUSTOMER
+
+
+class Command(BaseCommand):
+    help = ('Measure time the throttles add to a request (both user and IP buckets, cache of THROTTLE_CACHE_ALIAS), '
+            'for allowed and for throttled requests. Fails when an allowed request costs more than --max-us.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000)
+        parser.add_argument('--max-us', type=float, default=100, help='Bound of overhead per allowed request.')
+
+    def run(self, rates, count):
+        """Microseconds per throttle check of a request of a customer."""
+        view_class = type('BenchView', (APIView,), {'throttle_rates': rates,
+                                                     'throttle_scope': 'bench-{}'.format(uuid.uuid4().hex)})
+        user = User(pk=1, username='bench')
+        user._role_names = frozenset([CUSTOMER])
+        request = Request(APIRequestFactory().get('/api/orders'))
+        request.user = user
+        view = view_class()
+        start = time.perf_counter()
+        for _ in range(count):
+            try:
+                view.check_throttles(request)
+            except Throttled:
+                pass
+        return (time.perf_counter() - start) / count * 1e6
+
+    @override_settings(THROTTLE_ENABLED=True)
+    def handle(self, *args, **options):
+        count = options['requests']
+        modes = (('no limits', {}),
+                 ('allowed', {'customer': '{}/s'.format(count), 'ip': '{}/s'.format(count)}),
+                 ('throttled', {'customer': '1/d', 'ip': '1/d'}))
+        results = {name: self.run(rates, count) for name, rates in modes}
+        for name, us in results.items():
+            self.stdout.write('{:<10} {:>8.2f} us/request'.format(name, us))
+        overhead = results['allowed'] - results['no limits']
+        self.stdout.write('overhead of an allowed request: {:.2f} us (bound {} us)'.format(overhead, options['max_us']))
+        if overhead > options['max_us']:
+            raise CommandError('Throttle overhead {:.2f} us exceeds {} us.'.format(overhead, options['max_us']))
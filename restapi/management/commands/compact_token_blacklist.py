@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from restapi import blacklist
+
+
+class Command(BaseCommand):
+    help = ('Delete expired outstanding and blacklisted refresh tokens in batches, each in a short transaction. '
+            'Run it periodically, e.g. hourly from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Tokens deleted per transaction.')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        deleted = blacklist.compact(options['batch_size'], options['pause'])
+        self.stdout.write(self.style.SUCCESS('{} expired tokens deleted in {:.1f} s.'.format(
+            deleted, time.perf_counter() - start)))
+        stats = blacklist.stats()
+        self.stdout.write('outstanding {outstanding_tokens}, blacklisted {blacklisted_tokens}'.format(**stats))
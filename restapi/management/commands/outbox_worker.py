@@ -0,0 +1,59 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from restapi import outbox
+
+
+def work_in_pool(batch_size, poll_interval, once):
+    """Outbox worker in a thread or process of the pool, which has its own database connections."""
+    try:
+        return outbox.work(batch_size, poll_interval, once)
+    finally:
+        connections.close_all()
+
+
+def share_stopping(stopping):
+    """Initializer of worker processes: stop when the parent sets 'stopping', not only on a SIGINT of their own."""
+    outbox.stopping = stopping
+
+
+class Command(BaseCommand):
+    help = ('Handle events of the outbox (restapi.outbox) with a pool of workers, each claiming its own batches. '
+            'Threads suit handlers waiting for I/O, processes CPU-bound ones. Stop it with Ctrl+C or SIGINT.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Size of the pool, 1 runs in this process.')
+        parser.add_argument('--mode', choices=['thread', 'process'], default='thread')
+        parser.add_argument('--batch-size', type=int, help='Events claimed at once, OUTBOX_BATCH_SIZE by default.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait for new events when there are none.')
+        parser.add_argument('--once', action='store_true', help='Exit when no event is available.')
+
+    def handle(self, *args, **options):
+        arguments = options['batch_size'], options['poll_interval'], options['once']
+        if options['workers'] == 1:
+            results = [outbox.work(*arguments)]
+        else:
+            # Forked processes must not share connections of this one
+            connections.close_all()
+            stopping = outbox.stopping
+            if options['mode'] == 'thread':
+                executor = ThreadPoolExecutor(max_workers=options['workers'])
+            else:
+                # The flag of this process is not seen by the workers, e.g. when only this one was sent SIGINT
+                stopping = multiprocessing.Event()
+                executor = ProcessPoolExecutor(max_workers=options['workers'], initializer=share_stopping,
+                                               initargs=[stopping])
+            with executor as pool:
+                futures = [pool.submit(work_in_pool, *arguments) for _ in range(options['workers'])]
+                try:
+                    results = [future.result() for future in futures]
+                except KeyboardInterrupt:
+                    stopping.set()
+                    results = [future.result() for future in futures]
+        handled, failed = map(sum, zip(*results))
+        self.stdout.write('{} events handled, {} failed attempts. Outbox: {pending} pending ({available} available), '
+                          '{failed} failed.'.format(handled, failed, **outbox.stats()))
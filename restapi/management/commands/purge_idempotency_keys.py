@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from restapi import idempotency
+
+
+class Command(BaseCommand):
+    help = 'Delete stored responses of Idempotency-Key requests older than IDEMPOTENCY_KEY_TTL, run it periodically.'
+
+    def handle(self, *args, **options):
+        deleted = idempotency.purge_expired()
+        self.stdout.write(self.style.SUCCESS('{} expired idempotency keys deleted.'.format(deleted)))
@@ -0,0 +1,18 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from restapi import sales
+
+
+class Command(BaseCommand):
+    help = ('Recompute sales rollups from finished orders, of all days or of a range (YYYY-MM-DD, inclusive). '
+            'Orders finished while it runs may be miscounted, run it when few are or rebuild their days again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat)
+        parser.add_argument('--until', type=date.fromisoformat)
+
+    def handle(self, *args, **options):
+        rows = sales.rebuild(options['since'], options['until'])
+        self.stdout.write(self.style.SUCCESS('{} sales rollup rows rebuilt.'.format(rows)))
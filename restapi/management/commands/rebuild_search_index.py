@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from restapi import cache as catalog_cache
+from restapi import search
+
+
+class Command(BaseCommand):
+    help = 'Recreate product search triggers and index every product again.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            search.install()
+            search.rebuild()
+            catalog_cache.bump_version()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt.'))
@@ -0,0 +1,40 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from restapi.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Verify stored order totals against order items and recompute the ones that differ.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report mismatching orders, exit with an error if any are found.')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Number of orders verified and updated per query.')
+
+    def find_mismatches(self, batch_size):
+        expected = Order.expected_totals()
+        orders = Order.objects.annotate(expected_total=expected['or_total_price'],
+                                        expected_count=expected['or_items_count'])
+        rows = orders.order_by('pk').values_list('pk', 'or_total_price', 'or_items_count', 'expected_total',
+                                                 'expected_count')
+        cent = Decimal('0.01')
+        for pk, total, count, expected_total, expected_count in rows.iterator(chunk_size=batch_size):
+            if Decimal(expected_total).quantize(cent) != total or expected_count != count:
+                yield pk
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        mismatches = list(self.find_mismatches(batch_size))
+        self.stdout.write('{} of {} orders have wrong totals.'.format(len(mismatches), Order.objects.count()))
+        if options['check']:
+            if mismatches:
+                raise CommandError('Order totals are out of date: {}'.format(mismatches[:20]))
+            return
+        for start in range(0, len(mismatches), batch_size):
+            with transaction.atomic():
+                Order.recalculate_totals(Order.objects.filter(pk__in=mismatches[start:start + batch_size]))
+        self.stdout.write(self.style.SUCCESS('Recalculated {} orders.'.format(len(mismatches))))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from restapi.factories import DEFAULT_PASSWORD, seed_dataset
+
+
+class Command(BaseCommand):
+    help = 'Insert a generated dataset with bulk queries; the same seed gives the same data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--suppliers', type=int, default=100)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--customers', type=int, default=100)
+        parser.add_argument('--employees', type=int, default=1)
+        parser.add_argument('--orders', type=int, default=10000)
+        parser.add_argument('--lines', type=int, default=5, help='Number of items in every order.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows inserted per query.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        pks = seed_dataset(options['seed'], options['suppliers'], options['products'], options['customers'],
+                           options['employees'], options['orders'], options['lines'], options['batch_size'])
+        for kind, keys in pks.items():
+            self.stdout.write('{:<10} {:>9}'.format(kind, len(keys)))
+        self.stdout.write('{:<10} {:>9}'.format('items', len(pks['orders']) * min(options['lines'],
+                                                                                   options['products'])))
+        self.stdout.write(self.style.SUCCESS('Seeded in {:.1f}s, password of every user: {}'.format(
+            time.perf_counter() - start, DEFAULT_PASSWORD)))
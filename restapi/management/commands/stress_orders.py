@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from restapi.management.commands.bench import percentile
+from restapi.models import Order, Product, ProductsInOrders, User
+
+'''
+Stress test of optimistic concurrency of orders: for every round an order is created, concurrent clients keep setting
+amounts of their own product in it while the order gets finished. Requests run through the whole request cycle with
+committed transactions, so the database sees real contention. Afterwards it is checked that no item was written after
+the order was finished, stored totals match the items and the last accepted amount of every client was kept.
+'''
+
+
+class Command(BaseCommand):
+    help = 'Change items of orders from concurrent threads while finishing them, check consistency, show throughput.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='User writing the orders, a customer or an employee.')
+        parser.add_argument('password')
+        parser.add_argument('--rounds', type=int, default=20, help='Number of orders.')
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent clients per order.')
+        parser.add_argument('--finish-after', type=float, default=0.05,
+                            help='Seconds of concurrent changes before the order is finished.')
+        parser.add_argument('--retries', type=int, default=5, help='Retries of a request answered with 409.')
+
+    def client(self, options):
+        client = APIClient()
+        response = client.post(reverse('token'), {'username': options['username'], 'password': options['password']})
+        if response.status_code != 200:
+            raise CommandError('Cannot obtain a token: {}'.format(response.data))
+        client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        return client
+
+    def send(self, request, retries):
+        """Response of the request retried on conflicts, latency of the last try and number of conflicts."""
+        for attempt in range(retries + 1):
+            start = time.perf_counter()
+            response = request()
+            latency = time.perf_counter() - start
+            if response.status_code != 409:
+                break
+        return response, latency, attempt + (response.status_code == 409)
+
+    def create_order(self, client):
+        response = client.post(reverse('order-list'), {'or_username': self.user.id})
+        if response.status_code != 201:
+            raise CommandError('Cannot create an order: {}'.format(response.data))
+        return response.data['or_id']
+
+    def round(self, client, or_id, products, clients, options):
+        url = reverse('order-item', args=[or_id])
+        counts = {'writes': 0, 'conflicts': 0, 'failed': 0, 'rejected': 0}
+        latencies, accepted, errors, lock = [], {}, [], threading.Lock()
+
+        def work(product, client):
+            amount = 0
+            try:
+                while True:
+                    amount += 1
+                    response, latency, conflicts = self.send(
+                        lambda: client.post(url, [{'pr_id': product.pr_id, 'amount': amount}], format='json'),
+                        options['retries'])
+                    with lock:
+                        counts['conflicts'] += conflicts
+                        if response.status_code == 201:
+                            counts['writes'] += 1
+                            latencies.append(latency)
+                            accepted[product.pr_id] = amount
+                        elif response.status_code == 409:
+                            counts['failed'] += 1
+                        elif response.status_code == 400:
+                            counts['rejected'] += 1
+                            return
+                        else:
+                            raise CommandError('POST {} returned {}'.format(url, response.status_code))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=work, args=args) for args in zip(products, clients)]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['finish_after'])
+        response, latency, conflicts = self.send(lambda: client.put(reverse('order-detail', args=[or_id])),
+                                                 options['retries'] * 10)
+        counts['conflicts'] += conflicts
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise CommandError(errors[0])
+        if response.status_code != 200:
+            raise CommandError('Finishing order {} returned {}'.format(or_id, response.status_code))
+        return counts, latencies, accepted
+
+    def violations(self, or_id, accepted):
+        order = Order.objects.annotate(**{'expected_' + name: expression for name, expression in
+                                          Order.expected_totals().items()}).get(pk=or_id)
+        items = ProductsInOrders.objects.filter(or_id=or_id)
+        found = []
+        late = items.filter(updated_at__gt=order.or_finish_date).count()
+        if late:
+            found.append('order {}: {} items changed after it was finished'.format(or_id, late))
+        if (order.or_total_price, order.or_items_count) != (order.expected_or_total_price,
+                                                            order.expected_or_items_count):
+            found.append('order {}: stored totals differ from items'.format(or_id))
+        amounts = dict(items.values_list('pr_id', 'amount'))
+        if amounts != accepted:
+            found.append('order {}: amounts {} differ from accepted {}'.format(or_id, amounts, accepted))
+        return found
+
+    # Requests of one user would be throttled
+    @override_settings(THROTTLE_ENABLED=False)
+    def handle(self, *args, **options):
+        client = self.client(options)
+        self.user = User.objects.get(username=options['username'])
+        products = list(Product.objects.order_by('pk')[:options['threads']])
+        if len(products) < options['threads']:
+            raise CommandError('At least {} products are needed.'.format(options['threads']))
+        clients = [self.client(options) for _ in products]
+        # Orders rejected as finished are expected, don't log every one
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+
+        totals = {'writes': 0, 'conflicts': 0, 'failed': 0, 'rejected': 0}
+        latencies, violations, orders = [], [], []
+        started = time.perf_counter()
+        try:
+            for _ in range(options['rounds']):
+                orders.append(self.create_order(client))
+                counts, round_latencies, accepted = self.round(client, orders[-1], products, clients, options)
+                for name, count in counts.items():
+                    totals[name] += count
+                latencies.extend(round_latencies)
+                violations.extend(self.violations(orders[-1], accepted))
+            elapsed = time.perf_counter() - started
+        finally:
+            ProductsInOrders.objects.filter(or_id__in=orders).delete()
+            Order.objects.filter(pk__in=orders).delete()
+
+        latencies.sort()
+        self.stdout.write('rounds {}, threads {}, accepted writes {} ({:.1f}/s), conflicts {}, failed after retries {}, '
+                          'rejected as finished {}'.format(options['rounds'], options['threads'], totals['writes'],
+                                                           totals['writes'] / elapsed, totals['conflicts'],
+                                                           totals['failed'], totals['rejected']))
+        if latencies:
+            self.stdout.write('write p50 {:.3f} ms, p95 {:.3f} ms'.format(percentile(latencies, 50) * 1000,
+                                                                          percentile(latencies, 95) * 1000))
+        if violations:
+            raise CommandError('\n'.join(violations))
+        self.stdout.write('No consistency violations.')
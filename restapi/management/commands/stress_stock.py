@@ -0,0 +1,146 @@
+import logging
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Sum
+from django.test.utils import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from restapi import stock
+from restapi.management.commands.bench import percentile
+from restapi.models import Order, Product, ProductsInOrders, User
+
+'''
+Stress test of stock reservations: concurrent clients keep ordering one product, each in orders of their own, and
+sometimes remove the line again, until the stock runs out. Afterwards it is checked that units in order lines and
+units left in stock add up to the initial stock, none is negative and every accepted line was kept.
+'''
+
+
+class Command(BaseCommand):
+    help = 'Order one product from concurrent threads until it is out of stock, check nothing was oversold.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='User writing the orders, a customer or an employee.')
+        parser.add_argument('password')
+        parser.add_argument('--product', type=int, help='Product ordered, the first one by default.')
+        parser.add_argument('--stock', type=int, default=500, help='Units in stock at the start.')
+        parser.add_argument('--shards', type=int, help='Rows the stock is split over, STOCK_SHARDS by default.')
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent clients.')
+        parser.add_argument('--max-amount', type=int, default=3, help='Most units ordered in one line.')
+        parser.add_argument('--release-rate', type=float, default=0.2, help='Share of lines removed again.')
+
+    def client(self, options):
+        client = APIClient()
+        response = client.post(reverse('token'), {'username': options['username'], 'password': options['password']})
+        if response.status_code != 200:
+            raise CommandError('Cannot obtain a token: {}'.format(response.data))
+        client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        return client
+
+    def run(self, clients, product, orders, options):
+        counts = {'reserved': 0, 'released': 0, 'out_of_stock': 0}
+        latencies, kept, errors, lock = [], {}, [], threading.Lock()
+
+        def work(client):
+            try:
+                while True:
+                    response = client.post(reverse('order-list'), {'or_username': self.user.id})
+                    if response.status_code != 201:
+                        raise CommandError('Cannot create an order: {}'.format(response.data))
+                    or_id = response.data['or_id']
+                    with lock:
+                        orders.append(or_id)
+                    url = reverse('order-item', args=[or_id])
+                    amount = random.randint(1, options['max_amount'])
+                    start = time.perf_counter()
+                    response = client.post(url, {'pr_id': product.pk, 'amount': amount}, format='json')
+                    latency = time.perf_counter() - start
+                    if response.status_code == 409 and response.data['detail'].code == 'out_of_stock':
+                        with lock:
+                            counts['out_of_stock'] += 1
+                        if amount == 1:
+                            return
+                        continue
+                    if response.status_code != 201:
+                        raise CommandError('POST {} returned {}: {}'.format(url, response.status_code, response.data))
+                    with lock:
+                        counts['reserved'] += amount
+                        latencies.append(latency)
+                        kept[or_id] = amount
+                    if random.random() < options['release_rate']:
+                        response = client.delete(url, [{'pr_id': product.pk}], format='json')
+                        if response.status_code != 204:
+                            raise CommandError('DELETE {} returned {}'.format(url, response.status_code))
+                        with lock:
+                            counts['released'] += amount
+                            del kept[or_id]
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=work, args=[client]) for client in clients]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        return counts, latencies, kept, errors, elapsed
+
+    def violations(self, product, orders, kept, options):
+        lines = ProductsInOrders.objects.filter(or_id__in=orders, pr_id=product)
+        ordered = lines.aggregate(units=Sum('amount'))['units'] or 0
+        left = stock.get_stock(product.pk)['quantity']
+        found = []
+        if ordered + left != options['stock']:
+            found.append('{} units ordered and {} left, stock was {}'.format(ordered, left, options['stock']))
+        if dict(lines.values_list('or_id', 'amount')) != kept:
+            found.append('order lines differ from accepted ones')
+        return found
+
+    # Requests of one user would be throttled
+    @override_settings(THROTTLE_ENABLED=False)
+    def handle(self, *args, **options):
+        self.user = User.objects.get(username=options['username'])
+        products = Product.objects.order_by('pk')
+        product = products.filter(pk=options['product']).first() if options['product'] else products.first()
+        if product is None:
+            raise CommandError('Product not found.')
+        clients = [self.client(options) for _ in range(options['threads'])]
+        # Rejected orders are expected, don't log every one
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+
+        previous = stock.get_stock(product.pk)
+        stock.set_stock(product.pk, options['stock'], options['shards'])
+        # Orders created by the clients, deleted afterwards
+        orders = []
+        try:
+            counts, latencies, kept, errors, elapsed = self.run(clients, product, orders, options)
+            if errors:
+                raise CommandError(errors[0])
+            violations = self.violations(product, orders, kept, options)
+        finally:
+            ProductsInOrders.objects.filter(or_id__in=orders).delete()
+            Order.objects.filter(pk__in=orders).delete()
+            if previous is None:
+                stock.clear_stock(product.pk)
+            else:
+                stock.set_stock(product.pk, previous['quantity'], previous['shards'])
+
+        latencies.sort()
+        self.stdout.write('threads {}, stock {}, reserved {} units ({:.1f} lines/s), released {}, '
+                          'out of stock {}'.format(options['threads'], options['stock'], counts['reserved'],
+                                                   len(latencies) / elapsed, counts['released'],
+                                                   counts['out_of_stock']))
+        if latencies:
+            self.stdout.write('reservation p50 {:.3f} ms, p95 {:.3f} ms'.format(percentile(latencies, 50) * 1000,
+                                                                                percentile(latencies, 95) * 1000))
+        if violations:
+            raise CommandError('\n'.join(violations))
+        self.stdout.write('No oversell.')
@@ -0,0 +1,204 @@
+import bisect
+import contextvars
+import functools
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
+from rest_framework.views import APIView
+
+from restapi.compiled import CompiledSerializer
+from restapi.roles import EMPLOYEE, has_role
+
+'''
+Request instrumentation. MetricsMiddleware records the duration of every request in a histogram per route and, for
+METRICS_SAMPLE_RATE of requests, time spent in authentication, permission checks, throttling, database queries
+(also their number), serialization and rendering. Phases of a sampled request are added to histograms per route and
+phase, served in Prometheus text format at api/_metrics (of the worker process answering the request), and sent in
+Server-Timing header to employees (to every client with DEBUG on). Phases are measured by wrapping DRF methods
+(install() called at startup), which only read a context variable for requests not sampled.
+'''
+
+# Upper bounds of histogram buckets: seconds, and numbers of queries
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+PHASES = ('auth', 'perm', 'throttle', 'db', 'serialize', 'render')
+
+_timing = contextvars.ContextVar('request_timing', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Histograms by metric name and labels, of this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, name, labels, value, buckets=SECONDS_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def render(self):
+        """Histograms in Prometheus text exposition format."""
+        with self.lock:
+            items = sorted((key, list(h.counts), h.sum, h.count, h.buckets) for key, h in self.histograms.items())
+        lines, described = [], set()
+        for (name, labels), counts, total, count, buckets in items:
+            if name not in described:
+                described.add(name)
+                lines += ['# HELP {} {}'.format(name, HELP[name]), '# TYPE {} histogram'.format(name)]
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{} {}'.format(name, _labels(labels + (('le', str(bound)),)), cumulative))
+            lines.append('{}_sum{} {}'.format(name, _labels(labels), round(total, 6)))
+            lines.append('{}_count{} {}'.format(name, _labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+
+HELP = {
+    'api_request_duration_seconds': 'Time to answer a request, by route, method and status class.',
+    'api_request_phase_seconds': 'Time spent in a phase of a sampled request, by route and phase.',
+    'api_request_queries': 'Database queries of a sampled request, by route.',
+}
+
+
+def _labels(labels):
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in labels) + '}'
+
+
+registry = Registry()
+
+
+class Timing:
+    """Phases of one sampled request."""
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.active = set()
+
+    def execute(self, execute, sql, params, many, context):
+        # Database execute wrapper, see Connection.execute_wrapper()
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds['db'] += time.perf_counter() - start
+            self.queries += 1
+
+    def header(self, total):
+        entries = ['{};dur={:.2f}'.format(phase, self.seconds[phase] * 1000) for phase in PHASES
+                   if phase != 'db' and self.seconds[phase]]
+        entries.append('db;dur={:.2f};desc="{} queries"'.format(self.seconds['db'] * 1000, self.queries))
+        entries.append('total;dur={:.2f}'.format(total * 1000))
+        return ', '.join(entries)
+
+
+def timed(phase, function):
+    """Add time of calls to the phase of a sampled request; nested calls count once."""
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        timing = _timing.get()
+        if timing is None or phase in timing.active:
+            return function(*args, **kwargs)
+        timing.active.add(phase)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timing.seconds[phase] += time.perf_counter() - start
+            timing.active.discard(phase)
+
+    wrapper.timed_phase = phase
+    return wrapper
+
+
+def _wrap(owner, name, phase):
+    attribute = owner.__dict__[name]
+    if isinstance(attribute, property):
+        if not hasattr(attribute.fget, 'timed_phase'):
+            setattr(owner, name, property(timed(phase, attribute.fget), attribute.fset, attribute.fdel))
+    elif not hasattr(attribute, 'timed_phase'):
+        setattr(owner, name, timed(phase, attribute))
+
+
+def install():
+    """Wrap DRF methods of request phases, called once from RestapiConfig.ready()."""
+    _wrap(APIView, 'perform_authentication', 'auth')
+    _wrap(APIView, 'check_permissions', 'perm')
+    _wrap(APIView, 'check_object_permissions', 'perm')
+    _wrap(APIView, 'check_throttles', 'throttle')
+    _wrap(BaseSerializer, 'data', 'serialize')
+    _wrap(CompiledSerializer, 'serialize_rows', 'serialize')
+    _wrap(Response, 'rendered_content', 'render')
+
+
+def route_of(request):
+    match = getattr(request, 'resolver_match', None)
+    return '/' + match.route if match is not None and match.route else 'unmatched'
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            return self.get_response(request)
+        sample_rate = getattr(settings, 'METRICS_SAMPLE_RATE', 1.0)
+        timing = Timing() if sample_rate >= 1 or random.random() < sample_rate else None
+        start = time.perf_counter()
+        if timing is None:
+            response = self.get_response(request)
+        else:
+            token = _timing.set(timing)
+            try:
+                with ExitStack() as stack:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(timing.execute))
+                    response = self.get_response(request)
+            finally:
+                _timing.reset(token)
+        total = time.perf_counter() - start
+        route = route_of(request)
+        status = '{}xx'.format(response.status_code // 100)
+        registry.observe('api_request_duration_seconds', {'route': route, 'method': request.method, 'status': status},
+                         total)
+        if timing is not None:
+            for phase in PHASES:
+                registry.observe('api_request_phase_seconds', {'route': route, 'phase': phase}, timing.seconds[phase])
+            registry.observe('api_request_queries', {'route': route}, timing.queries, QUERY_BUCKETS)
+            # Requests answered before AuthenticationMiddleware have no user
+            user = getattr(request, 'user', None)
+            if getattr(settings, 'SERVER_TIMING_HEADER', True) and (settings.DEBUG or has_role(user, EMPLOYEE)):
+                response['Server-Timing'] = timing.header(total)
+        return response
@@ -0,0 +1,37 @@
+# Generated by Django 3.0.6 on 2026-10-18 14:39
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    Order = apps.get_model('restapi', 'Order')
+    ProductsInOrders = apps.get_model('restapi', 'ProductsInOrders')
+    items = ProductsInOrders.objects.filter(or_id=OuterRef('pk')).order_by().values('or_id')
+    total = items.annotate(total=ExpressionWrapper(Sum(F('amount') * F('pr_id__pr_price')),
+                                                   output_field=DecimalField())).values('total')
+    count = items.annotate(count=Count('pk')).values('count')
+    Order.objects.update(or_total_price=Coalesce(Subquery(total), Value(0), output_field=DecimalField()),
+                         or_items_count=Coalesce(Subquery(count), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='or_items_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='or_total_price',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
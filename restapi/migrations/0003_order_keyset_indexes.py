@@ -0,0 +1,26 @@
+# Generated by Django 3.0.6 on 2026-10-18 14:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0002_order_totals'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='or_total_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['or_start_date', 'or_id'], name='restapi_ord_or_star_c8d24a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['or_total_price', 'or_id'], name='restapi_ord_or_tota_6415cc_idx'),
+        ),
+    ]
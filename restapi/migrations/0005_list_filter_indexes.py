@@ -0,0 +1,45 @@
+# Generated by Django 3.0.6 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0004_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['or_username', 'or_start_date', 'or_id'], name='restapi_ord_or_user_0c9f0d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['or_is_finished', 'or_is_sent', 'or_start_date'], name='restapi_ord_or_is_f_471633_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['or_is_sent', 'or_start_date'], name='restapi_ord_or_is_s_51e4bd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['or_finish_date', 'or_id'], name='restapi_ord_or_fini_c2659b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['pr_cat', 'pr_price', 'pr_id'], name='restapi_pro_pr_cat_d17616_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['pr_sup', 'pr_price', 'pr_id'], name='restapi_pro_pr_sup__60db58_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['pr_price', 'pr_id'], name='restapi_pro_pr_pric_9dcdbc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['pr_name', 'pr_id'], name='restapi_pro_pr_name_555ca8_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def install(apps, schema_editor):
+    from restapi import search
+    search.install(schema_editor.connection)
+    search.rebuild(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    from restapi import search
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0005_list_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Index for finding expired tokens (restapi.blacklist.compact) in a table of another app."""
+
+    dependencies = [
+        ('restapi', '0008_idempotency_key'),
+        ('token_blacklist', '0007_auto_20171017_2214'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS restapi_outstandingtoken_expires_idx '
+            'ON token_blacklist_outstandingtoken (expires_at)',
+            'DROP INDEX IF EXISTS restapi_outstandingtoken_expires_idx',
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.0.6 on 2026-10-18 15:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0009_outstanding_token_expires_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('units', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='restapi.Product')),
+            ],
+            options={
+                'unique_together': {('day', 'product')},
+            },
+        ),
+    ]
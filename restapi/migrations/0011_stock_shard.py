@@ -0,0 +1,26 @@
+# Generated by Django 3.0.6 on 2026-10-18 15:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0010_daily_sales'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_shards', to='restapi.Product')),
+            ],
+            options={
+                'unique_together': {('product', 'shard')},
+            },
+        ),
+    ]
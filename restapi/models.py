@@ -2,7 +2,9 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth import get_user_model
 from django.conf import settings
-from django.db.models import Sum, F, ExpressionWrapper, DecimalField
+from django.utils import timezone
+from django.db.models import Sum, F, ExpressionWrapper, DecimalField, Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 
 
 class User(AbstractUser):
@@ -22,6 +24,7 @@ class Supplier(models.Model):
     sup_postal_code = models.CharField(max_length=10)
     sup_city = models.CharField(max_length=50)
     sup_address = models.CharField(max_length=70)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.sup_name
@@ -42,21 +45,48 @@ class Product(models.Model):
                         (VALVES, 'Valves'),
                         (WELD_AND_THREAD, 'Welds and threads')]
 
+    class Meta:
+        # Filters of product list (restapi.views.ProductList.filters) with price or name ordering
+        indexes = [models.Index(fields=['pr_cat', 'pr_price', 'pr_id']),
+                   models.Index(fields=['pr_sup', 'pr_price', 'pr_id']),
+                   models.Index(fields=['pr_price', 'pr_id']),
+                   models.Index(fields=['pr_name', 'pr_id'])]
+
     pr_id = models.AutoField(primary_key=True)
     pr_name = models.CharField(max_length=50)
     pr_cat = models.CharField(max_length=2, choices=CATEGORY_CHOICES)
     pr_price = models.DecimalField(max_digits=8, decimal_places=2)
     pr_sup = models.ForeignKey(Supplier, on_delete=models.PROTECT)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.pr_name
 
+    def reprice_orders(self, old_price):
+        """Shift stored totals of every order containing this product by the price difference."""
+        amount = ProductsInOrders.objects.filter(or_id=OuterRef('pk'), pr_id=self.pk).values('amount')[:1]
+        delta = ExpressionWrapper(Subquery(amount) * Value(self.pr_price - old_price), output_field=DecimalField())
+        Order.objects.filter(items_in_order__pr_id=self.pk).update(or_total_price=F('or_total_price') + delta,
+                                                                   updated_at=timezone.now())
+        # Sales rollups use current prices too
+        shift = ExpressionWrapper(F('units') * Value(self.pr_price - old_price), output_field=DecimalField())
+        DailySales.objects.filter(product=self.pk).update(revenue=F('revenue') + shift)
+
 
 def get_sentinel_user():
     return get_user_model().objects.get_or_create(username='deleted')[0]
 
 
 class Order(models.Model):
+    class Meta:
+        # Keyset ordering and filters of order list (restapi.views.OrderList.filters)
+        indexes = [models.Index(fields=['or_start_date', 'or_id']),
+                   models.Index(fields=['or_total_price', 'or_id']),
+                   models.Index(fields=['or_username', 'or_start_date', 'or_id']),
+                   models.Index(fields=['or_is_finished', 'or_is_sent', 'or_start_date']),
+                   models.Index(fields=['or_is_sent', 'or_start_date']),
+                   models.Index(fields=['or_finish_date', 'or_id'])]
+
     or_id = models.AutoField(primary_key=True)
     or_start_date = models.DateTimeField(auto_now_add=True)
     or_is_finished = models.BooleanField(default=False)
@@ -64,15 +94,59 @@ class Order(models.Model):
     or_is_sent = models.BooleanField(default=False)
     or_sent_date = models.DateTimeField(null=True)
     or_username = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET(get_sentinel_user))
+    or_total_price = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    or_items_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Incremented by every change of the order or its items, see compare_and_set()
+    version = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return 'Order No. {}, started {}'.format(self.or_id, self.or_start_date)
 
+    @classmethod
+    def compare_and_set(cls, or_id, version, **fields):
+        """
+        Update an unfinished order only if it still has 'version' (no row is locked beforehand), bumping the version.
+        Return whether the order was updated; False means a concurrent change or a finished order.
+        """
+        fields.setdefault('updated_at', timezone.now())
+        return cls.objects.filter(pk=or_id, version=version, or_is_finished=False).update(
+            version=F('version') + 1, **fields) == 1
+
+    @classmethod
+    def add_item_totals(cls, or_id, price_delta, count_delta=0, version=None):
+        """Apply a change of order lines to the stored totals without reading them first, see compare_and_set()."""
+        totals = {'or_total_price': F('or_total_price') + price_delta,
+                  'or_items_count': F('or_items_count') + count_delta}
+        if version is not None:
+            return cls.compare_and_set(or_id, version, **totals)
+        return cls.objects.filter(pk=or_id).update(version=F('version') + 1, updated_at=timezone.now(), **totals) == 1
+
+    @classmethod
+    def expected_totals(cls):
+        """Totals and line counts aggregated from order items, as subqueries correlated to the order."""
+        items = ProductsInOrders.objects.filter(or_id=OuterRef('pk')).order_by().values('or_id')
+        total = items.annotate(total=cls.total_price_expression()).values('total')
+        count = items.annotate(count=Count('pk')).values('count')
+        return {'or_total_price': Coalesce(Subquery(total), Value(0), output_field=DecimalField()),
+                'or_items_count': Coalesce(Subquery(count), Value(0))}
+
+    @classmethod
+    def recalculate_totals(cls, queryset=None):
+        """Recompute stored totals from order items in a single UPDATE."""
+        if queryset is None:
+            queryset = cls.objects.all()
+        return queryset.update(updated_at=timezone.now(), version=F('version') + 1, **cls.expected_totals())
+
+    @staticmethod
+    def total_price_expression(prefix=''):
+        """Sum of amount * product price over order items."""
+        return ExpressionWrapper(Sum(F(prefix + 'amount') * F(prefix + 'pr_id__pr_price')),
+                                 output_field=DecimalField())
+
     @property
     def total_price(self):
-        order_price = self.items_in_order.all().aggregate(
-            price=ExpressionWrapper(Sum(F('amount') * F('pr_id__pr_price')), output_field=DecimalField()))
-        return order_price
+        return {'price': self.or_total_price}
 
 
 class ProductsInOrders(models.Model):
@@ -82,6 +156,70 @@ class ProductsInOrders(models.Model):
     or_id = models.ForeignKey(Order, on_delete=models.PROTECT, related_name='items_in_order', db_column='or_id')
     pr_id = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='chosen_products', db_column='pr_id')
     amount = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def line_price(self):
+        return self.amount * self.pr_id.pr_price
 
     def __str__(self):
-        return 'Order No. {}, Product: {}, Amount: {}'.format(self.or_id.or_id, self.pr_id.pr_name, self.amount)
+        return 'Order No. {}, Product: {}, Amount: {}'.format(self.or_id_id, self.pr_id.pr_name, self.amount)
+
+
+class IdempotencyKey(models.Model):
+    """Response to a request sent with Idempotency-Key header, replayed to retries of it (restapi.idempotency)."""
+    class Meta:
+        unique_together = ['user', 'key']
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    # Hash of method, path and body, a key can't be reused for another request
+    fingerprint = models.CharField(max_length=64)
+    # None while the first request is being processed
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.TextField(blank=True)
+    created_at = models.DateTimeField(db_index=True)
+
+
+class DailySales(models.Model):
+    """Revenue and units of a product in orders finished on a day, maintained by restapi.sales."""
+    class Meta:
+        unique_together = ['day', 'product']
+
+    day = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    revenue = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    units = models.IntegerField(default=0)
+
+
+class StockShard(models.Model):
+    """
+    Part of the stock of a product. Reservations take units from shards with conditional updates (restapi.stock),
+    so concurrent orders of one product lock different rows. A product without shards has no stock tracked.
+    """
+    class Meta:
+        unique_together = ['product', 'shard']
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_shards')
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+
+
+class OutboxEvent(models.Model):
+    """Event written in the transaction of a state change, handled later by the outbox worker (restapi.outbox)."""
+    PENDING = 'pending'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (FAILED, 'Failed')]
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'available_at'])]
+
+    topic = models.CharField(max_length=100)
+    payload = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Not handled before this time: retry backoff, or lease of the worker which claimed the event
+    available_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=64, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
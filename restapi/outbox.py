@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import random
+import threading
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from restapi.models import OutboxEvent
+
+'''
+Transactional outbox: side effects of a state change (e-mails, calls to other services) are recorded as events in the
+transaction of the change and run later by 'python manage.py outbox_worker', so requests neither wait for them nor
+lose them. Workers claim batches of events (SELECT ... FOR UPDATE SKIP LOCKED where the database has it, otherwise
+a conditional update) for OUTBOX_LEASE_SECONDS and run the handlers of their topic from OUTBOX_HANDLERS. A handled
+event is deleted, a failed one retried with exponential backoff and marked failed after OUTBOX_MAX_ATTEMPTS.
+Events are handled at least once, so handlers must tolerate repeats.
+'''
+
+logger = logging.getLogger('restapi.outbox')
+
+ORDER_FINISHED = 'order.finished'
+
+# Set to stop workers of this process after their current batch; worker processes of outbox_worker get an event
+# shared with the parent instead
+stopping = threading.Event()
+
+
+def publish(topic, **payload):
+    """Record an event; call it in the transaction of the change, a rollback drops the event with it."""
+    return OutboxEvent.objects.create(topic=topic, payload=json.dumps(payload, cls=DjangoJSONEncoder))
+
+
+def log_event(event, payload):
+    """Handler logging the event, e.g. for topics without other handlers yet."""
+    logger.info('%s %s', event.topic, payload)
+
+
+def handlers_of(topic):
+    return [import_string(path) for path in getattr(settings, 'OUTBOX_HANDLERS', {}).get(topic, ())]
+
+
+def claim(worker, batch_size):
+    """Available events, oldest first, claimed by the worker until its lease ends."""
+    now = timezone.now()
+    lease = now + timedelta(seconds=getattr(settings, 'OUTBOX_LEASE_SECONDS', 60))
+    available = OutboxEvent.objects.filter(status=OutboxEvent.PENDING, available_at__lte=now).order_by('available_at')
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(available.select_for_update(skip_locked=True).values_list('pk', flat=True)[:batch_size])
+            OutboxEvent.objects.filter(pk__in=ids).update(available_at=lease, claimed_by=worker)
+    else:
+        # Workers may read the same events, the conditional update gives each to one of them
+        ids = list(available.values_list('pk', flat=True)[:batch_size])
+        available.filter(pk__in=ids).update(available_at=lease, claimed_by=worker)
+    return list(OutboxEvent.objects.filter(pk__in=ids, claimed_by=worker, available_at=lease).order_by('pk'))
+
+
+def retry_delay(attempts):
+    """Seconds before the next attempt: doubled with every failure, with jitter spreading retries of a batch."""
+    delay = min(getattr(settings, 'OUTBOX_RETRY_DELAY', 1) * 2 ** (attempts - 1),
+                getattr(settings, 'OUTBOX_MAX_RETRY_DELAY', 600))
+    return delay * random.uniform(0.5, 1)
+
+
+def fail(event, exc):
+    attempts = event.attempts + 1
+    error = ''.join(traceback.format_exception_only(type(exc), exc)).strip()
+    fields = {'attempts': attempts, 'last_error': error, 'claimed_by': ''}
+    if attempts >= getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8):
+        fields['status'] = OutboxEvent.FAILED
+        logger.error('Outbox event %s (%s) failed %s times: %s', event.pk, event.topic, attempts, error)
+    else:
+        fields['available_at'] = timezone.now() + timedelta(seconds=retry_delay(attempts))
+    # Only while the worker holds the event, its lease may have run out and another worker claimed it
+    OutboxEvent.objects.filter(pk=event.pk, claimed_by=event.claimed_by).update(**fields)
+
+
+def process(events):
+    """Run handlers of claimed events, return numbers of handled and failed ones."""
+    handled = failed = 0
+    for event in events:
+        try:
+            payload = json.loads(event.payload)
+            for handler in handlers_of(event.topic):
+                handler(event, payload)
+        except Exception as exc:
+            fail(event, exc)
+            failed += 1
+        else:
+            if not OutboxEvent.objects.filter(pk=event.pk, claimed_by=event.claimed_by).delete()[0]:
+                logger.warning('Lease of outbox event %s (%s) ran out while it was handled, it is handled again',
+                               event.pk, event.topic)
+            handled += 1
+    return handled, failed
+
+
+def work(batch_size=None, poll_interval=1.0, once=False):
+    """
+    Handle events until stopped (or, with 'once', until none is available), return numbers of handled and failed
+    events. Runs in a thread or process of the worker pool.
+    """
+    worker = '{}-{}'.format(os.getpid(), uuid.uuid4().hex[:12])
+    batch_size = batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', 100)
+    handled = failed = 0
+    try:
+        while not stopping.is_set():
+            events = claim(worker, batch_size)
+            if events:
+                counts = process(events)
+                handled, failed = handled + counts[0], failed + counts[1]
+            elif once:
+                break
+            else:
+                stopping.wait(poll_interval)
+    except KeyboardInterrupt:
+        pass
+    return handled, failed
+
+
+def stats():
+    """Numbers of pending, available and failed events."""
+    events = OutboxEvent.objects.all()
+    return {'pending': events.filter(status=OutboxEvent.PENDING).count(),
+            'available': events.filter(status=OutboxEvent.PENDING, available_at__lte=timezone.now()).count(),
+            'failed': events.filter(status=OutboxEvent.FAILED).count()}
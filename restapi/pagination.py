@@ -0,0 +1,108 @@
+import binascii
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+'''
+Keyset pagination: a page continues after the (ordering field, primary key) pair of the last row of the previous page,
+so the database seeks in an index instead of skipping OFFSET rows and deep pages cost the same as the first one.
+'''
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering_query_param = 'ordering'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 500)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            page_size = self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, request, queryset, view):
+        """Ordering field chosen by client from view's 'ordering_fields' (primary key by default)."""
+        pk_name = queryset.model._meta.pk.name
+        ordering = request.query_params.get(self.ordering_query_param) or getattr(view, 'ordering', pk_name)
+        allowed = getattr(view, 'ordering_fields', [pk_name])
+        if ordering.lstrip('-') not in allowed:
+            raise ValidationError({self.ordering_query_param: 'Allowed values: {}.'.format(', '.join(allowed))})
+        return ordering.lstrip('-'), ordering.startswith('-')
+
+    def encode_cursor(self, row):
+        """Link to the page after the row, which is a model instance or a dict from values()."""
+        if isinstance(row, dict):
+            value, pk = row[self.field], row[self.pk_name]
+        else:
+            value, pk = getattr(row, self.field), row.pk
+        value = value.isoformat() if isinstance(value, datetime) else str(value)
+        position = [self.field, self.descending, value, pk]
+        cursor = urlsafe_b64encode(json.dumps(position).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            field, descending, value, pk = json.loads(urlsafe_b64decode(cursor.encode('ascii')).decode('ascii'))
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if field != self.field or descending != self.descending:
+            raise NotFound(self.invalid_cursor_message)
+        # A well-formed cursor may still carry values the database can't compare to the columns
+        try:
+            return self.model._meta.get_field(field).to_python(value), self.model._meta.pk.to_python(pk)
+        except (TypeError, ValueError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        self.field, self.descending = self.get_ordering(request, queryset, view)
+        page_size = self.get_page_size(request)
+        pk_name = self.pk_name = queryset.model._meta.pk.name
+        sign = '-' if self.descending else ''
+        keys = [self.field] if self.field == pk_name else [self.field, pk_name]
+        queryset = queryset.order_by(*[sign + key for key in keys])
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            value, pk = cursor
+            after = 'lt' if self.descending else 'gt'
+            if self.field == pk_name:
+                queryset = queryset.filter(**{pk_name + '__' + after: pk})
+            else:
+                queryset = queryset.filter(Q(**{self.field + '__' + after: value}) |
+                                           Q(**{self.field: value, pk_name + '__' + after: pk}))
+
+        rows = list(queryset[:page_size + 1])
+        page = rows[:page_size]
+        self.next_link = self.encode_cursor(page[-1]) if len(rows) > page_size else None
+        return page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([('next', self.next_link), ('results', data)]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
@@ -1,5 +1,6 @@
 from rest_framework import permissions
 from rest_framework.permissions import SAFE_METHODS
+from restapi.roles import has_role, CUSTOMER, EMPLOYEE
 
 '''Own permissions i.e. for model owner or selected group'''
 
@@ -8,25 +9,21 @@ class IsOrderOwner(permissions.BasePermission):
     message = "Not an owner."
 
     def has_object_permission(self, request, view, obj):
-        return request.user == obj.or_username
+        return request.user.id == obj.or_username_id
 
 
 class IsEmployeeGroup(permissions.BasePermission):
     message = "Not an employee."
 
     def has_permission(self, request, view):
-        if request.user and request.user.groups.filter(name='employee'):
-            return True
-        return False
+        return has_role(request.user, EMPLOYEE)
 
 
 class IsCustomerGroup(permissions.BasePermission):
     message = "Not a customer."
 
     def has_permission(self, request, view):
-        if request.user and request.user.groups.filter(name='customer'):
-            return True
-        return False
+        return has_role(request.user, CUSTOMER)
 
 
 class ReadOnly(permissions.BasePermission):
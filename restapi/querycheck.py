@@ -0,0 +1,139 @@
+import logging
+import os
+import random
+import re
+import time
+import traceback
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+'''
+Query checks of a request: queries are grouped by fingerprint (SQL with literals and IN lists collapsed), a
+fingerprint run more than QUERY_REPEAT_THRESHOLD times points to an N+1 pattern (e.g. a related object loaded per
+row), a query taking over QUERY_SLOW_SECONDS is slow. Each violation carries the stack of project code which ran the
+query. QueryCheckMiddleware logs violations of QUERY_CHECK_SAMPLE_RATE of requests to 'restapi.queries' logger;
+tests deriving from QueryCheckMixin check every request and fail with repeated queries. Durations depend on the
+machine running the tests, so slow queries are only logged there too.
+'''
+
+logger = logging.getLogger('restapi.queries')
+
+REPEATED = 'repeated query'
+SLOW = 'slow query'
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\bIN \((?:%s|\?)(?:, (?:%s|\?))*\)', re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+
+# Lists of violations of tests being run, see QueryCheckMixin
+_collectors = []
+
+
+def fingerprint(sql):
+    """Shape of a query: same for queries differing only in parameters or IN list lengths."""
+    sql = _IN_LISTS.sub('IN (...)', _LITERALS.sub('?', sql))
+    return _SPACES.sub(' ', sql).strip()
+
+
+def project_stack():
+    """Frames of project code (views, serializers, tests) leading to the current call, outermost first."""
+    root = str(settings.BASE_DIR) + os.sep
+    return [frame for frame in traceback.extract_stack()[:-1] if frame.filename.startswith(root)
+            and frame.filename != __file__ and 'site-packages' not in frame.filename]
+
+
+class Violation:
+    def __init__(self, kind, sql, detail, stack):
+        self.kind = kind
+        self.sql = sql
+        self.detail = detail
+        self.stack = stack
+
+    def __str__(self):
+        lines = ['{} ({}): {}'.format(self.kind, self.detail, self.sql)]
+        lines += ['    {}:{} in {}: {}'.format(frame.filename, frame.lineno, frame.name, frame.line)
+                  for frame in self.stack]
+        return '\n'.join(lines)
+
+
+class QueryRecorder:
+    """Database execute wrapper collecting violations of the queries run while it is installed."""
+
+    def __init__(self, threshold=None, slow_seconds=None):
+        self.threshold = threshold if threshold is not None else getattr(settings, 'QUERY_REPEAT_THRESHOLD', 5)
+        self.slow_seconds = slow_seconds if slow_seconds is not None else getattr(settings, 'QUERY_SLOW_SECONDS', 0.1)
+        self.counts = {}
+        self.repeated = {}
+        self.violations = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            shape = fingerprint(sql)
+            count = self.counts[shape] = self.counts.get(shape, 0) + 1
+            if count == self.threshold + 1:
+                # Stack of the first query over the threshold, the count is completed by finish()
+                self.repeated[shape] = Violation(REPEATED, shape, '', project_stack())
+                self.violations.append(self.repeated[shape])
+            if duration > self.slow_seconds:
+                self.violations.append(Violation(SLOW, sql, '{:.0f} ms'.format(duration * 1000),
+                                                 project_stack()))
+
+    def install(self, stack):
+        """Record queries of all connections until 'stack' (ExitStack) closes."""
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+
+    def finish(self):
+        for shape, violation in self.repeated.items():
+            violation.detail = '{} times'.format(self.counts[shape])
+        return self.violations
+
+
+def report(violations, title):
+    return '{}: {} query violation(s)\n{}'.format(title, len(violations), '\n'.join(map(str, violations)))
+
+
+class QueryCheckMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not _collectors and random.random() >= getattr(settings, 'QUERY_CHECK_SAMPLE_RATE', 0.0):
+            return self.get_response(request)
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            recorder.install(stack)
+            response = self.get_response(request)
+        violations = recorder.finish()
+        title = '{} {}'.format(request.method, request.path)
+        failing = [violation for violation in violations if violation.kind == REPEATED] if _collectors else []
+        if failing:
+            for collected in _collectors:
+                collected.append(report(failing, title))
+        logged = [violation for violation in violations if violation not in failing]
+        if logged:
+            logger.warning(report(logged, title))
+        return response
+
+
+class QueryCheckMixin:
+    """Test case mixin failing a test whose requests (through QueryCheckMiddleware) run repeated queries."""
+
+    def _pre_setup(self):
+        super()._pre_setup()
+        self.query_violations = []
+        _collectors.append(self.query_violations)
+
+    def _post_teardown(self):
+        try:
+            _collectors.remove(self.query_violations)
+            if self.query_violations:
+                raise AssertionError('\n\n'.join(self.query_violations))
+        finally:
+            super()._post_teardown()
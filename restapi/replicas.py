@@ -0,0 +1,149 @@
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import DatabaseError, InterfaceError, OperationalError
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+'''
+Read replicas: reads of GET/HEAD/OPTIONS requests go to a replica from DATABASE_REPLICAS (alias: weight), everything
+else to the primary ('default'). A client who changed something reads from the primary for REPLICA_STICKY_SECONDS
+afterwards, so they see their own writes despite replication lag; the marker is kept in REPLICA_STICKY_CACHE, which
+must be shared by all processes. A replica which cannot be connected to is left out
+for REPLICA_EJECT_SECONDS. Outside requests (commands, shell) all queries go to the primary.
+'''
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = contextvars.ContextVar('replica_state', default=None)
+# Alias of ejected replica: time (monotonic) when it can be used again
+_ejected = {}
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', {})
+
+
+def eject(alias):
+    _ejected[alias] = time.monotonic() + getattr(settings, 'REPLICA_EJECT_SECONDS', 30)
+
+
+def healthy_replicas():
+    now = time.monotonic()
+    return {alias: weight for alias, weight in get_replicas().items() if weight > 0 and _ejected.get(alias, 0) <= now}
+
+
+def choose_replica():
+    """Random replica by weight which accepts a connection, None if there is none."""
+    candidates = healthy_replicas()
+    while candidates:
+        alias = random.choices(list(candidates), weights=list(candidates.values()))[0]
+        try:
+            connections[alias].ensure_connection()
+            return alias
+        except DatabaseError:
+            eject(alias)
+            del candidates[alias]
+    return None
+
+
+class ReadState:
+    """Where reads of the current request go; a replica is chosen by the first read."""
+
+    def __init__(self, primary):
+        self.primary = primary
+        self.alias = None
+
+    def read_alias(self):
+        if self.primary:
+            return DEFAULT_DB_ALIAS
+        if self.alias is None:
+            self.alias = choose_replica() or DEFAULT_DB_ALIAS
+        return self.alias
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary inside the block, e.g. to build data cached for all clients."""
+    token = _state.set(ReadState(primary=True))
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        return state.read_alias() if state is not None else None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db in get_replicas() else None
+
+
+def client_key(request):
+    """User id from the access token, without a database query; None for anonymous clients."""
+    header = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(header) != 2 or header[0] != 'Bearer':
+        return None
+    try:
+        return AccessToken(header[1])[jwt_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return None
+
+
+def _sticky_key(client):
+    return 'replica:sticky:{}'.format(client)
+
+
+def sticky_cache():
+    return caches[getattr(settings, 'REPLICA_STICKY_CACHE', 'default')]
+
+
+# Backends kept per process or not kept at all, another worker wouldn't see a client's marker
+LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        if get_replicas() and isinstance(sticky_cache(), LOCAL_CACHES):
+            raise ImproperlyConfigured('REPLICA_STICKY_CACHE must be a cache shared by all processes '
+                                       'when DATABASE_REPLICAS are configured.')
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not get_replicas():
+            return self.get_response(request)
+        client = client_key(request)
+        safe = request.method in SAFE_METHODS
+        primary = not safe or (client is not None and sticky_cache().get(_sticky_key(client)) is not None)
+        token = _state.set(ReadState(primary))
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        if not safe and client is not None and response.status_code < 400:
+            sticky_cache().set(_sticky_key(client), 1, getattr(settings, 'REPLICA_STICKY_SECONDS', 5))
+        return response
+
+    def process_exception(self, request, exception):
+        state = _state.get()
+        if isinstance(exception, (OperationalError, InterfaceError)) and state is not None \
+                and state.alias not in (None, DEFAULT_DB_ALIAS):
+            eject(state.alias)
@@ -0,0 +1,48 @@
+import threading
+import time
+
+from django.conf import settings
+
+'''Resolve user's group names once per request, optionally caching them per process for ROLE_CACHE_TTL seconds'''
+
+CUSTOMER = 'customer'
+EMPLOYEE = 'employee'
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def clear_role_cache(user_id=None):
+    with _cache_lock:
+        if user_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(user_id, None)
+
+
+def _load_roles(user):
+    ttl = getattr(settings, 'ROLE_CACHE_TTL', 0)
+    if not ttl:
+        return frozenset(user.groups.values_list('name', flat=True))
+    now = time.monotonic()
+    cached = _cache.get(user.pk)
+    if cached and cached[0] > now:
+        return cached[1]
+    roles = frozenset(user.groups.values_list('name', flat=True))
+    with _cache_lock:
+        _cache[user.pk] = (now + ttl, roles)
+    return roles
+
+
+def get_roles(user):
+    """Group names of the user. The user object lives for one request, so the result is kept on it."""
+    if not user or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_role_names', None)
+    if roles is None:
+        roles = user._role_names = _load_roles(user)
+    return roles
+
+
+def has_role(user, role):
+    return role in get_roles(user)
@@ -0,0 +1,85 @@
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from restapi.models import DailySales, Order, Product, ProductsInOrders
+
+'''
+Sales rollups: revenue and units per product and day (the day an order was finished) in DailySales, changed in the
+transaction finishing an order with a constant number of queries, whatever the number of its lines (a finished
+order can't change, and its items protect it from deletion).
+Reports per supplier, category or day aggregate the rows of a date range, which are few compared to order items.
+Revenue uses current product prices like order totals (Product.reprice_orders shifts both). rebuild() recomputes
+rollups from orders, e.g. for a backfill: 'python manage.py rebuild_sales_rollups'.
+'''
+
+# Dimension of a report: values grouped by, ordering
+DIMENSIONS = {
+    'products': (('product', 'product__pr_name'), ('-revenue', 'product')),
+    'suppliers': (('product__pr_sup', 'product__pr_sup__sup_name'), ('-revenue', 'product__pr_sup')),
+    'categories': (('product__pr_cat',), ('-revenue', 'product__pr_cat')),
+    'days': (('day',), ('day',)),
+}
+# Names of grouped values in reports
+FIELD_NAMES = {'product__pr_name': 'pr_name', 'product__pr_sup': 'supplier', 'product__pr_sup__sup_name': 'sup_name',
+               'product__pr_cat': 'category'}
+
+
+def line_totals(lines, *group):
+    """Revenue and units per product (and 'group' values) of order items."""
+    return lines.order_by().values('pr_id', *group).annotate(revenue=Order.total_price_expression(),
+                                                             units=Sum('amount'))
+
+
+def record_order(or_id, finish_date):
+    """Add lines of a finished order to the rollups of its finish day."""
+    totals = list(line_totals(ProductsInOrders.objects.filter(or_id=or_id)))
+    if not totals:
+        return
+    day = timezone.localdate(finish_date)
+    # Missing rows first, then one UPDATE with the deltas of all products
+    DailySales.objects.bulk_create([DailySales(day=day, product_id=row['pr_id']) for row in totals],
+                                   ignore_conflicts=True)
+    revenue = Case(*[When(product=row['pr_id'], then=Value(row['revenue'])) for row in totals],
+                   output_field=DecimalField())
+    units = Case(*[When(product=row['pr_id'], then=Value(row['units'])) for row in totals],
+                 output_field=IntegerField())
+    DailySales.objects.filter(day=day, product__in=[row['pr_id'] for row in totals]).update(
+        revenue=F('revenue') + revenue, units=F('units') + units)
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def rebuild(since=None, until=None):
+    """Recompute rollups of days in the range (all by default) from finished orders, return the number of rows."""
+    days, lines = Q(), ProductsInOrders.objects.filter(or_id__or_is_finished=True)
+    if since is not None:
+        days &= Q(day__gte=since)
+        lines = lines.filter(or_id__or_finish_date__gte=day_start(since))
+    if until is not None:
+        days &= Q(day__lte=until)
+        lines = lines.filter(or_id__or_finish_date__lt=day_start(until + timedelta(days=1)))
+    rows = line_totals(lines.annotate(day=TruncDate('or_id__or_finish_date')), 'day')
+    with transaction.atomic():
+        DailySales.objects.filter(days).delete()
+        # Batches sized by the backend, SQLite limits terms of a query
+        created = DailySales.objects.bulk_create(
+            [DailySales(day=row['day'], product_id=row['pr_id'], revenue=row['revenue'], units=row['units'])
+             for row in rows])
+    return len(created)
+
+
+def report(dimension, since, until):
+    """Revenue and units grouped by the dimension over days from 'since' to 'until' (inclusive)."""
+    fields, ordering = DIMENSIONS[dimension]
+    rows = DailySales.objects.filter(day__gte=since, day__lte=until).values(*fields) \
+        .annotate(revenue=Sum('revenue'), units=Sum('units')).order_by(*ordering)
+    if dimension == 'categories':
+        names = dict(Product.CATEGORY_CHOICES)
+        rows = ({**row, 'cat_name': names.get(row['product__pr_cat'])} for row in rows)
+    return [{FIELD_NAMES.get(name, name): value for name, value in row.items()} for row in rows]
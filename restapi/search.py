@@ -0,0 +1,166 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+
+'''
+Full-text search of products by product and supplier name. The index is kept by the database itself: a tsvector column
+with a GIN index on PostgreSQL, an FTS5 table on SQLite, both maintained by triggers on product and supplier tables,
+so bulk inserts and queryset updates are indexed too. Terms are matched as prefixes, results are ranked with product
+name weighted over supplier name.
+'''
+
+MAX_TERMS = 10
+
+POSTGRES_INSTALL = [
+    'ALTER TABLE restapi_product ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    'CREATE INDEX IF NOT EXISTS restapi_product_search_idx ON restapi_product USING gin(search_vector)',
+    '''CREATE OR REPLACE FUNCTION restapi_product_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{config}', coalesce(NEW.pr_name, '')), 'A') ||
+            setweight(to_tsvector('{config}', coalesce(
+                (SELECT sup_name FROM restapi_supplier WHERE sup_id = NEW.pr_sup_id), '')), 'B');
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql''',
+    'DROP TRIGGER IF EXISTS restapi_product_search ON restapi_product',
+    '''CREATE TRIGGER restapi_product_search BEFORE INSERT OR UPDATE OF pr_name, pr_sup_id ON restapi_product
+    FOR EACH ROW EXECUTE PROCEDURE restapi_product_search_vector()''',
+    '''CREATE OR REPLACE FUNCTION restapi_supplier_search_vector() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.sup_name IS DISTINCT FROM OLD.sup_name THEN
+            UPDATE restapi_product SET pr_name = pr_name WHERE pr_sup_id = NEW.sup_id;
+        END IF;
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql''',
+    'DROP TRIGGER IF EXISTS restapi_supplier_search ON restapi_supplier',
+    '''CREATE TRIGGER restapi_supplier_search AFTER UPDATE OF sup_name ON restapi_supplier
+    FOR EACH ROW EXECUTE PROCEDURE restapi_supplier_search_vector()''',
+]
+
+POSTGRES_REBUILD = ['UPDATE restapi_product SET pr_name = pr_name']
+
+POSTGRES_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS restapi_supplier_search ON restapi_supplier',
+    'DROP TRIGGER IF EXISTS restapi_product_search ON restapi_product',
+    'DROP FUNCTION IF EXISTS restapi_supplier_search_vector()',
+    'DROP FUNCTION IF EXISTS restapi_product_search_vector()',
+    'ALTER TABLE restapi_product DROP COLUMN IF EXISTS search_vector',
+]
+
+SQLITE_INSERT = '''INSERT INTO restapi_product_fts(rowid, pr_name, sup_name, pr_cat)
+    SELECT {row}.pr_id, {row}.pr_name, sup_name, {row}.pr_cat FROM restapi_supplier WHERE sup_id = {row}.pr_sup_id'''
+
+SQLITE_INSTALL = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS restapi_product_fts USING fts5(
+        pr_name, sup_name, pr_cat UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')''',
+    '''CREATE TRIGGER IF NOT EXISTS restapi_product_fts_insert AFTER INSERT ON restapi_product BEGIN
+        {};
+    END'''.format(SQLITE_INSERT.format(row='new')),
+    '''CREATE TRIGGER IF NOT EXISTS restapi_product_fts_update AFTER UPDATE OF pr_name, pr_cat, pr_sup_id
+    ON restapi_product BEGIN
+        DELETE FROM restapi_product_fts WHERE rowid = old.pr_id;
+        {};
+    END'''.format(SQLITE_INSERT.format(row='new')),
+    '''CREATE TRIGGER IF NOT EXISTS restapi_product_fts_delete AFTER DELETE ON restapi_product BEGIN
+        DELETE FROM restapi_product_fts WHERE rowid = old.pr_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS restapi_supplier_fts_update AFTER UPDATE OF sup_name ON restapi_supplier BEGIN
+        UPDATE restapi_product_fts SET sup_name = new.sup_name
+        WHERE rowid IN (SELECT pr_id FROM restapi_product WHERE pr_sup_id = new.sup_id);
+    END''',
+]
+
+SQLITE_REBUILD = [
+    'DELETE FROM restapi_product_fts',
+    '''INSERT INTO restapi_product_fts(rowid, pr_name, sup_name, pr_cat)
+    SELECT pr_id, pr_name, sup_name, pr_cat FROM restapi_product JOIN restapi_supplier ON sup_id = pr_sup_id''',
+]
+
+SQLITE_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS restapi_supplier_fts_update',
+    'DROP TRIGGER IF EXISTS restapi_product_fts_delete',
+    'DROP TRIGGER IF EXISTS restapi_product_fts_update',
+    'DROP TRIGGER IF EXISTS restapi_product_fts_insert',
+    'DROP TABLE IF EXISTS restapi_product_fts',
+]
+
+
+def get_config():
+    """Text search configuration of PostgreSQL; 'simple' doesn't stem, so prefixes match as typed."""
+    return getattr(settings, 'SEARCH_CONFIG', 'simple')
+
+
+def _execute(connection, statements):
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql.replace('{config}', get_config()) if connection.vendor == 'postgresql' else sql)
+
+
+def _statements(connection, name):
+    statements = {'postgresql': {'install': POSTGRES_INSTALL, 'rebuild': POSTGRES_REBUILD,
+                                 'uninstall': POSTGRES_UNINSTALL},
+                  'sqlite': {'install': SQLITE_INSTALL, 'rebuild': SQLITE_REBUILD, 'uninstall': SQLITE_UNINSTALL}}
+    return statements.get(connection.vendor, {}).get(name, [])
+
+
+def install(connection=connection):
+    """Create the index and its triggers if missing (SQLite drops triggers with a table rebuilt by a migration)."""
+    _execute(connection, _statements(connection, 'install'))
+
+
+def rebuild(connection=connection):
+    """Index every product again."""
+    _execute(connection, _statements(connection, 'rebuild'))
+
+
+def uninstall(connection=connection):
+    _execute(connection, _statements(connection, 'uninstall'))
+
+
+def get_terms(text):
+    return re.findall(r'\w+', text.lower())[:MAX_TERMS]
+
+
+def _match(terms):
+    """Query matching products whose names contain words starting with every term."""
+    if connection.vendor == 'postgresql':
+        return ' & '.join(term + ':*' for term in terms)
+    return ' '.join('"{}"*'.format(term) for term in terms)
+
+
+def _query(terms, category, select, tail, params=()):
+    if connection.vendor == 'postgresql':
+        sql = ('SELECT {} FROM restapi_product, to_tsquery(%s, %s) query WHERE search_vector @@ query'
+               .format(select))
+        args = [get_config(), _match(terms)]
+    else:
+        sql = 'SELECT {} FROM restapi_product_fts WHERE restapi_product_fts MATCH %s'.format(select)
+        args = [_match(terms)]
+    if category is not None:
+        sql += ' AND pr_cat = %s'
+        args.append(category)
+    with connection.cursor() as cursor:
+        cursor.execute(sql + tail, args + list(params))
+        return cursor.fetchall()
+
+
+def search(text, category=None, limit=50):
+    """Primary keys of best matching products, best first."""
+    terms = get_terms(text)
+    if not terms:
+        return []
+    if connection.vendor == 'postgresql':
+        select, tail = 'pr_id, ts_rank(search_vector, query) AS rank', ' ORDER BY rank DESC, pr_id LIMIT %s'
+    else:
+        # bm25() is lower for better matches, product name counts ten times more than supplier name
+        select, tail = 'rowid, bm25(restapi_product_fts, 10.0, 1.0) AS rank', ' ORDER BY rank, rowid LIMIT %s'
+    return [pk for pk, rank in _query(terms, category, select, tail, [limit])]
+
+
+def facets(text):
+    """Number of matching products in every category."""
+    terms = get_terms(text)
+    if not terms:
+        return {}
+    return dict(_query(terms, None, 'pr_cat, COUNT(*)', ' GROUP BY pr_cat ORDER BY pr_cat'))
@@ -1,3 +1,6 @@
+from datetime import timedelta
+
+from django.utils import timezone
 from rest_framework import serializers
 from restapi.models import Supplier, Product, Order, ProductsInOrders
 
@@ -19,13 +22,46 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ['or_id', 'or_start_date', 'or_is_finished', 'or_finish_date', 'or_is_sent', 'or_sent_date',
-                  'or_username']
+                  'or_username', 'or_total_price', 'or_items_count']
+        read_only_fields = ['or_total_price', 'or_items_count']
 
 
 class ProductsInOrdersSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductsInOrders
         fields = ['or_id', 'pr_id', 'amount']
+        extra_kwargs = {'amount': {'min_value': 1}}
+
+
+class OrderItemLineSerializer(serializers.Serializer):
+    """One line of a bulk order items request, products are validated by the view in one query."""
+    pr_id = serializers.IntegerField()
+    amount = serializers.IntegerField(min_value=1)
+
+
+class ProductSearchSerializer(serializers.Serializer):
+    """Query params of product search."""
+    q = serializers.CharField(max_length=200)
+    pr_cat = serializers.ChoiceField(choices=Product.CATEGORY_CHOICES, required=False)
+
+
+class SalesQuerySerializer(serializers.Serializer):
+    """Query params of sales reports, days of finishing orders (inclusive), the last 30 by default."""
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        attrs.setdefault('until', timezone.localdate())
+        attrs.setdefault('since', attrs['until'] - timedelta(days=29))
+        if attrs['since'] > attrs['until']:
+            raise serializers.ValidationError({'since': ['Must not be after until.']})
+        return attrs
+
+
+class StockSerializer(serializers.Serializer):
+    """Stock of a product, split over 'shards' rows (more for products ordered by many clients at once)."""
+    quantity = serializers.IntegerField(min_value=0)
+    shards = serializers.IntegerField(min_value=1, max_value=64, required=False)
 
 
 class ProductDetailSerializer(serializers.ModelSerializer):
@@ -48,4 +84,4 @@ class OrderGetSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ['or_id', 'or_start_date', 'or_is_finished', 'or_finish_date', 'or_is_sent', 'or_sent_date',
-                  'or_username', 'items_in_order']
+                  'or_username', 'or_total_price', 'or_items_count', 'items_in_order']
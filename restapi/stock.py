@@ -0,0 +1,125 @@
+import random
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from restapi.models import StockShard
+
+'''
+Stock of products, kept as StockShard rows whose quantities add up to it. Adding order lines reserves their amounts,
+changing or removing them reserves the difference of amounts (or releases it, when negative) in the transaction of
+the change. A reservation is a conditional update,
+'quantity = quantity - n WHERE quantity >= n', never a read-modify-write, so concurrent orders can't oversell; the
+check constraint of the column backs it. Units are taken from a random shard having enough of them, from several if
+none has, so concurrent orders of one product mostly wait on different rows. Products without shards are not tracked.
+'''
+
+# Rounds of taking units spread over shards, quantities are read again for every round
+MAX_ATTEMPTS = 5
+
+
+class OutOfStock(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Not enough products in stock.'
+    default_code = 'out_of_stock'
+
+
+class _Contended(Exception):
+    pass
+
+
+def _by_pk(units):
+    """Units of shards (pk: units) as an expression of the updated row."""
+    return Case(*[When(pk=pk, then=Value(count)) for pk, count in units.items()], output_field=IntegerField())
+
+
+def shards_of(product_ids):
+    """Shards (id, quantity) by product id, products without stock tracked are left out."""
+    shards = {}
+    for row in StockShard.objects.filter(product__in=product_ids).values('id', 'product', 'quantity'):
+        shards.setdefault(row['product'], []).append(row)
+    return shards
+
+
+def reserve(units):
+    """Reserve units of products ({product id: units}) of new order lines, see change(); units must be positive."""
+    invalid = sorted(pr_id for pr_id, count in units.items() if count <= 0)
+    if invalid:
+        raise ValueError('Reserved units of products {} are not positive.'.format(invalid))
+    change(units)
+
+
+def change(deltas):
+    """
+    Reserve differences of amounts of products ({product id: units}), release them for negative units. Must run in the
+    transaction of the order change, which is rolled back by OutOfStock raised when a product has fewer units left.
+    """
+    deltas = {pr_id: units for pr_id, units in deltas.items() if units}
+    shards = shards_of(deltas) if deltas else {}
+    releases, takes, taking, spread = {}, {}, [], []
+    for pr_id, rows in shards.items():
+        units = deltas[pr_id]
+        candidates = rows if units < 0 else [row for row in rows if row['quantity'] >= units]
+        if not candidates:
+            spread.append(pr_id)
+        elif units < 0:
+            releases[random.choice(candidates)['id']] = -units
+        else:
+            takes[random.choice(candidates)['id']] = units
+            taking.append(pr_id)
+    if releases:
+        StockShard.objects.filter(pk__in=releases).update(quantity=F('quantity') + _by_pk(releases))
+    if takes:
+        # All products in one update, unless a shard was drained since it was read
+        try:
+            with transaction.atomic():
+                taken = StockShard.objects.filter(pk__in=takes, quantity__gte=_by_pk(takes)).update(
+                    quantity=F('quantity') - _by_pk(takes))
+                if taken != len(takes):
+                    raise _Contended()
+        except _Contended:
+            spread.extend(taking)
+    for pr_id in sorted(spread):
+        take_spread(pr_id, deltas[pr_id])
+
+
+def take_spread(pr_id, units):
+    """Take units of a product from as many shards as needed."""
+    for _ in range(MAX_ATTEMPTS):
+        rows = list(StockShard.objects.filter(product=pr_id, quantity__gt=0).values('id', 'quantity'))
+        if sum(row['quantity'] for row in rows) < units:
+            break
+        random.shuffle(rows)
+        for row in rows:
+            part = min(row['quantity'], units)
+            if StockShard.objects.filter(pk=row['id'], quantity__gte=part).update(quantity=F('quantity') - part):
+                units -= part
+                if not units:
+                    return
+    raise OutOfStock('Not enough of product {} in stock.'.format(pr_id))
+
+
+def set_stock(pr_id, quantity, shards=None):
+    """Set stock of a product, split evenly over 'shards' (STOCK_SHARDS by default) rows."""
+    shards = shards or getattr(settings, 'STOCK_SHARDS', 8)
+    with transaction.atomic():
+        # Waits for transactions holding reservations of the product
+        list(StockShard.objects.select_for_update().filter(product=pr_id).values_list('pk'))
+        StockShard.objects.filter(product=pr_id).delete()
+        StockShard.objects.bulk_create([StockShard(product_id=pr_id, shard=shard,
+                                                   quantity=quantity // shards + (shard < quantity % shards))
+                                        for shard in range(shards)])
+
+
+def clear_stock(pr_id):
+    """Stop tracking stock of a product."""
+    StockShard.objects.filter(product=pr_id).delete()
+
+
+def get_stock(pr_id):
+    """Units in stock and number of shards, None for a product without stock tracked."""
+    stock = StockShard.objects.filter(product=pr_id).aggregate(quantity=Sum('quantity'), shards=Count('pk'))
+    return stock if stock['shards'] else None
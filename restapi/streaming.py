@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.utils import encoders
+
+from restapi.compiled import compile_serializer
+
+'''
+Streaming of whole lists: rows are read with a server-side cursor in chunks and written out as JSON array elements,
+so memory used by a request doesn't grow with the number of rows. Requested with 'stream' query param.
+'''
+
+
+def wants_stream(request):
+    return request.query_params.get('stream') in ('1', 'true')
+
+
+def iter_json_array(queryset, serializer_class, chunk_size):
+    compiled = compile_serializer(serializer_class)
+    encoder = encoders.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    separator = ''
+    yield '['
+    chunk = []
+    for row in compiled.values(queryset).iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield separator + ','.join(encoder.encode(item) for item in compiled.serialize_rows(chunk))
+            separator, chunk = ',', []
+    if chunk:
+        yield separator + ','.join(encoder.encode(item) for item in compiled.serialize_rows(chunk))
+    yield ']'
+
+
+def stream_list(queryset, serializer_class, chunk_size=None):
+    chunk_size = chunk_size or getattr(settings, 'STREAM_CHUNK_SIZE', 2000)
+    return StreamingHttpResponse(iter_json_array(queryset, serializer_class, chunk_size),
+                                 content_type='application/json')
+
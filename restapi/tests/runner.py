@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+'''
+Test runner of the project: requests of tests come from one client address and a few users, so throttles are off
+unless a test turns them on with override_settings(THROTTLE_ENABLED=True).
+'''
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.THROTTLE_ENABLED = False
@@ -0,0 +1,83 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from restapi.blacklist import BloomFilter, blacklist_filter
+from restapi.factories import GroupFactory, UserFactory
+from restapi.querycheck import QueryCheckMixin
+
+
+class TestBloomFilter(SimpleTestCase):
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000, 0.01)
+        items = ['jti-{}'.format(i) for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+        false_positives = sum('other-{}'.format(i) in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class TestTokenBlacklist(QueryCheckMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client = APIClient()
+        cls.pwd = 'secret_pass'
+        cls.user_employee = UserFactory(password=cls.pwd)
+        cls.user_employee.groups.add(GroupFactory(name='employee'))
+
+    def setUp(self):
+        cache.clear()
+        blacklist_filter.reset()
+        self.tokens = self.client.post(reverse('token'),
+                                       data={'username': self.user_employee.username, 'password': self.pwd}).data
+
+    def refresh(self, token):
+        return self.client.post(reverse('refresh-token'), data={'refresh': token})
+
+    def test_rotated_token_rejected(self):
+        response = self.refresh(self.tokens['refresh'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+        self.assertEqual(self.refresh(self.tokens['refresh']).status_code, status.HTTP_401_UNAUTHORIZED)
+        # Also when the filter has not seen the blacklisted token yet
+        blacklist_filter.reset()
+        blacklist_filter.sync()
+        blacklist_filter.filter = BloomFilter(blacklist_filter.min_capacity)
+        self.assertEqual(self.refresh(self.tokens['refresh']).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.refresh(response.data['refresh']).status_code, status.HTTP_200_OK)
+
+    def test_blacklist_query_skipped(self):
+        blacklist_filter.sync()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.refresh(self.tokens['refresh']).status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if 'token_blacklist_blacklistedtoken' in query['sql']
+                          and query['sql'].startswith('SELECT (1)')])
+
+    def test_compact(self):
+        self.refresh(self.tokens['refresh'])
+        OutstandingToken.objects.update(expires_at=aware_utcnow() - timedelta(seconds=1))
+        out = StringIO()
+        call_command('compact_token_blacklist', batch_size=1, stdout=out)
+        self.assertIn('1 expired tokens deleted', out.getvalue())
+        self.assertFalse(OutstandingToken.objects.exists())
+
+    def test_stats(self):
+        header = 'Bearer ' + self.tokens['access']
+        checks = blacklist_filter.stats['checks']
+        self.refresh(self.tokens['refresh'])
+        response = self.client.get(reverse('token-blacklist'), HTTP_AUTHORIZATION=header)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['blacklisted_tokens'], response.data['checks']), (1, checks + 1))
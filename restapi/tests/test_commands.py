@@ -0,0 +1,34 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+
+from restapi.models import Supplier
+
+
+class TestBenchCommand(TestCase):
+
+    def bench(self, *args):
+        call_command('bench', '--suppliers', '2', '--products', '5', '--customers', '2', '--orders', '4',
+                     '--lines', '2', '--requests', '3', '--warmup', '1', *args, stdout=StringIO())
+
+    def test_bench_results_and_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+            self.bench('--output', output)
+            with open(output) as file:
+                results = json.load(file)['endpoints']
+            self.assertEqual(results['order-detail']['queries'], 5)
+            self.assertEqual(set(results['index']), {'p50_ms', 'p95_ms', 'p99_ms', 'rps', 'queries', 'sql_ms',
+                                                     'peak_kb'})
+            # Seeded rows are rolled back
+            self.assertFalse(Supplier.objects.exists())
+
+            results['order-detail']['queries'] = 4
+            with open(output, 'w') as file:
+                json.dump({'endpoints': results}, file)
+            with self.assertRaisesMessage(CommandError, 'order-detail: queries 4 -> 5.0'):
+                self.bench('--endpoint', 'order-detail', '--baseline', output, '--tolerance', '100')
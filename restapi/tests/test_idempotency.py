@@ -0,0 +1,81 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+from rest_framework.views import APIView
+
+from restapi import idempotency
+from restapi.authentication import RoleTokenAuthentication
+from restapi.factories import GroupFactory, UserFactory, SupplierFactory, ProductFactory, OrderFactory
+from restapi.models import Order, ProductsInOrders, IdempotencyKey
+from restapi.querycheck import QueryCheckMixin
+
+
+class TestIdempotencyKey(QueryCheckMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client = APIClient()
+        cls.pwd = 'secret_pass'
+        cls.user_customer = UserFactory(password=cls.pwd)
+        cls.user_customer.groups.add(GroupFactory(name='customer'))
+        cls.test_order = OrderFactory(or_username=cls.user_customer)
+        cls.test_product = ProductFactory(pr_sup=SupplierFactory())
+        cls.url_items = reverse('order-item', kwargs={'pk': cls.test_order.or_id})
+
+    def setUp(self):
+        token = self.client.post(reverse('token'), data={'username': self.user_customer.username, 'password': self.pwd})
+        self.header = 'Bearer ' + token.data['access']
+
+    def post(self, url, data, key):
+        return self.client.post(url, data, format='json', HTTP_AUTHORIZATION=self.header, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_order_create_replayed(self):
+        first = self.post(reverse('order-list'), {}, 'order-1')
+        retry = self.post(reverse('order-list'), {}, 'order-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((retry.status_code, retry.json()), (first.status_code, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.filter(or_username=self.user_customer).count(), 2)
+        # Another key is another order
+        self.assertEqual(self.post(reverse('order-list'), {}, 'order-2').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.filter(or_username=self.user_customer).count(), 3)
+
+    def test_order_create_replayed_stateless_authentication(self):
+        # request.user is a RoleTokenUser built from token claims, not a model instance
+        with mock.patch.object(APIView, 'authentication_classes', [RoleTokenAuthentication]):
+            first = self.post(reverse('order-list'), {}, 'order-1')
+            retry = self.post(reverse('order-list'), {}, 'order-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((retry.status_code, retry.json()), (first.status_code, first.json()))
+        self.assertEqual(IdempotencyKey.objects.get(key='order-1').user, self.user_customer)
+
+    def test_order_item_create_replayed(self):
+        data = [{'pr_id': self.test_product.pr_id, 'amount': 2}]
+        for _ in range(3):
+            response = self.post(self.url_items, data, 'items-1')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ProductsInOrders.objects.get(or_id=self.test_order).amount, 2)
+        self.assertEqual(Order.objects.get(pk=self.test_order.pk).or_items_count, 1)
+        # Validation errors are stored too, a key can't be reused for another body
+        invalid = self.post(self.url_items, [{'pr_id': 0, 'amount': 1}], 'items-2')
+        self.assertEqual(invalid.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.post(self.url_items, [{'pr_id': 0, 'amount': 1}], 'items-2').json(), invalid.json())
+        self.assertEqual(self.post(self.url_items, data, 'items-2').status_code,
+                         status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0.1)
+    def test_request_in_progress(self):
+        data = [{'pr_id': self.test_product.pr_id, 'amount': 2}]
+        self.post(self.url_items, data, 'items-1')
+        IdempotencyKey.objects.update(status_code=None)
+        self.assertEqual(self.post(self.url_items, data, 'items-1').status_code, status.HTTP_409_CONFLICT)
+        # Abandoned by the first request
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(self.post(self.url_items, data, 'items-1').status_code, status.HTTP_201_CREATED)
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(idempotency.purge_expired(), 1)
@@ -0,0 +1,66 @@
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from restapi.factories import GroupFactory, UserFactory
+from restapi.metrics import registry
+from restapi.querycheck import QueryCheckMixin
+
+
+class TestMetrics(QueryCheckMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client = APIClient()
+        cls.pwd = 'secret_pass'
+        cls.user_customer = UserFactory(password=cls.pwd)
+        cls.user_customer.groups.add(GroupFactory(name='customer'))
+        cls.user_employee = UserFactory(password=cls.pwd)
+        cls.user_employee.groups.add(GroupFactory(name='employee'))
+
+    def setUp(self):
+        registry.clear()
+
+    def header(self, user):
+        response = self.client.post(reverse('token'), data={'username': user.username, 'password': self.pwd})
+        return 'Bearer ' + response.data['access']
+
+    def test_server_timing(self):
+        response = self.client.get(reverse('order-list'), HTTP_AUTHORIZATION=self.header(self.user_employee))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        phases = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        for phase in ('auth', 'perm', 'db', 'serialize', 'render', 'total'):
+            self.assertIn(phase, phases)
+
+    def test_server_timing_only_for_employees(self):
+        response = self.client.get(reverse('order-list'), HTTP_AUTHORIZATION=self.header(self.user_customer))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Server-Timing', response)
+        response = self.client.get(reverse('product-list'))
+        self.assertNotIn('Server-Timing', response)
+        # Phases are recorded all the same
+        self.assertIn('api_request_phase_seconds_count{phase="db",route="/api/orders"} 1', registry.render())
+        with self.settings(DEBUG=True):
+            response = self.client.get(reverse('product-list'))
+        self.assertIn('Server-Timing', response)
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_not_sampled(self):
+        response = self.client.get(reverse('order-list'), HTTP_AUTHORIZATION=self.header(self.user_employee))
+        self.assertNotIn('Server-Timing', response)
+        text = registry.render()
+        self.assertIn('api_request_duration_seconds_count{method="GET",route="/api/orders",status="2xx"} 1', text)
+        self.assertNotIn('api_request_phase_seconds', text)
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('order-list'), HTTP_AUTHORIZATION=self.header(self.user_employee))
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION=self.header(self.user_customer))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION=self.header(self.user_employee))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        self.assertIn('# TYPE api_request_phase_seconds histogram', text)
+        self.assertIn('api_request_queries_bucket{route="/api/orders",le="+Inf"} 1', text)
+        self.assertIn('api_request_phase_seconds_count{phase="db",route="/api/orders"} 1', text)
@@ -1,7 +1,10 @@
+from io import StringIO
+from django.core.management import call_command, CommandError
+from django.db import transaction
 from rest_framework.test import APITestCase
-from restapi.models import Supplier, Product, Order, ProductsInOrders
+from restapi.models import Supplier, Product, Order, ProductsInOrders, User
 from restapi.factories import SupplierFactory, ProductFactory, UserFactory, OrderFactory, ProductsInOrdersFactory, \
-    GroupFactory
+    GroupFactory, seed_dataset
 
 
 class TestModelSupplier(APITestCase):
@@ -34,6 +37,17 @@ class TestModelOrder(APITestCase):
         self.assertIsInstance(self.test_order, Order)
         self.assertIsNotNone(self.test_order.or_start_date)
 
+    def test_order_compare_and_set(self):
+        version = self.test_order.version
+        self.assertTrue(Order.add_item_totals(self.test_order.pk, 10, 1, version=version))
+        # Stale version
+        self.assertFalse(Order.compare_and_set(self.test_order.pk, version, or_is_finished=True))
+        self.assertTrue(Order.compare_and_set(self.test_order.pk, version + 1, or_is_finished=True))
+        # Finished order
+        self.assertFalse(Order.add_item_totals(self.test_order.pk, 10, 1, version=version + 2))
+        order = Order.objects.get(pk=self.test_order.pk)
+        self.assertEqual((order.or_is_finished, order.or_items_count, order.version), (True, 1, version + 2))
+
 
 class TestModelProductsInOrder(APITestCase):
 
@@ -47,6 +61,17 @@ class TestModelProductsInOrder(APITestCase):
         self.test_item = ProductsInOrdersFactory(or_id=self.test_order, pr_id=self.test_product)
         self.assertIsInstance(self.test_item, ProductsInOrders)
 
+    def test_recalculate_order_totals(self):
+        self.test_item = ProductsInOrdersFactory(or_id=self.test_order, pr_id=self.test_product)
+        Order.objects.filter(pk=self.test_order.pk).update(or_total_price=0, or_items_count=0)
+        with self.assertRaises(CommandError):
+            call_command('recalculate_order_totals', '--check', stdout=StringIO())
+        call_command('recalculate_order_totals', stdout=StringIO())
+        self.test_order.refresh_from_db()
+        self.assertEqual(self.test_order.or_total_price, self.test_item.line_price)
+        self.assertEqual(self.test_order.or_items_count, 1)
+        call_command('recalculate_order_totals', '--check', stdout=StringIO())
+
 
 class TestModelUser(APITestCase):
 
@@ -58,3 +83,27 @@ class TestModelUser(APITestCase):
     def test_is_user_in_group(self):
         self.assertEqual(self.user_employee.groups.filter(name='employee').exists(), True)
         self.assertEqual(self.user_employee.groups.filter(name='customer').exists(), False)
+
+
+class TestSeedDataset(APITestCase):
+
+    def seed(self, seed):
+        with transaction.atomic():
+            pks = seed_dataset(seed, suppliers=3, products=10, customers=4, employees=1, orders=20, lines=3,
+                               batch_size=7)
+            rows = (list(Product.objects.order_by('pk').values_list('pk', 'pr_name', 'pr_price', 'pr_sup')),
+                    list(ProductsInOrders.objects.order_by('or_id', 'pr_id').values_list('or_id', 'pr_id', 'amount')),
+                    list(Order.objects.order_by('pk').values_list('or_username', 'or_total_price', 'or_items_count')))
+            passwords = set(User.objects.filter(pk__in=pks['customers']).values_list('password', flat=True))
+            call_command('recalculate_order_totals', '--check', stdout=StringIO())
+            transaction.set_rollback(True)
+        return pks, rows, passwords
+
+    def test_seed_dataset(self):
+        pks, rows, passwords = self.seed(1)
+        self.assertEqual(len(pks['orders']), 20)
+        self.assertEqual(len(rows[1]), 60)
+        self.assertEqual(len(passwords), 1)
+        self.assertTrue(User(password=passwords.pop()).check_password('abc123'))
+        self.assertEqual(self.seed(1)[1], rows)
+        self.assertNotEqual(self.seed(2)[1], rows)
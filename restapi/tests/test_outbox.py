@@ -0,0 +1,93 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from restapi import outbox
+from restapi.factories import GroupFactory, UserFactory, OrderFactory
+from restapi.models import OutboxEvent
+from restapi.querycheck import QueryCheckMixin
+
+handled = []
+
+
+def record_event(event, payload):
+    handled.append((event.topic, payload))
+
+
+def fail_event(event, payload):
+    raise ConnectionError('Service unavailable')
+
+
+@override_settings(OUTBOX_HANDLERS={outbox.ORDER_FINISHED: ['restapi.tests.test_outbox.record_event']})
+class TestOrderEvents(QueryCheckMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client = APIClient()
+        cls.user_customer = UserFactory(password='secret_pass')
+        cls.user_customer.groups.add(GroupFactory(name='customer'))
+        cls.order = OrderFactory(or_username=cls.user_customer)
+
+    def setUp(self):
+        handled.clear()
+
+    def test_finished_order_handled_by_worker(self):
+        self.client.force_authenticate(self.user_customer)
+        response = self.client.put(reverse('order-detail', args=[self.order.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Handlers run outside the request
+        self.assertEqual(handled, [])
+        self.assertEqual(OutboxEvent.objects.get().topic, outbox.ORDER_FINISHED)
+        out = StringIO()
+        call_command('outbox_worker', workers=1, once=True, stdout=out)
+        self.assertIn('1 events handled, 0 failed attempts', out.getvalue())
+        self.assertEqual(len(handled), 1)
+        self.assertEqual(handled[0][1]['or_id'], self.order.pk)
+        self.assertEqual(handled[0][1]['or_username'], self.user_customer.pk)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+
+class TestOutboxWorker(TestCase):
+
+    def test_claims_are_disjoint(self):
+        for number in range(5):
+            outbox.publish('test', number=number)
+        first, second = outbox.claim('first', 2), outbox.claim('second', 10)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 3)
+        self.assertFalse({event.pk for event in first} & {event.pk for event in second})
+        self.assertEqual(outbox.claim('third', 10), [])
+
+    def test_expired_lease_left_to_new_claim(self):
+        outbox.publish('test')
+        stale = outbox.claim('first', 10)
+        # Lease of the first worker ran out while it was handling the event, another worker claimed it
+        OutboxEvent.objects.update(available_at=timezone.now())
+        self.assertEqual(len(outbox.claim('second', 10)), 1)
+        with self.assertLogs('restapi.outbox', 'WARNING'):
+            self.assertEqual(outbox.process(stale), (1, 0))
+        with override_settings(OUTBOX_HANDLERS={'test': ['restapi.tests.test_outbox.fail_event']}):
+            self.assertEqual(outbox.process(stale), (0, 1))
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.claimed_by, event.attempts, event.last_error), ('second', 0, ''))
+
+    @override_settings(OUTBOX_HANDLERS={'test': ['restapi.tests.test_outbox.fail_event']}, OUTBOX_MAX_ATTEMPTS=2)
+    def test_retries_with_backoff(self):
+        event = outbox.publish('test')
+        with self.assertLogs('restapi.outbox', 'ERROR'):
+            self.assertEqual(outbox.work(once=True), (0, 1))
+            event.refresh_from_db()
+            self.assertEqual((event.status, event.attempts), (OutboxEvent.PENDING, 1))
+            self.assertIn('ConnectionError: Service unavailable', event.last_error)
+            self.assertGreater(event.available_at, timezone.now())
+            # Not available before the delay passes
+            self.assertEqual(outbox.work(once=True), (0, 0))
+            OutboxEvent.objects.update(available_at=timezone.now())
+            self.assertEqual(outbox.work(once=True), (0, 1))
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), (OutboxEvent.FAILED, 2))
@@ -0,0 +1,56 @@
+import sqlite3
+import threading
+
+from django.db.utils import OperationalError
+from django.test import SimpleTestCase
+
+from restapi.db.pool import ConnectionPool
+
+
+def connect():
+    return sqlite3.connect(':memory:', check_same_thread=False)
+
+
+class TestConnectionPool(SimpleTestCase):
+
+    def test_pool_reuses_connections(self):
+        pool = ConnectionPool(max_size=2, ping_after=0)
+        connection = pool.checkout(connect)
+        connection.execute('CREATE TABLE t (a INTEGER)')
+        connection.execute('BEGIN')
+        connection.execute('INSERT INTO t VALUES (1)')
+        pool.checkin(connection)
+        # Same connection, open transaction was rolled back
+        self.assertIs(pool.checkout(connect), connection)
+        self.assertEqual(connection.execute('SELECT COUNT(*) FROM t').fetchone(), (0,))
+        stats = pool.stats()
+        self.assertEqual((stats['in_use'], stats['idle'], stats['opened'], stats['checkouts']), (1, 0, 1, 2))
+
+    def test_pool_replaces_broken_and_expired_connections(self):
+        pool = ConnectionPool(max_size=2, ping_after=0)
+        connection = pool.checkout(connect)
+        pool.checkin(connection)
+        connection.close()
+        replacement = pool.checkout(connect)
+        self.assertIsNot(replacement, connection)
+        pool.max_age = 0
+        pool.checkin(replacement)
+        self.assertEqual(pool.stats()['idle'], 0)
+        self.assertEqual(pool.stats()['recycled'], 2)
+
+    def test_pool_is_bounded(self):
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+        connection = pool.checkout(connect)
+        with self.assertRaises(OperationalError):
+            pool.checkout(connect)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+
+        # A waiting thread gets the connection given back
+        result = []
+        thread = threading.Thread(target=lambda: result.append(pool.checkout(connect)))
+        pool.timeout = 5
+        thread.start()
+        pool.checkin(connection)
+        thread.join()
+        self.assertEqual(result, [connection])
+        self.assertEqual(pool.stats()['opened'], 1)
@@ -0,0 +1,74 @@
+from contextlib import ExitStack
+
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient, APITestCase
+
+from restapi.factories import GroupFactory, UserFactory, SupplierFactory, ProductFactory, OrderFactory, \
+    ProductsInOrdersFactory
+from restapi.models import Order, Product
+from restapi.querycheck import QueryCheckMiddleware, QueryCheckMixin, QueryRecorder, fingerprint
+from restapi.serializers import OrderGetSerializer
+
+
+class TestQueryRecorder(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        order = OrderFactory(or_username=UserFactory())
+        supplier = SupplierFactory()
+        for _ in range(6):
+            ProductsInOrdersFactory(or_id=order, pr_id=ProductFactory(pr_sup=supplier))
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint('SELECT * FROM "t"  WHERE "id" IN (%s, %s, %s) AND "name" = \'a\' LIMIT 21'),
+                         fingerprint('SELECT * FROM "t" WHERE "id" IN (%s) AND "name" = \'b\' LIMIT 1'))
+
+    def test_repeated_query(self):
+        recorder = QueryRecorder(threshold=5)
+        with ExitStack() as stack:
+            recorder.install(stack)
+            # Products of items are loaded one by one by the nested serializer
+            OrderGetSerializer(Order.objects.all(), many=True).data
+        violations = recorder.finish()
+        self.assertEqual([(violation.kind, violation.detail) for violation in violations],
+                         [('repeated query', '6 times')])
+        self.assertIn('restapi_product', violations[0].sql)
+        self.assertIn('test_repeated_query', [frame.name for frame in violations[0].stack])
+
+    @override_settings(QUERY_CHECK_SAMPLE_RATE=1.0, QUERY_SLOW_SECONDS=0)
+    def test_middleware_logs_violations(self):
+        def view(request):
+            list(Product.objects.all())
+
+        middleware = QueryCheckMiddleware(view)
+        with self.assertLogs('restapi.queries', 'WARNING') as logs:
+            middleware(RequestFactory().get('/api/products'))
+        self.assertIn('GET /api/products: 1 query violation(s)\nslow query', logs.output[0])
+
+
+class TestQueryCheckMixin(QueryCheckMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client = APIClient()
+        cls.user_employee = UserFactory(password='secret_pass')
+        cls.user_employee.groups.add(GroupFactory(name='employee'))
+
+    @override_settings(QUERY_REPEAT_THRESHOLD=0)
+    def test_request_violations_collected(self):
+        self.client.force_authenticate(self.user_employee)
+        self.client.get(reverse('order-list'))
+        self.assertTrue(self.query_violations)
+        self.assertIn('GET /api/orders', self.query_violations[0])
+        # Expected here, the test would fail with them
+        self.query_violations.clear()
+
+    @override_settings(QUERY_SLOW_SECONDS=0)
+    def test_slow_queries_logged(self):
+        self.client.force_authenticate(self.user_employee)
+        with self.assertLogs('restapi.queries', 'WARNING') as logs:
+            self.client.get(reverse('order-list'))
+        self.assertIn('GET /api/orders', logs.output[0])
+        self.assertNotIn('repeated query', logs.output[0])
+        self.assertEqual(self.query_violations, [])
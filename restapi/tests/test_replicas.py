@@ -0,0 +1,133 @@
+import os
+import tempfile
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.test import override_settings
+from django.test.client import ClientHandler
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from restapi import replicas
+from restapi.factories import GroupFactory, UserFactory, SupplierFactory, ProductFactory
+from restapi.models import User
+from restapi.querycheck import QueryCheckMixin
+
+'''
+The replica is a second SQLite file which is never written to by the tests, so a read served from it misses rows
+created on the primary. Markers of writes are kept in a file cache, which all processes can share.
+'''
+
+
+def add_database(alias, name):
+    connections.databases[alias] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': name}
+    connections.ensure_defaults(alias)
+    connections.prepare_test_settings(alias)
+
+
+def remove_database(alias):
+    connections[alias].close()
+    del connections[alias]
+    del connections.databases[alias]
+
+
+@override_settings(DATABASE_REPLICAS={'replica': 1})
+class TestReadReplicas(QueryCheckMixin, APITestCase):
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.sticky_cache = override_settings(REPLICA_STICKY_CACHE='sticky', CACHES=dict(settings.CACHES, sticky={
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(cls.directory.name, 'cache'),
+        }))
+        cls.sticky_cache.enable()
+        add_database('replica', os.path.join(cls.directory.name, 'replica.sqlite3'))
+        # Tables of the models are enough, data migrations of some apps don't support other databases
+        with connections['replica'].schema_editor() as editor:
+            for model in apps.get_models():
+                editor.create_model(model)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        remove_database('replica')
+        cls.sticky_cache.disable()
+        cls.directory.cleanup()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client = APIClient()
+        cls.pwd = 'secret_pass'
+        cls.user_customer = UserFactory(password=cls.pwd)
+        cls.user_customer.groups.add(GroupFactory(name='customer'))
+        cls.user_employee = UserFactory(password=cls.pwd)
+        cls.user_employee.groups.add(GroupFactory(name='employee'))
+        # Users are replicated, catalog and orders are not yet
+        for user in (cls.user_customer, cls.user_employee):
+            group = user.groups.get()
+            group.save(using='replica')
+            user.save(using='replica')
+            User.groups.through.objects.using('replica').create(user=user, group=group)
+        cls.product = ProductFactory(pr_sup=SupplierFactory())
+
+    def setUp(self):
+        caches['sticky'].clear()
+        replicas._ejected.clear()
+
+    def header(self, user):
+        token = self.client.post(reverse('token'), data={'username': user.username, 'password': self.pwd})
+        return 'Bearer ' + token.data['access']
+
+    def test_safe_requests_read_from_replica(self):
+        header = self.header(self.user_employee)
+        url = reverse('supplier-detail', args=[self.product.pr_sup_id])
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=header).status_code, status.HTTP_404_NOT_FOUND)
+        # Unsafe requests read and write the primary
+        response = self.client.patch(url, {'sup_city': 'Gdansk'}, HTTP_AUTHORIZATION=header)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_reads_stick_to_primary_after_write(self):
+        header = self.header(self.user_customer)
+        other_header = self.header(self.user_employee)
+        response = self.client.post(reverse('order-list'), {}, HTTP_AUTHORIZATION=header)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        url = reverse('order-detail', args=[response.data['or_id']])
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=header).status_code, status.HTTP_200_OK)
+        # Other clients still read from the replica
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=other_header).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        # Window is over
+        caches['sticky'].clear()
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=header).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_failed_replica_is_ejected(self):
+        header = self.header(self.user_employee)
+        url = reverse('supplier-detail', args=[self.product.pr_sup_id])
+        add_database('broken', os.path.join(self.directory.name, 'missing', 'broken.sqlite3'))
+        try:
+            with self.settings(DATABASE_REPLICAS={'broken': 1, 'replica': 0}):
+                # No healthy replica left, the primary answers
+                self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=header).status_code, status.HTTP_200_OK)
+                self.assertEqual(replicas.healthy_replicas(), {})
+            with self.settings(DATABASE_REPLICAS={'broken': 5, 'replica': 1}):
+                for _ in range(3):
+                    self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=header).status_code,
+                                     status.HTTP_404_NOT_FOUND)
+        finally:
+            remove_database('broken')
+
+    def test_local_sticky_cache_is_rejected(self):
+        for backend in ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache'):
+            with self.settings(CACHES=dict(settings.CACHES, sticky={'BACKEND': backend})):
+                with self.assertRaises(ImproperlyConfigured):
+                    ClientHandler().load_middleware()
+        with self.settings(DATABASE_REPLICAS={}, CACHES=dict(settings.CACHES, sticky={
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'})):
+            ClientHandler().load_middleware()
@@ -0,0 +1,93 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from restapi.factories import GroupFactory, UserFactory, SupplierFactory, ProductFactory, OrderFactory, \
+    ProductsInOrdersFactory
+from restapi.models import DailySales
+from restapi.querycheck import QueryCheckMixin
+from restapi.serializers import ProductSerializer
+
+
+class TestSalesRollups(QueryCheckMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client = APIClient()
+        cls.pwd = 'secret_pass'
+        cls.user_customer = UserFactory(password=cls.pwd)
+        cls.user_customer.groups.add(GroupFactory(name='customer'))
+        cls.user_employee = UserFactory(password=cls.pwd)
+        cls.user_employee.groups.add(GroupFactory(name='employee'))
+        cls.supplier1, cls.supplier2 = SupplierFactory(), SupplierFactory()
+        cls.pipe = ProductFactory(pr_sup=cls.supplier1, pr_price=Decimal('10.00'))
+        cls.valve = ProductFactory(pr_sup=cls.supplier2, pr_cat='VA', pr_price=Decimal('2.50'))
+        cls.order1 = OrderFactory(or_username=cls.user_customer)
+        ProductsInOrdersFactory(or_id=cls.order1, pr_id=cls.pipe, amount=3)
+        ProductsInOrdersFactory(or_id=cls.order1, pr_id=cls.valve, amount=4)
+        cls.order2 = OrderFactory(or_username=cls.user_customer)
+        ProductsInOrdersFactory(or_id=cls.order2, pr_id=cls.pipe, amount=1)
+
+    def setUp(self):
+        self.customer = 'Bearer ' + self.token(self.user_customer)
+        self.employee = 'Bearer ' + self.token(self.user_employee)
+
+    def token(self, user):
+        return self.client.post(reverse('token'), data={'username': user.username, 'password': self.pwd}).data['access']
+
+    def finish(self, order):
+        response = self.client.put(reverse('order-detail', args=[order.or_id]), HTTP_AUTHORIZATION=self.customer)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def report(self, dimension, **params):
+        response = self.client.get(reverse('sales-report', args=[dimension]), params, HTTP_AUTHORIZATION=self.employee)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['results']
+
+    def rollups(self):
+        return sorted(DailySales.objects.values_list('day', 'product', 'revenue', 'units'))
+
+    def test_finished_orders_reported(self):
+        self.finish(self.order1)
+        self.finish(self.order2)
+        today = timezone.localdate()
+        self.assertEqual(self.report('products'), [
+            {'product': self.pipe.pk, 'pr_name': self.pipe.pr_name, 'revenue': Decimal('40.00'), 'units': 4},
+            {'product': self.valve.pk, 'pr_name': self.valve.pr_name, 'revenue': Decimal('10.00'), 'units': 4}])
+        self.assertEqual([row['supplier'] for row in self.report('suppliers')], [self.supplier1.pk, self.supplier2.pk])
+        self.assertEqual(self.report('categories'), [
+            {'category': 'PI', 'revenue': Decimal('40.00'), 'units': 4, 'cat_name': 'Pipes'},
+            {'category': 'VA', 'revenue': Decimal('10.00'), 'units': 4, 'cat_name': 'Valves'}])
+        self.assertEqual(self.report('days', since=today, until=today),
+                         [{'day': today, 'revenue': Decimal('50.00'), 'units': 8}])
+        yesterday = today - timedelta(days=1)
+        self.assertEqual(self.report('days', since=yesterday, until=yesterday), [])
+
+    def test_rollups_follow_changes(self):
+        self.finish(self.order1)
+        self.finish(self.order2)
+        data = ProductSerializer(self.pipe).data
+        data['pr_price'] = '11.00'
+        self.client.put(reverse('product-detail', args=[self.pipe.pk]), data, HTTP_AUTHORIZATION=self.employee)
+        self.assertEqual([row['revenue'] for row in self.report('products')], [Decimal('44.00'), Decimal('10.00')])
+        # Incremental changes give the same rows as a rebuild
+        incremental = self.rollups()
+        out = StringIO()
+        call_command('rebuild_sales_rollups', stdout=out)
+        self.assertIn('2 sales rollup rows rebuilt', out.getvalue())
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_sales_report_permissions_and_params(self):
+        url = reverse('sales-report', args=['days'])
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=self.customer).status_code,
+                         status.HTTP_403_FORBIDDEN)
+        response = self.client.get(url, {'since': '2020-02-01', 'until': '2020-01-01'}, HTTP_AUTHORIZATION=self.employee)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(reverse('sales-report', args=['days']).replace('days', 'weeks'),
+                                         HTTP_AUTHORIZATION=self.employee).status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,39 @@
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from restapi.compiled import compile_serializer
+from restapi.models import Supplier, Product, Order
+from restapi.serializers import SupplierSerializer, ProductSerializer, OrderSerializer, OrderGetSerializer
+from restapi.factories import SupplierFactory, ProductFactory, UserFactory, OrderFactory, ProductsInOrdersFactory
+
+
+class TestCompiledSerializer(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.test_supplier = SupplierFactory()
+        cls.test_product1 = ProductFactory(pr_sup=cls.test_supplier)
+        cls.test_product2 = ProductFactory(pr_sup=cls.test_supplier, pr_cat='VA')
+        cls.test_user = UserFactory()
+        cls.test_order1 = OrderFactory(or_username=cls.test_user)
+        cls.test_order2 = OrderFactory(or_username=cls.test_user, or_is_finished=True, or_finish_date=timezone.now())
+        cls.test_order3 = OrderFactory(or_username=cls.test_user)
+        ProductsInOrdersFactory(or_id=cls.test_order1, pr_id=cls.test_product1)
+        ProductsInOrdersFactory(or_id=cls.test_order1, pr_id=cls.test_product2)
+        ProductsInOrdersFactory(or_id=cls.test_order2, pr_id=cls.test_product2)
+
+    def assertSameJSON(self, serializer_class, queryset):
+        expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        compiled = JSONRenderer().render(compile_serializer(serializer_class).serialize(queryset))
+        self.assertEqual(compiled, expected)
+
+    def test_compiled_flat_serializers(self):
+        self.assertSameJSON(SupplierSerializer, Supplier.objects.order_by('pk'))
+        self.assertSameJSON(ProductSerializer, Product.objects.order_by('pk'))
+        self.assertSameJSON(OrderSerializer, Order.objects.order_by('pk'))
+
+    def test_compiled_nested_serializer(self):
+        self.assertSameJSON(OrderGetSerializer, Order.objects.order_by('pk'))
+        with self.assertNumQueries(2):
+            compile_serializer(OrderGetSerializer).serialize(Order.objects.all())
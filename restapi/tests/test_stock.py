@@ -0,0 +1,155 @@
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import Sum
+from django.test import TransactionTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from restapi import stock
+from restapi.management.commands import stress_stock
+from restapi.factories import GroupFactory, UserFactory, SupplierFactory, ProductFactory, OrderFactory
+from restapi.models import Order, ProductsInOrders, StockShard
+from restapi.querycheck import QueryCheckMixin
+
+
+class TestStock(QueryCheckMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client = APIClient()
+        cls.pwd = 'secret_pass'
+        cls.user_customer = UserFactory(password=cls.pwd)
+        cls.user_customer.groups.add(GroupFactory(name='customer'))
+        cls.user_employee = UserFactory(password=cls.pwd)
+        cls.user_employee.groups.add(GroupFactory(name='employee'))
+        supplier = SupplierFactory()
+        cls.product1 = ProductFactory(pr_sup=supplier, pr_price=Decimal('2.00'))
+        cls.product2 = ProductFactory(pr_sup=supplier, pr_price=Decimal('3.00'))
+        cls.order = OrderFactory(or_username=cls.user_customer)
+
+    def setUp(self):
+        self.customer = 'Bearer ' + self.token(self.user_customer)
+        self.employee = 'Bearer ' + self.token(self.user_employee)
+        stock.set_stock(self.product1.pk, 10, shards=4)
+        self.url = reverse('order-item', args=[self.order.pk])
+
+    def token(self, user):
+        return self.client.post(reverse('token'), data={'username': user.username, 'password': self.pwd}).data['access']
+
+    def quantity(self, product):
+        return stock.get_stock(product.pk)['quantity']
+
+    def test_set_stock(self):
+        url = reverse('product-stock', args=[self.product1.pk])
+        self.assertEqual(self.client.put(url, {'quantity': 5}, HTTP_AUTHORIZATION=self.customer).status_code,
+                         status.HTTP_403_FORBIDDEN)
+        response = self.client.put(url, {'quantity': 7, 'shards': 3}, HTTP_AUTHORIZATION=self.employee)
+        self.assertEqual(response.data, {'quantity': 7, 'shards': 3})
+        self.assertEqual(sorted(StockShard.objects.values_list('quantity', flat=True)), [2, 2, 3])
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=self.customer).data, {'quantity': 7, 'shards': 3})
+        self.client.delete(url, HTTP_AUTHORIZATION=self.employee)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=self.customer).data, {'quantity': None, 'shards': 0})
+
+    def test_reserve_and_release(self):
+        # No shard has 9 units, they are taken from several
+        response = self.client.post(self.url, [{'pr_id': self.product1.pk, 'amount': 9},
+                                               {'pr_id': self.product2.pk, 'amount': 100}], format='json',
+                                    HTTP_AUTHORIZATION=self.customer)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.quantity(self.product1), 1)
+        self.client.patch(self.url, [{'pr_id': self.product1.pk, 'amount': 4}], format='json',
+                          HTTP_AUTHORIZATION=self.customer)
+        self.assertEqual(self.quantity(self.product1), 6)
+        item = ProductsInOrders.objects.get(or_id=self.order, pr_id=self.product1)
+        self.client.put(reverse('order-item-detail', args=[self.order.pk, item.pk]), {'amount': 10},
+                        HTTP_AUTHORIZATION=self.customer)
+        self.assertEqual(self.quantity(self.product1), 0)
+        self.client.delete(reverse('order-item-detail', args=[self.order.pk, item.pk]),
+                           HTTP_AUTHORIZATION=self.customer)
+        self.assertEqual(self.quantity(self.product1), 10)
+        self.assertFalse(StockShard.objects.filter(product=self.product2).exists())
+
+    def test_item_product_change_keeps_stock(self):
+        stock.set_stock(self.product2.pk, 10)
+        self.client.post(self.url, {'pr_id': self.product1.pk, 'amount': 2}, format='json',
+                         HTTP_AUTHORIZATION=self.customer)
+        item = ProductsInOrders.objects.get(or_id=self.order, pr_id=self.product1)
+        response = self.client.put(reverse('order-item-detail', args=[self.order.pk, item.pk]),
+                                   {'pr_id': self.product2.pk, 'amount': 3}, HTTP_AUTHORIZATION=self.customer)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual((self.quantity(self.product1), self.quantity(self.product2)), (8, 10))
+
+    def test_out_of_stock(self):
+        response = self.client.post(self.url, [{'pr_id': self.product1.pk, 'amount': 11},
+                                               {'pr_id': self.product2.pk, 'amount': 1}], format='json',
+                                    HTTP_AUTHORIZATION=self.customer)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['detail'].code, 'out_of_stock')
+        # Nothing of the request was kept
+        self.assertFalse(ProductsInOrders.objects.filter(or_id=self.order).exists())
+        self.assertEqual(Order.objects.get(pk=self.order.pk).or_total_price, 0)
+        self.assertEqual(self.quantity(self.product1), 10)
+
+    def test_non_positive_amount(self):
+        self.client.post(self.url, {'pr_id': self.product1.pk, 'amount': 2}, format='json',
+                         HTTP_AUTHORIZATION=self.customer)
+        item = ProductsInOrders.objects.get(or_id=self.order, pr_id=self.product1)
+        for amount in (0, -100):
+            response = self.client.post(self.url, {'pr_id': self.product1.pk, 'amount': amount}, format='json',
+                                        HTTP_AUTHORIZATION=self.customer)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('amount', response.data)
+            response = self.client.put(reverse('order-item-detail', args=[self.order.pk, item.pk]),
+                                       {'amount': amount}, HTTP_AUTHORIZATION=self.customer)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('amount', response.data)
+        self.assertEqual(self.quantity(self.product1), 8)
+        self.assertEqual(ProductsInOrders.objects.get(pk=item.pk).amount, 2)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).or_total_price, Decimal('4.00'))
+        with self.assertRaises(ValueError):
+            stock.reserve({self.product1.pk: -1})
+
+    def test_order_delete_releases_stock(self):
+        self.client.post(self.url, {'pr_id': self.product1.pk, 'amount': 3}, format='json',
+                         HTTP_AUTHORIZATION=self.customer)
+        self.assertEqual(self.quantity(self.product1), 7)
+        response = self.client.delete(reverse('order-detail', args=[self.order.pk]), HTTP_AUTHORIZATION=self.customer)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.quantity(self.product1), 10)
+
+
+class TestConcurrentStock(TransactionTestCase):
+    """Clients ordering one product at once until it runs out, as 'python manage.py stress_stock' does."""
+    initial = 40
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Threads need a database in a file or on a server.')
+        self.pwd = 'secret_pass'
+        self.user = UserFactory(password=self.pwd)
+        self.user.groups.add(GroupFactory(name='customer'))
+        self.product = ProductFactory(pr_sup=SupplierFactory())
+        stock.set_stock(self.product.pk, self.initial, shards=4)
+
+    def test_no_oversell(self):
+        command = stress_stock.Command()
+        command.user = self.user
+        options = {'username': self.user.username, 'password': self.pwd, 'stock': self.initial, 'max_amount': 3,
+                   'release_rate': 0.2}
+        clients = [command.client(options) for _ in range(4)]
+        orders = []
+        # Rejected lines are logged
+        with self.assertLogs('django.request', 'WARNING'):
+            counts, _, kept, errors, _ = command.run(clients, self.product, orders, options)
+        self.assertEqual(errors, [])
+        self.assertGreater(counts['out_of_stock'], 0)
+        lines = ProductsInOrders.objects.filter(pr_id=self.product)
+        ordered = lines.aggregate(units=Sum('amount'))['units'] or 0
+        self.assertEqual(ordered + self.quantity(), self.initial)
+        self.assertEqual(dict(lines.values_list('or_id', 'amount')), kept)
+        self.assertFalse(StockShard.objects.filter(quantity__lt=0).exists())
+
+    def quantity(self):
+        return stock.get_stock(self.product.pk)['quantity']
@@ -0,0 +1,98 @@
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from restapi.factories import GroupFactory, UserFactory
+from restapi.throttling import parse_rate, take
+from restapi.views import OrderList
+from restapi.querycheck import QueryCheckMixin
+
+
+class TestTokenBucket(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_take(self):
+        self.assertEqual(parse_rate('2/min'), (2, 30000))
+        capacity, interval, now = 2, 1000, 10 ** 12
+        self.assertEqual([take('bucket', capacity, interval, now) for _ in range(2)], [0, 0])
+        self.assertEqual(take('bucket', capacity, interval, now), 1)
+        self.assertEqual(take('bucket', capacity, interval, now + 400), 0.6)
+        # One token refilled
+        self.assertEqual(take('bucket', capacity, interval, now + 1000), 0)
+        self.assertEqual(take('bucket', capacity, interval, now + 1000), 1)
+        # Full again after being idle
+        self.assertEqual([take('bucket', capacity, interval, now + 10000) for _ in range(3)], [0, 0, 1])
+
+    def test_bench_throttle(self):
+        out = StringIO()
+        call_command('bench_throttle', requests=100, max_us=10 ** 6, stdout=out)
+        self.assertIn('overhead of an allowed request', out.getvalue())
+
+
+@override_settings(THROTTLE_ENABLED=True)
+class TestThrottledViews(QueryCheckMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client = APIClient()
+        cls.pwd = 'secret_pass'
+        cls.user_customer = UserFactory(password=cls.pwd)
+        cls.user_customer.groups.add(GroupFactory(name='customer'))
+        cls.user_employee = UserFactory(password=cls.pwd)
+        cls.user_employee.groups.add(GroupFactory(name='employee'))
+
+    def setUp(self):
+        cache.clear()
+
+    def header(self, user):
+        response = self.client.post(reverse('token'), data={'username': user.username, 'password': self.pwd})
+        return 'Bearer ' + response.data['access']
+
+    # Clock stopped, Retry-After doesn't depend on the time password checks take
+    @mock.patch('restapi.throttling.time.time', return_value=10 ** 9)
+    def test_token_throttled_per_ip(self, _):
+        data = {'username': self.user_customer.username, 'password': 'wrong'}
+        for _ in range(10):
+            self.assertEqual(self.client.post(reverse('token'), data).status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(reverse('token'), data)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # A token is refilled every 6 s
+        self.assertEqual(response['Retry-After'], '6')
+        # Other clients have their own bucket
+        response = self.client.post(reverse('token'), data, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_token_throttled_spoofed_forwarded_for(self):
+        data = {'username': self.user_customer.username, 'password': 'wrong'}
+        statuses = [self.client.post(reverse('token'), data, HTTP_X_FORWARDED_FOR='10.1.0.{}'.format(i)).status_code
+                    for i in range(11)]
+        self.assertEqual(statuses, [status.HTTP_401_UNAUTHORIZED] * 10 + [status.HTTP_429_TOO_MANY_REQUESTS])
+
+    def test_token_throttled_per_forwarded_ip_behind_proxy(self):
+        data = {'username': self.user_customer.username, 'password': 'wrong'}
+        with override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, NUM_PROXIES=1)):
+            # Clients behind the proxy are told apart by the address it appends, whatever they send before it
+            for i in range(11):
+                response = self.client.post(reverse('token'), data, HTTP_X_FORWARDED_FOR='10.1.0.{}'.format(i))
+                self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+            for i in range(11):
+                response = self.client.post(reverse('token'), data,
+                                            HTTP_X_FORWARDED_FOR='10.1.0.{}, 10.2.0.1'.format(i))
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @mock.patch.object(OrderList, 'throttle_rates', {'customer': '2/min', 'employee': '4/min'})
+    def test_order_list_throttled_per_user_role(self):
+        for user, allowed in ((self.user_customer, 2), (self.user_employee, 4)):
+            header = self.header(user)
+            statuses = [self.client.get(reverse('order-list'), HTTP_AUTHORIZATION=header).status_code
+                        for _ in range(allowed + 1)]
+            self.assertEqual(statuses, [status.HTTP_200_OK] * allowed + [status.HTTP_429_TOO_MANY_REQUESTS])
@@ -2,11 +2,30 @@ from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
-
-from restapi.models import Supplier, Product, Order
+from django.test import override_settings
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.http import QueryDict
+from unittest import mock
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken
+from decimal import Decimal
+import base64
+import itertools
+import json
+
+from restapi.models import Supplier, Product, Order, ProductsInOrders
+from restapi.roles import clear_role_cache
+from restapi.filters import apply_filters
+from restapi.views import ProductList, OrderList, OrderDetail, OrderItemCreate
+from restapi.authentication import RoleTokenAuthentication
+from restapi import cache as catalog_cache
+from restapi import search
 from restapi.serializers import SupplierSerializer, ProductSerializer, OrderSerializer, ProductsInOrdersSerializer
 from restapi.factories import GroupFactory, UserFactory, SupplierFactory, ProductFactory, OrderFactory, \
     ProductsInOrdersFactory
+from restapi.querycheck import QueryCheckMixin
 
 '''
 Naming acc. following key:
@@ -16,7 +35,7 @@ Method (snake_case):
 'test' + name_of_model_view_is_based_on + ('list' or 'detail') + CRUD_method + test_user_group + (optional)
 '''
 
-class TestSupplierListView(APITestCase):
+class TestSupplierListView(QueryCheckMixin, APITestCase):
 
     @classmethod
     def setUpTestData(cls):
@@ -66,11 +85,11 @@ class TestSupplierListView(APITestCase):
         suppliers = Supplier.objects.all()
         serializer = SupplierSerializer(suppliers, many=True)
         self.assertEqual(Supplier.objects.count(), 3)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
-class TestSupplierDetailView(APITestCase):
+class TestSupplierDetailView(QueryCheckMixin, APITestCase):
 
     @classmethod
     def setUpTestData(cls):
@@ -108,7 +127,7 @@ class TestSupplierDetailView(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
 
-class TestProductListView(APITestCase):
+class TestProductListView(QueryCheckMixin, APITestCase):
 
     @classmethod
     def setUpTestData(cls):
@@ -134,6 +153,7 @@ class TestProductListView(APITestCase):
         cls.user_employee.groups.add(cls.group_employee)
 
     def setUp(self):
+        cache.clear()
         self.user_token_employee = self.client.post(
             self.url_token,
             data={'username': self.user_employee.username, 'password': self.pwd}).data['access']
@@ -153,11 +173,91 @@ class TestProductListView(APITestCase):
         response = self.client.get(self.url)
         product = Product.objects.all()
         serializer = ProductSerializer(product, many=True)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
-class TestProductDetailView(APITestCase):
+    def test_product_list_retrieve_cached(self):
+        ProductFactory(pr_sup=self.test_supplier)
+        response = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response_cached = self.client.get(self.url)
+        self.assertEqual(response_cached.data, response.data)
+        response = self.client.post(self.url, self.data_valid, format='json',
+                                    HTTP_AUTHORIZATION=self.user_header_employee)
+        # Catalog version was bumped by the write
+        response_new = self.client.get(self.url)
+        self.assertEqual(len(response_new.data['results']), len(response_cached.data['results']) + 1)
+
+
+    @override_settings(STREAM_CHUNK_SIZE=2)
+    def test_product_list_retrieve_stream(self):
+        for _ in range(5):
+            ProductFactory(pr_sup=self.test_supplier)
+        response = self.client.get(self.url, {'stream': 'true'})
+        serializer = ProductSerializer(Product.objects.order_by('pr_id'), many=True)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), json.loads(json.dumps(serializer.data)))
+
+
+    def test_product_list_filter(self):
+        product1 = ProductFactory(pr_sup=self.test_supplier, pr_name='Pipe 20', pr_cat='PI', pr_price=20)
+        product2 = ProductFactory(pr_sup=self.test_supplier, pr_name='Pipe 10', pr_cat='PI', pr_price=10)
+        ProductFactory(pr_sup=self.test_supplier, pr_name='Valve', pr_cat='VA', pr_price=15)
+        ProductFactory(pr_name='Pipe 30', pr_cat='PI', pr_price=30)
+        response = self.client.get(self.url, {'pr_cat': 'PI', 'pr_sup': self.test_supplier.sup_id, 'name': 'Pip',
+                                              'max_price': 25, 'ordering': 'pr_price'})
+        self.assertEqual([product['pr_id'] for product in response.data['results']], [product2.pr_id, product1.pr_id])
+        product3 = ProductFactory(pr_name='Pipe \U0010ffff')
+        response = self.client.get(self.url, {'name': 'Pipe \U0010ffff'})
+        self.assertEqual([product['pr_id'] for product in response.data['results']], [product3.pr_id])
+        response = self.client.get(self.url, {'pr_cat': 'XX', 'min_price': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data), {'pr_cat', 'min_price'})
+
+
+class TestProductSearchView(QueryCheckMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.url = reverse('product-search')
+        cls.test_supplier = SupplierFactory(sup_name='Steelworks')
+        cls.test_product1 = ProductFactory(pr_name='Steel pipe 20mm', pr_cat='PI', pr_sup=cls.test_supplier)
+        cls.test_product2 = ProductFactory(pr_name='Ball valve', pr_cat='VA', pr_sup=cls.test_supplier)
+        cls.test_product3 = ProductFactory(pr_name='Steel valve', pr_cat='VA')
+        cls.test_product4 = ProductFactory(pr_name='Copper fitting', pr_cat='FI')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_product_search(self):
+        response = self.client.get(self.url, {'q': 'stee'})
+        # Product name matches rank above supplier name matches
+        self.assertEqual([product['pr_id'] for product in response.data['results']],
+                         [self.test_product3.pr_id, self.test_product1.pr_id, self.test_product2.pr_id])
+        self.assertEqual(response.data['results'][0], ProductSerializer(self.test_product3).data)
+        self.assertEqual(response.data['facets'], {'pr_cat': {'PI': 1, 'VA': 2}})
+        self.assertEqual(response.data['count'], 3)
+        response = self.client.get(self.url, {'q': 'steel VAL', 'pr_cat': 'VA'})
+        self.assertEqual([product['pr_id'] for product in response.data['results']],
+                         [self.test_product3.pr_id, self.test_product2.pr_id])
+        self.assertEqual(response.data['count'], 2)
+        response = self.client.get(self.url, {'pr_cat': 'XX'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data), {'q', 'pr_cat'})
+
+    def test_product_search_follows_writes(self):
+        self.test_supplier.sup_name = 'Ironworks'
+        self.test_supplier.save()
+        Product.objects.filter(pk=self.test_product4.pk).update(pr_name='Copper steel fitting')
+        product = ProductFactory(pr_name='Iron pipe', pr_sup=self.test_product3.pr_sup)
+        self.test_product3.delete()
+        found = search.search('iron')
+        self.assertEqual(found[0], product.pk)
+        self.assertEqual(set(found[1:]), {self.test_product1.pk, self.test_product2.pk})
+        self.assertEqual(set(search.search('steel')), {self.test_product4.pk, self.test_product1.pk})
+
+
+class TestProductDetailView(QueryCheckMixin, APITestCase):
 
     @classmethod
     def setUpTestData(cls):
@@ -172,6 +272,7 @@ class TestProductDetailView(APITestCase):
         cls.url_token = reverse('token')
 
     def setUp(self):
+        cache.clear()
         self.user_token_employee = self.client.post(
             self.url_token,
             data={'username': self.user_employee.username, 'password': self.pwd}).data['access']
@@ -191,12 +292,36 @@ class TestProductDetailView(APITestCase):
                                    HTTP_AUTHORIZATION=self.user_header_employee)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_product_detail_retrieve_not_modified(self):
+        response = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response_cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response_cached.status_code, status.HTTP_304_NOT_MODIFIED)
+        response_cached = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response_cached.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_product_detail_delete_if_match(self):
+        response = self.client.delete(self.url, HTTP_AUTHORIZATION=self.user_header_employee,
+                                      HTTP_IF_MATCH='"outdated"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_product_detail_update_invalidates_cache(self):
+        self.client.get(self.url)
+        hits = catalog_cache.stats()['hits']
+        self.client.get(self.url)
+        self.assertEqual(catalog_cache.stats()['hits'], hits + 1)
+        self.data = ProductSerializer(self.test_product).data
+        self.data.update({'pr_name': 'Renamed'})
+        self.client.put(self.url, self.data, HTTP_AUTHORIZATION=self.user_header_employee)
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['pr_name'], 'Renamed')
+
     def test_product_detail_delete(self):
         response = self.client.delete(self.url, HTTP_AUTHORIZATION=self.user_header_employee)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
 
-class TestOrderListView(APITestCase):
+class TestOrderListView(QueryCheckMixin, APITestCase):
 
     @classmethod
     def setUpTestData(cls):
@@ -235,16 +360,102 @@ class TestOrderListView(APITestCase):
         response = self.client.get(self.url, HTTP_AUTHORIZATION=self.user_header_customer1)
         order = Order.objects.filter(or_username=self.user_customer1)
         serializer = OrderSerializer(order, many=True)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
     def test_order_list_retrieve_employee(self):
         response = self.client.get(self.url, HTTP_AUTHORIZATION=self.user_header_employee)
         order = Order.objects.all()
         serializer = OrderSerializer(order, many=True)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_order_list_filter_by_total(self):
+        Order.objects.filter(pk=self.test_order1.pk).update(or_total_price=50)
+        Order.objects.filter(pk=self.test_order2.pk).update(or_total_price=150)
+        Order.objects.filter(pk=self.test_order3.pk).update(or_total_price=100)
+        response = self.client.get(self.url, {'min_total': 60, 'ordering': '-or_total_price'},
+                                   HTTP_AUTHORIZATION=self.user_header_employee)
+        self.assertEqual([order['or_id'] for order in response.data['results']],
+                         [self.test_order2.or_id, self.test_order3.or_id])
+        response = self.client.get(self.url, {'max_total': 'abc'}, HTTP_AUTHORIZATION=self.user_header_employee)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {'ordering': 'or_username'}, HTTP_AUTHORIZATION=self.user_header_employee)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_order_list_filter(self):
+        Order.objects.filter(pk=self.test_order2.pk).update(or_is_finished=True, or_finish_date='2020-05-10T10:00Z')
+        response = self.client.get(self.url, {'or_username': self.user_customer1.id, 'or_is_finished': 'true',
+                                              'finish_from': '2020-05-10', 'finish_to': '2020-05-11'},
+                                   HTTP_AUTHORIZATION=self.user_header_employee)
+        self.assertEqual([order['or_id'] for order in response.data['results']], [self.test_order2.or_id])
+        response = self.client.get(self.url, {'start_from': 'yesterday'}, HTTP_AUTHORIZATION=self.user_header_employee)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_order_list_retrieve_pages(self):
+        for _ in range(3):
+            OrderFactory(or_username=self.user_customer2)
+        expected = list(Order.objects.order_by('-or_start_date', '-or_id').values_list('or_id', flat=True))
+        received = []
+        url = self.url + '?ordering=-or_start_date&page_size=2'
+        while url:
+            response = self.client.get(url, HTTP_AUTHORIZATION=self.user_header_employee)
+            self.assertLessEqual(len(response.data['results']), 2)
+            received += [order['or_id'] for order in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(received, expected)
+
+    def test_order_list_retrieve_stream(self):
+        response = self.client.get(self.url, {'stream': 1}, HTTP_AUTHORIZATION=self.user_header_employee)
+        self.assertTrue(response.streaming)
+        serializer = OrderSerializer(Order.objects.order_by('or_id'), many=True)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), json.loads(json.dumps(serializer.data)))
+
+    def test_order_list_retrieve_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'abc'}, HTTP_AUTHORIZATION=self.user_header_employee)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_order_list_retrieve_cursor_wrong_types(self):
+        for position in (['or_id', False, 'x', 'abc'], ['or_total_price', False, 'x', 1], ['or_id', False, 1, [1]]):
+            cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+            response = self.client.get(self.url, {'cursor': cursor, 'ordering': position[0]},
+                                       HTTP_AUTHORIZATION=self.user_header_employee)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, position)
+
+    def test_order_list_retrieve_not_modified(self):
+        response = self.client.get(self.url, {'page_size': 1}, HTTP_AUTHORIZATION=self.user_header_employee)
+        # Answered from the rows of the page, no query over the whole list
+        with CaptureQueriesContext(connection) as queries:
+            response_cached = self.client.get(self.url, {'page_size': 1}, HTTP_AUTHORIZATION=self.user_header_employee,
+                                              HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response_cached.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql'] or 'MAX(' in query['sql']])
+        # A change of an order on another page leaves the page as it was
+        other = Order.objects.exclude(pk=response.data['results'][0]['or_id']).first()
+        Order.add_item_totals(other.pk, 1)
+        response_cached = self.client.get(self.url, {'page_size': 1}, HTTP_AUTHORIZATION=self.user_header_employee,
+                                          HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response_cached.status_code, status.HTTP_304_NOT_MODIFIED)
+        Order.add_item_totals(response.data['results'][0]['or_id'], 1)
+        response_changed = self.client.get(self.url, {'page_size': 1}, HTTP_AUTHORIZATION=self.user_header_employee,
+                                           HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response_changed.status_code, status.HTTP_200_OK)
+
+    def test_order_list_retrieve_token_claims(self):
+        # Stateless authentication needs no user or groups query, validators come from the page query
+        with mock.patch.object(APIView, 'authentication_classes', [RoleTokenAuthentication]):
+            with self.assertNumQueries(1):
+                response = self.client.get(self.url, HTTP_AUTHORIZATION=self.user_header_customer1)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(AccessToken(self.user_token_customer1)['roles'], ['customer'])
+
+    def test_order_list_refresh_token_roles(self):
+        refresh = self.client.post(self.url_token, data={'username': self.user_customer1.username,
+                                                         'password': self.pwd}).data['refresh']
+        self.user_customer1.groups.add(self.group_employee)
+        response = self.client.post(reverse('refresh-token'), data={'refresh': refresh})
+        self.assertEqual(AccessToken(response.data['access'])['roles'], ['customer', 'employee'])
+
     def test_order_list_create_customer(self):
         self.data = {}
         response = self.client.post(self.url, self.data, format='json', HTTP_AUTHORIZATION=self.user_header_customer1)
@@ -271,7 +482,7 @@ class TestOrderListView(APITestCase):
         self.assertEqual(response_post2.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
-class TestOrderDetailView(APITestCase):
+class TestOrderDetailView(QueryCheckMixin, APITestCase):
 
     @classmethod
     def setUpTestData(cls):
@@ -325,6 +536,66 @@ class TestOrderDetailView(APITestCase):
         response_another = self.client.get(self.url_another_customer, HTTP_AUTHORIZATION=self.user_header_customer1)
         self.assertEqual(response_another.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_order_detail_retrieve_total_price(self):
+        ProductsInOrdersFactory(or_id=self.test_order1, pr_id=self.test_product1, amount=2)
+        ProductsInOrdersFactory(or_id=self.test_order1, pr_id=self.test_product2, amount=3)
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.user_header_customer1)
+        expected = self.test_product1.pr_price * 2 + self.test_product2.pr_price * 3
+        self.assertEqual(response.data['total_price'], {'price': expected})
+        self.assertEqual(response.data['order_info']['or_items_count'], 2)
+        self.assertEqual(len(response.data['order_info']['items_in_order']), 2)
+
+    def test_order_detail_retrieve_query_count(self):
+        # Order, items and products are fetched in bounded queries, independent of order size
+        ProductsInOrdersFactory(or_id=self.test_order1, pr_id=self.test_product1)
+        # User, groups, validators, order and items with products
+        with self.assertNumQueries(5):
+            self.client.get(self.url, HTTP_AUTHORIZATION=self.user_header_customer1)
+        for _ in range(20):
+            ProductsInOrdersFactory(or_id=self.test_order1, pr_id=ProductFactory(pr_sup=self.test_supplier))
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url, HTTP_AUTHORIZATION=self.user_header_customer1)
+        self.assertEqual(len(response.data['order_info']['items_in_order']), 21)
+        with self.assertNumQueries(5):
+            self.client.get(self.url, HTTP_AUTHORIZATION=self.user_header_employee)
+
+    @override_settings(ROLE_CACHE_TTL=60)
+    def test_order_detail_retrieve_role_cache(self):
+        clear_role_cache()
+        self.client.get(self.url, HTTP_AUTHORIZATION=self.user_header_customer1)
+        # Groups are served from the process cache until TTL expires
+        with self.assertNumQueries(4):
+            self.client.get(self.url, HTTP_AUTHORIZATION=self.user_header_customer1)
+        clear_role_cache()
+
+    def test_order_detail_retrieve_not_modified(self):
+        ProductsInOrdersFactory(or_id=self.test_order1, pr_id=self.test_product1)
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=self.user_header_customer1)
+        # Not modified answer skips loading the order and its items
+        with self.assertNumQueries(3):
+            response_cached = self.client.get(self.url, HTTP_AUTHORIZATION=self.user_header_customer1,
+                                              HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response_cached.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.data = ProductSerializer(self.test_product1).data
+        self.data.update({'pr_name': 'Renamed'})
+        self.client.put(reverse('product-detail', args=[self.test_product1.pr_id]), self.data,
+                        HTTP_AUTHORIZATION=self.user_header_employee)
+        response_changed = self.client.get(self.url, HTTP_AUTHORIZATION=self.user_header_customer1,
+                                           HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response_changed.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response_changed['ETag'], response['ETag'])
+
+    def test_order_detail_update_if_match(self):
+        etag = self.client.get(self.url, HTTP_AUTHORIZATION=self.user_header_customer1)['ETag']
+        ProductsInOrdersFactory(or_id=self.test_order1, pr_id=self.test_product1)
+        response = self.client.put(self.url, format='json', HTTP_AUTHORIZATION=self.user_header_customer1,
+                                   HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        etag = self.client.get(self.url, HTTP_AUTHORIZATION=self.user_header_customer1)['ETag']
+        response = self.client.put(self.url, format='json', HTTP_AUTHORIZATION=self.user_header_customer1,
+                                   HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
     def test_order_detail_update_employee(self):
         self.data = OrderSerializer(self.test_order1).data
         self.data.update({'or_username': self.user_customer2.id, 'or_is_sent': True})
@@ -332,6 +603,15 @@ class TestOrderDetailView(APITestCase):
                                    HTTP_AUTHORIZATION=self.user_header_employee)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_order_detail_update_conflict(self):
+        stale = Order.objects.get(pk=self.test_order1.pk)
+        # Item added by a concurrent request after the order was read
+        Order.add_item_totals(self.test_order1.pk, 0)
+        with mock.patch.object(OrderDetail, 'get_object', return_value=stale):
+            response = self.client.put(self.url, format='json', HTTP_AUTHORIZATION=self.user_header_customer1)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Order.objects.get(pk=self.test_order1.pk).or_is_finished)
+
     def test_order_detail_update_customer_valid(self):
         response_valid1 = self.client.put(reverse('order-detail', args=[self.test_order1.or_id]), format='json',
                                           HTTP_AUTHORIZATION=self.user_header_customer1)
@@ -357,8 +637,16 @@ class TestOrderDetailView(APITestCase):
         response = self.client.delete(self.url, HTTP_AUTHORIZATION=self.user_header_employee)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
+    def test_order_detail_delete_finished_order(self):
+        ProductsInOrdersFactory(or_id=self.test_order2, pr_id=self.test_product1)
+        url = reverse('order-detail', kwargs={'pk': self.test_order2.or_id})
+        for header in (self.user_header_customer1, self.user_header_employee):
+            response = self.client.delete(url, HTTP_AUTHORIZATION=header)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(ProductsInOrders.objects.filter(or_id=self.test_order2).exists())
+
 
-class TestOrderItemsView(APITestCase):
+class TestOrderItemsView(QueryCheckMixin, APITestCase):
 
     @classmethod
     def setUpTestData(cls):
@@ -410,6 +698,98 @@ class TestOrderItemsView(APITestCase):
                                             HTTP_AUTHORIZATION=self.user_header_customer1)
         self.assertEqual(response_invalid.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_order_item_create_conflict(self):
+        stale = Order.objects.get(pk=self.test_order1.pk)
+        # Order finished by a concurrent request after it was read
+        Order.compare_and_set(self.test_order1.pk, stale.version, or_is_finished=True)
+        self.data = {"pr_id": self.test_product2.pr_id, "amount": 4}
+        with mock.patch('restapi.views.get_object_or_404', return_value=stale):
+            response = self.client.post(self.url, self.data, format='json',
+                                        HTTP_AUTHORIZATION=self.user_header_customer1)
+            self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+            response = self.client.post(self.url, [self.data], format='json',
+                                        HTTP_AUTHORIZATION=self.user_header_customer1)
+            self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(ProductsInOrders.objects.filter(or_id=self.test_order1).exists())
+
+    def concurrently_added(self, method):
+        """Wrap 'method' to add product 2 to order 1 as a concurrent request would after the method ran."""
+        def wrapper(*args, **kwargs):
+            result = method(*args, **kwargs)
+            ProductsInOrdersFactory(or_id=self.test_order1, pr_id=self.test_product2, amount=1)
+            Order.add_item_totals(self.test_order1.or_id, self.test_product2.pr_price, 1)
+            return result
+        return wrapper
+
+    def test_order_item_create_concurrent_same_product(self):
+        self.data = {"pr_id": self.test_product2.pr_id, "amount": 4}
+        with mock.patch.object(ProductsInOrdersSerializer, 'is_valid',
+                               self.concurrently_added(ProductsInOrdersSerializer.is_valid)):
+            response = self.client.post(self.url, self.data, format='json',
+                                        HTTP_AUTHORIZATION=self.user_header_customer1)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        ProductsInOrders.objects.filter(or_id=self.test_order1).delete()
+        with mock.patch.object(OrderItemCreate, 'existing_lines',
+                               self.concurrently_added(OrderItemCreate.existing_lines)):
+            response = self.client.post(self.url, [self.data], format='json',
+                                        HTTP_AUTHORIZATION=self.user_header_customer1)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(ProductsInOrders.objects.get(or_id=self.test_order1).amount, 1)
+
+    def test_order_item_create_updates_totals(self):
+        self.data = {"pr_id": self.test_product2.pr_id, "amount": 4}
+        self.client.post(self.url, self.data, format='json', HTTP_AUTHORIZATION=self.user_header_customer1)
+        order = Order.objects.get(pk=self.test_order1.pk)
+        self.assertEqual(order.or_total_price, self.test_product2.pr_price * 4)
+        self.assertEqual(order.or_items_count, 1)
+
+    def test_order_item_create_bulk(self):
+        ProductsInOrdersFactory(or_id=self.test_order1, pr_id=self.test_product1, amount=1)
+        self.data = [{"pr_id": self.test_product1.pr_id, "amount": 7},
+                     {"pr_id": self.test_product2.pr_id, "amount": 2},
+                     {"pr_id": self.test_product2.pr_id, "amount": 3}]
+        response = self.client.post(self.url, self.data, format='json', HTTP_AUTHORIZATION=self.user_header_customer1)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        amounts = dict(ProductsInOrders.objects.filter(or_id=self.test_order1).values_list('pr_id', 'amount'))
+        self.assertEqual(amounts, {self.test_product1.pr_id: 7, self.test_product2.pr_id: 5})
+        order = Order.objects.get(pk=self.test_order1.pk)
+        self.assertEqual(order.or_total_price, self.test_product1.pr_price * 7 + self.test_product2.pr_price * 5)
+        self.assertEqual(order.or_items_count, 2)
+
+    def test_order_item_create_bulk_errors(self):
+        self.data = [{"pr_id": self.test_product1.pr_id, "amount": 7}, {"pr_id": 999999, "amount": 1}]
+        response = self.client.post(self.url, self.data, format='json', HTTP_AUTHORIZATION=self.user_header_customer1)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('pr_id', response.data[1])
+        self.assertFalse(ProductsInOrders.objects.filter(or_id=self.test_order1).exists())
+        response = self.client.post(self.url_finished, self.data, format='json',
+                                    HTTP_AUTHORIZATION=self.user_header_employee)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_order_item_create_bulk_query_count(self):
+        products = [ProductFactory(pr_sup=self.test_supplier) for _ in range(30)]
+        self.data = [{"pr_id": product.pr_id, "amount": 1} for product in products]
+        # User, groups, order, products, existing items, stock, insert, totals and savepoint with release
+        with self.assertNumQueries(10):
+            self.client.post(self.url, self.data, format='json', HTTP_AUTHORIZATION=self.user_header_customer1)
+
+    def test_order_item_update_delete_bulk(self):
+        ProductsInOrdersFactory(or_id=self.test_order1, pr_id=self.test_product1, amount=1)
+        ProductsInOrdersFactory(or_id=self.test_order1, pr_id=self.test_product2, amount=1)
+        response = self.client.patch(self.url, [{"pr_id": self.test_product1.pr_id, "amount": 4}], format='json',
+                                     HTTP_AUTHORIZATION=self.user_header_customer1)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.delete(self.url, [{"pr_id": self.test_product2.pr_id}], format='json',
+                                      HTTP_AUTHORIZATION=self.user_header_customer1)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.delete(self.url, [{"pr_id": self.test_product2.pr_id}], format='json',
+                                      HTTP_AUTHORIZATION=self.user_header_customer1)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        order = Order.objects.get(pk=self.test_order1.pk)
+        self.assertEqual(order.or_total_price, self.test_product1.pr_price * 4)
+        self.assertEqual(order.or_items_count, 1)
+
     def test_order_item_check_uniqueness(self):
         self.pio1 = ProductsInOrdersFactory(or_id=self.test_order1,
                                             pr_id=self.test_product1)
@@ -424,7 +804,7 @@ class TestOrderItemsView(APITestCase):
         self.assertEqual(response_valid.status_code, status.HTTP_400_BAD_REQUEST)
 
 
-class TestOrderItemDetailView(APITestCase):
+class TestOrderItemDetailView(QueryCheckMixin, APITestCase):
 
     @classmethod
     def setUpTestData(cls):
@@ -480,6 +860,36 @@ class TestOrderItemDetailView(APITestCase):
     def test_order_item_detail_delete_employee(self):
         response = self.client.delete(self.url, HTTP_AUTHORIZATION=self.user_header_employee)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        order = Order.objects.get(pk=self.test_order1.pk)
+        self.assertEqual(order.or_total_price, self.pio2.line_price)
+        self.assertEqual(order.or_items_count, 1)
+
+    def test_order_item_detail_update_totals(self):
+        self.client.put(self.url, {'amount': 5}, format='json', HTTP_AUTHORIZATION=self.user_header_employee)
+        order = Order.objects.get(pk=self.test_order1.pk)
+        self.assertEqual(order.or_total_price, self.test_product1.pr_price * 5 + self.pio2.line_price)
+        self.assertEqual(order.or_items_count, 2)
+
+    def test_order_item_detail_update_cannot_move(self):
+        product = ProductFactory(pr_sup=self.test_supplier)
+        for change in ({'or_id': self.test_order4.or_id}, {'pr_id': product.pr_id},
+                       {'or_id': self.test_order2.or_id, 'pr_id': self.test_product1.pr_id}):
+            response = self.client.put(self.url, dict(change, amount=5), format='json',
+                                       HTTP_AUTHORIZATION=self.user_header_employee)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, change)
+        item = ProductsInOrders.objects.get(pk=self.pio1.pk)
+        self.assertEqual((item.or_id_id, item.pr_id_id, item.amount),
+                         (self.test_order1.or_id, self.test_product1.pr_id, self.pio1.amount))
+        self.assertEqual(Order.objects.get(pk=self.test_order4.pk).or_items_count, 0)
+
+    def test_order_item_detail_product_price_change(self):
+        self.data = ProductSerializer(self.test_product1).data
+        self.data.update({'pr_price': '10.50'})
+        response = self.client.put(reverse('product-detail', args=[self.test_product1.pr_id]), self.data,
+                                   HTTP_AUTHORIZATION=self.user_header_employee)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        order = Order.objects.get(pk=self.test_order1.pk)
+        self.assertEqual(order.or_total_price, Decimal('10.50') * self.pio1.amount + self.pio2.line_price)
 
     def test_order_item_detail_update_customer(self):
         self.data = ProductsInOrdersSerializer(self.pio1).data
@@ -516,3 +926,66 @@ class TestOrderItemDetailView(APITestCase):
     def test_order_item_detail_delete_customer_finished_order(self):
         response = self.client.delete(self.url_order_finished, HTTP_AUTHORIZATION=self.user_header_customer1)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestListFilterIndexes(QueryCheckMixin, APITestCase):
+    """Supported filter combinations with their ordering are answered from the matching index."""
+
+    def assertUsesIndex(self, model, view, params, ordering, fields):
+        index = next(index.name for index in model._meta.indexes if index.fields == fields)
+        queryset = apply_filters(model.objects.all(), QueryDict(params), view.filters).order_by(ordering, 'pk')
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+        self.assertIn(index, queryset[:51].explain(), '{} ordered by {}'.format(params, ordering))
+
+    def test_product_filter_indexes(self):
+        cases = [('pr_cat=PI', 'pr_price', ['pr_cat', 'pr_price', 'pr_id']),
+                 ('pr_cat=PI&min_price=10&max_price=20', 'pr_price', ['pr_cat', 'pr_price', 'pr_id']),
+                 ('pr_sup=1&min_price=10', 'pr_price', ['pr_sup', 'pr_price', 'pr_id']),
+                 ('min_price=10&max_price=20', 'pr_price', ['pr_price', 'pr_id']),
+                 ('name=Pip', 'pr_name', ['pr_name', 'pr_id']),
+                 ('name=Pip&max_price=20', 'pr_id', ['pr_name', 'pr_id'])]
+        for params, ordering, fields in cases:
+            self.assertUsesIndex(Product, ProductList, params, ordering, fields)
+
+    def test_order_filter_indexes(self):
+        cases = [('or_username=1&start_from=2020-01-01', 'or_start_date', ['or_username', 'or_start_date', 'or_id']),
+                 ('or_is_finished=true&or_is_sent=false&start_to=2020-01-01', 'or_start_date',
+                  ['or_is_finished', 'or_is_sent', 'or_start_date']),
+                 ('or_is_finished=false', 'or_id', ['or_is_finished', 'or_is_sent', 'or_start_date']),
+                 ('or_is_sent=true&start_from=2020-01-01', 'or_start_date', ['or_is_sent', 'or_start_date']),
+                 ('finish_from=2020-01-01&finish_to=2020-02-01', 'or_id', ['or_finish_date', 'or_id']),
+                 ('start_from=2020-01-01', 'or_start_date', ['or_start_date', 'or_id']),
+                 ('min_total=10', 'or_total_price', ['or_total_price', 'or_id'])]
+        for params, ordering, fields in cases:
+            self.assertUsesIndex(Order, OrderList, params, ordering, fields)
+
+    def test_filter_combinations_seek(self):
+        """
+        Supported combinations: any with an equality or prefix filter, with any ordering (the index led by that filter
+        is searched), and ranges alone when ordered by the column of one of them.
+        """
+        seeking = {'pr_cat': 'PI', 'pr_sup': '1', 'name': 'Pip', 'or_is_finished': 'true', 'or_is_sent': 'false',
+                   'or_username': '1'}
+        ranges = {'min_price': ('10', 'pr_price'), 'max_price': ('20', 'pr_price'),
+                  'start_from': ('2020-01-01', 'or_start_date'), 'start_to': ('2020-02-01', 'or_start_date'),
+                  'finish_from': ('2020-01-01', 'or_finish_date'), 'finish_to': ('2020-02-01', 'or_finish_date'),
+                  'min_total': ('10', 'or_total_price'), 'max_total': ('20', 'or_total_price')}
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+        for model, view in ((Product, ProductList), (Order, OrderList)):
+            params = [query_filter.param for query_filter in view.filters]
+            for size in range(1, len(params) + 1):
+                for combination in itertools.combinations(params, size):
+                    columns = {ranges[param][1] for param in combination if param in ranges}
+                    orderings = view.ordering_fields if seeking.keys() & set(combination) else columns
+                    query = QueryDict('&'.join('{}={}'.format(param, seeking[param] if param in seeking
+                                                              else ranges[param][0]) for param in combination))
+                    for ordering in set(view.ordering_fields) & set(orderings):
+                        queryset = apply_filters(model.objects.all(), query, view.filters).order_by(ordering, 'pk')
+                        plan = queryset[:51].explain()
+                        self.assertTrue('Index Cond' in plan if connection.vendor == 'postgresql' else
+                                        'SEARCH' in plan, '{} ordered by {}: {}'.format(query.urlencode(),
+                                                                                         ordering, plan))
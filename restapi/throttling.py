@@ -0,0 +1,108 @@
+import math
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+from restapi.roles import has_role, CUSTOMER, EMPLOYEE
+
+'''
+Token bucket throttles. A view sets 'throttle_rates', e.g. {'customer': '120/min', 'employee': '600/min',
+'ip': '600/min'}: authenticated users get a bucket per user with the rate of their role ('user' for users without
+one), every client a bucket per IP address. A bucket holds as many tokens as the rate allows per period and refills
+continuously. Buckets live in the THROTTLE_CACHE_ALIAS cache, so a shared cache (memcached, redis) enforces limits
+across workers. State of a bucket is a single number, the time when it will be full again, changed with atomic
+incr/decr: an allowed request usually costs one cache round trip.
+'''
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+# Roles in order of precedence, a user with both gets the employee rate
+ROLES = (EMPLOYEE, CUSTOMER)
+
+
+def get_cache():
+    return caches[getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')]
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """'120/min' -> bucket capacity (120) and milliseconds to refill one token (500)."""
+    count, period = rate.split('/')
+    count = int(count)
+    return count, max(1, round(PERIODS[period[0]] * 1000 / count))
+
+
+def _timeout(ahead):
+    """Cache timeout of a bucket full again in 'ahead' milliseconds, a missing bucket is a full one."""
+    return math.ceil(ahead / 1000) + 1
+
+
+def take(key, capacity, interval, now=None):
+    """
+    Take a token from the bucket, return 0 if one was available, otherwise seconds until one will be.
+    The bucket is stored as the time (ms) when it will be full again: every token moves it by 'interval' and it may
+    be at most 'capacity' tokens ahead of now.
+    """
+    cache = get_cache()
+    now = int(time.time() * 1000) if now is None else now
+    burst = capacity * interval
+    try:
+        full_at = cache.incr(key, interval)
+    except ValueError:
+        if cache.add(key, now + interval, _timeout(interval)):
+            return 0
+        # Created by a concurrent request
+        return take(key, capacity, interval, now)
+    if full_at < now + interval:
+        # Refilled since the last request
+        cache.set(key, now + interval, _timeout(interval))
+        return 0
+    if full_at > now + burst:
+        cache.decr(key, interval)
+        cache.touch(key, _timeout(full_at - interval - now))
+        return (full_at - burst - now) / 1000
+    if full_at - now > burst // 2:
+        # Timeout is extended only for buckets over half empty, an expired bucket is at most half a bucket off
+        cache.touch(key, _timeout(full_at - now))
+    return 0
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Base of throttles with rates from 'throttle_rates' of the view, buckets are separate per view."""
+    delay = None
+
+    def get_bucket(self, request, rates):
+        """Key and rate of the bucket of the request, None if it is not throttled."""
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        if not getattr(settings, 'THROTTLE_ENABLED', True):
+            return True
+        bucket = self.get_bucket(request, getattr(view, 'throttle_rates', {}))
+        if bucket is None:
+            return True
+        key, rate = bucket
+        scope = getattr(view, 'throttle_scope', None) or type(view).__name__
+        self.delay = take('throttle:{}:{}'.format(scope, key), *parse_rate(rate))
+        return not self.delay
+
+    def wait(self):
+        # Retry-After has whole seconds
+        return math.ceil(self.delay) if self.delay else None
+
+
+class UserThrottle(TokenBucketThrottle):
+    def get_bucket(self, request, rates):
+        user = request.user
+        if not rates or not user or not user.is_authenticated:
+            return None
+        rate = next((rates[role] for role in ROLES if role in rates and has_role(user, role)), rates.get('user'))
+        return ('user:{}'.format(user.pk), rate) if rate else None
+
+
+class IPThrottle(TokenBucketThrottle):
+    def get_bucket(self, request, rates):
+        rate = rates.get('ip')
+        return ('ip:{}'.format(self.get_ident(request)), rate) if rate else None
@@ -1,16 +1,43 @@
+import hashlib
+from collections import OrderedDict
+
 from django.http import HttpResponse
 from rest_framework.views import APIView
-from rest_framework import generics, permissions
+from rest_framework import generics, permissions, serializers
 from rest_framework.response import Response
+from rest_framework_simplejwt import views as jwt_views
 from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
 from django.http import Http404
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.db import transaction
+from django.db.models import F, Max, Count
 
 
 from restapi.models import Supplier, Product, Order, ProductsInOrders
 from restapi.serializers import SupplierSerializer, ProductSerializer, OrderSerializer, \
-    OrderProductsSerializer, OrderGetSerializer, ProductsInOrdersSerializer
+    OrderProductsSerializer, OrderGetSerializer, ProductsInOrdersSerializer, OrderItemLineSerializer, \
+    ProductSearchSerializer, SalesQuerySerializer, StockSerializer
 from restapi.permissions import IsOrderOwner, IsEmployeeGroup, IsCustomerGroup, ReadOnly
+from restapi.roles import has_role, CUSTOMER, EMPLOYEE
+from restapi.pagination import KeysetPagination
+from restapi.filters import Filter, PrefixFilter, QueryParamFilterBackend, apply_filters, decimal_field, \
+    datetime_field
+from restapi.streaming import stream_list, wants_stream
+from restapi.compiled import compile_serializer
+from restapi import cache as catalog_cache
+from restapi import search
+from restapi import sales
+from restapi import stock
+from restapi import outbox
+from restapi.db import pool as db_pool
+from restapi import blacklist
+from restapi import metrics
+from restapi.idempotency import idempotent
+from restapi.authentication import RoleTokenObtainPairSerializer, RoleTokenRefreshSerializer
+from restapi.conditional import conditional_response, check_preconditions, has_preconditions, set_validators, \
+    instance_validators, page_validators, queryset_validators, make_etag
 
 
 def index(request):
@@ -25,46 +52,282 @@ def index(request):
     )
 
 
-class SupplierList(generics.ListCreateAPIView):
+class TokenObtainView(jwt_views.TokenObtainPairView):
+    """Each attempt hashes a password, so clients get few of them."""
+    serializer_class = RoleTokenObtainPairSerializer
+    throttle_rates = {'ip': '10/min'}
+
+
+class TokenRefreshView(jwt_views.TokenRefreshView):
+    serializer_class = RoleTokenRefreshSerializer
+    throttle_rates = {'ip': '60/min'}
+
+
+class DatabasePoolStats(APIView):
+    """Connection pool statistics of the worker process answering the request."""
+    permission_classes = (IsEmployeeGroup,)
+
+    def get(self, request, format=None):
+        return Response(db_pool.stats())
+
+
+class TokenBlacklistStats(APIView):
+    """Token table sizes and blacklist check statistics of the worker process answering the request."""
+    permission_classes = (IsEmployeeGroup,)
+
+    def get(self, request, format=None):
+        return Response(blacklist.stats())
+
+
+class Metrics(APIView):
+    """Request histograms of the worker process answering the request, in Prometheus text format."""
+    permission_classes = (IsEmployeeGroup,)
+
+    def get(self, request, format=None):
+        return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class SalesReport(APIView):
+    """Revenue and units of finished orders per product, supplier, category or day, from sales rollups."""
+    permission_classes = (IsEmployeeGroup,)
+
+    def get(self, request, dimension, format=None):
+        query = SalesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        since, until = query.validated_data['since'], query.validated_data['until']
+        return Response({'since': since, 'until': until, 'results': sales.report(dimension, since, until)})
+
+
+class ConditionalMixin:
+    """ETag / Last-Modified for generic views, compared with request headers before serialization."""
+
+    def respond(self, request, validators, build):
+        response = conditional_response(request, *validators) or build()
+        return set_validators(response, *validators)
+
+    def page_validators(self, request, page):
+        return page_validators(page, self.get_queryset().model._meta.pk.name, self.paginator.next_link,
+                               request.query_params.urlencode())
+
+    def list(self, request, *args, **kwargs):
+        if wants_stream(request):
+            # The whole list is read for the response anyway
+            queryset = self.filter_queryset(self.get_queryset())
+            validators = queryset_validators(queryset, request.query_params.urlencode())
+            return self.respond(request, validators,
+                                lambda: super(ConditionalMixin, self).list(request, *args, **kwargs))
+        page, render = self.list_page(request)
+        return self.respond(request, self.page_validators(request, page), render)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return self.respond(request, instance_validators(instance),
+                            lambda: Response(self.get_serializer(instance).data))
+
+    def perform_update(self, serializer):
+        check_preconditions(self.request, *instance_validators(serializer.instance))
+        super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        check_preconditions(self.request, *instance_validators(instance))
+        super().perform_destroy(instance)
+
+
+class FastListMixin:
+    """Read-only list rendered by compiled serializer: a page, or the whole list streamed when requested."""
+
+    def list_page(self, request):
+        """Rows of the requested page (with 'updated_at' for validators) and a function rendering the response."""
+        compiled = compile_serializer(self.get_serializer_class())
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(compiled.values(queryset, 'updated_at', *self.ordering_fields))
+        return page, lambda: self.get_paginated_response(compiled.serialize_rows(page))
+
+    def list(self, request, *args, **kwargs):
+        if wants_stream(request):
+            return stream_list(self.filter_queryset(self.get_queryset()).order_by('pk'), self.get_serializer_class())
+        page, render = self.list_page(request)
+        return render()
+
+
+class CatalogWriteMixin:
+    """Invalidate cached catalog after any write."""
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        catalog_cache.bump_version()
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        catalog_cache.bump_version()
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        catalog_cache.bump_version()
+
+
+class SupplierList(CatalogWriteMixin, ConditionalMixin, FastListMixin, generics.ListCreateAPIView):
     permission_classes = (IsEmployeeGroup,)
     queryset = Supplier.objects.all()
     serializer_class = SupplierSerializer
+    ordering_fields = ['sup_id']
 
 
-class SupplierDetail(generics.RetrieveUpdateDestroyAPIView):
+class SupplierDetail(CatalogWriteMixin, ConditionalMixin, generics.RetrieveUpdateDestroyAPIView):
     permission_classes = (IsEmployeeGroup,)
     queryset = Supplier.objects.all()
     serializer_class = SupplierSerializer
 
 
-class ProductList(generics.ListCreateAPIView):
+class ProductList(CatalogWriteMixin, ConditionalMixin, FastListMixin, generics.ListCreateAPIView):
     permission_classes = ((IsEmployeeGroup | ReadOnly),)
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
-
-
-class ProductDetail(generics.RetrieveUpdateDestroyAPIView):
+    ordering_fields = ['pr_id', 'pr_name', 'pr_price']
+    filter_backends = [QueryParamFilterBackend]
+    filters = [
+        Filter('pr_cat', 'pr_cat', serializers.ChoiceField(choices=Product.CATEGORY_CHOICES)),
+        Filter('pr_sup', 'pr_sup', serializers.IntegerField()),
+        Filter('min_price', 'pr_price__gte', decimal_field()),
+        Filter('max_price', 'pr_price__lte', decimal_field()),
+        PrefixFilter('name', 'pr_name', serializers.CharField()),
+    ]
+
+    def list(self, request, *args, **kwargs):
+        if wants_stream(request):
+            return super().list(request, *args, **kwargs)
+        key = 'list:' + hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+
+        def build():
+            page, render = self.list_page(request)
+            return self.page_validators(request, page), render().data
+
+        validators, data = catalog_cache.get_or_build(key, build)
+        return self.respond(request, validators, lambda: Response(data))
+
+
+class ProductDetail(CatalogWriteMixin, ConditionalMixin, generics.RetrieveUpdateDestroyAPIView):
     permission_classes = ((IsEmployeeGroup | ReadOnly),)
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        def build():
+            instance = self.get_object()
+            return instance_validators(instance), self.get_serializer(instance).data
+
+        validators, data = catalog_cache.get_or_build('product:{}'.format(kwargs['pk']), build)
+        return self.respond(request, validators, lambda: Response(data))
+
+    def perform_update(self, serializer):
+        check_preconditions(self.request, *instance_validators(serializer.instance))
+        old_price = serializer.instance.pr_price
+        with transaction.atomic():
+            product = serializer.save()
+            if product.pr_price != old_price:
+                product.reprice_orders(old_price)
+        catalog_cache.bump_version()
+
+
+class ProductStock(APIView):
+    """Units of a product in stock; employees set them, or stop tracking the stock by deleting it."""
+    permission_classes = ((IsEmployeeGroup | ReadOnly),)
+
+    def get(self, request, pk, format=None):
+        get_object_or_404(Product, pk=pk)
+        return Response(stock.get_stock(pk) or {'quantity': None, 'shards': 0})
+
+    def put(self, request, pk, format=None):
+        get_object_or_404(Product, pk=pk)
+        serializer = StockSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        stock.set_stock(pk, **serializer.validated_data)
+        return Response(stock.get_stock(pk))
+
+    def delete(self, request, pk, format=None):
+        get_object_or_404(Product, pk=pk)
+        stock.clear_stock(pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ProductSearch(APIView):
+    """Products with words starting with every word of 'q' in product or supplier name, best matches first."""
+    permission_classes = ((IsEmployeeGroup | ReadOnly),)
+    pagination_class = KeysetPagination
+
+    def get(self, request, format=None):
+        params = ProductSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        key = 'search:' + hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        return Response(catalog_cache.get_or_build(key, lambda: self.build(request, **params.validated_data)))
+
+    def build(self, request, q, pr_cat=None):
+        pks = search.search(q, pr_cat, self.pagination_class().get_page_size(request))
+        products = compile_serializer(ProductSerializer).serialize(Product.objects.filter(pk__in=pks))
+        by_pk = {product['pr_id']: product for product in products}
+        facets = search.facets(q)
+        return OrderedDict([('count', facets.get(pr_cat, 0) if pr_cat else sum(facets.values())),
+                            ('facets', {'pr_cat': facets}),
+                            ('results', [by_pk[pk] for pk in pks if pk in by_pk])])
+
+
+class OrderConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Order was changed by another request at the same time, try again.'
+    default_code = 'conflict'
+
+
+def check_swapped(swapped):
+    """Fail the request (rolling back its transaction) if a compare-and-set of an order did not apply."""
+    if not swapped:
+        raise OrderConflict()
+
 
 class OrderList(APIView):
     permission_classes = ((IsCustomerGroup | IsEmployeeGroup),)
+    throttle_rates = {'customer': '120/min', 'employee': '1200/min', 'ip': '1200/min'}
+    pagination_class = KeysetPagination
+    ordering = 'or_id'
+    ordering_fields = ['or_id', 'or_start_date', 'or_total_price']
+    filters = [
+        Filter('or_is_finished', 'or_is_finished', serializers.BooleanField()),
+        Filter('or_is_sent', 'or_is_sent', serializers.BooleanField()),
+        Filter('start_from', 'or_start_date__gte', datetime_field()),
+        Filter('start_to', 'or_start_date__lte', datetime_field()),
+        Filter('finish_from', 'or_finish_date__gte', datetime_field()),
+        Filter('finish_to', 'or_finish_date__lte', datetime_field()),
+        Filter('or_username', 'or_username', serializers.IntegerField()),
+        Filter('min_total', 'or_total_price__gte', decimal_field()),
+        Filter('max_total', 'or_total_price__lte', decimal_field()),
+    ]
 
     def get(self, request, format=None):
-        if request.user.groups.filter(name='customer'):
-            orders = Order.objects.filter(or_username=request.user)
-        elif request.user.groups.filter(name='employee'):
+        if has_role(request.user, CUSTOMER):
+            orders = Order.objects.filter(or_username_id=request.user.id)
+        elif has_role(request.user, EMPLOYEE):
             orders = Order.objects.all()
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
-
+        orders = apply_filters(orders, request.query_params, self.filters)
+        if wants_stream(request):
+            validators = queryset_validators(orders, request.user.id, request.query_params.urlencode())
+            response = conditional_response(request, *validators) or stream_list(orders.order_by('or_id'),
+                                                                                 OrderSerializer)
+            return set_validators(response, *validators)
+        compiled = compile_serializer(OrderSerializer)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(compiled.values(orders, 'updated_at', *self.ordering_fields), request,
+                                           view=self)
+        validators = page_validators(page, 'or_id', paginator.next_link, request.user.id,
+                                     request.query_params.urlencode())
+        response = conditional_response(request, *validators) or paginator.get_paginated_response(
+            compiled.serialize_rows(page))
+        return set_validators(response, *validators)
+
+    @idempotent
     def post(self, request, format=None):
-        if request.user.groups.filter(name='customer'):
+        if has_role(request.user, CUSTOMER):
             content = {"or_username": request.user.id}
             serializer = OrderSerializer(data=content)
-        elif request.user.groups.filter(name='employee'):
+        elif has_role(request.user, EMPLOYEE):
             serializer = OrderSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save()
@@ -84,17 +347,32 @@ class OrderDetail(APIView):
         except Order.DoesNotExist:
             raise Http404
 
+    def get_validators(self, pk):
+        """Owner id, ETag and Last-Modified of the order, computed from 'updated_at' of order, items and products."""
+        meta = Order.objects.filter(pk=pk).aggregate(
+            owner=Max('or_username'), order=Max('updated_at'), items=Max('items_in_order__updated_at'),
+            products=Max('items_in_order__pr_id__updated_at'), count=Count('items_in_order'))
+        if meta['owner'] is None:
+            raise Http404
+        etag = make_etag(pk, meta['order'], meta['items'], meta['products'], meta['count'])
+        last_modified = max(date for date in (meta['order'], meta['items'], meta['products']) if date)
+        return meta['owner'], etag, last_modified
+
     def get(self, request, pk, format=None):
-        if request.user.groups.filter(name='customer'):
-            order = self.get_object(pk)
-            if not request.user == order.or_username:
+        owner, *validators = self.get_validators(pk)
+        if has_role(request.user, CUSTOMER):
+            if not request.user.id == owner:
                 return Response(self.order_wrong(), status=status.HTTP_400_BAD_REQUEST)
-        elif request.user.groups.filter(name='employee'):
-            order = self.get_object(pk)
-        order_serializer = OrderGetSerializer(order)
-        return Response({'order_info': order_serializer.data,
-                         'total_price': order.total_price,
-                         })
+        response = conditional_response(request, *validators)
+        if response is None:
+            compiled = compile_serializer(OrderGetSerializer)
+            rows = list(compiled.values(Order.objects.filter(pk=pk)))
+            if not rows:
+                raise Http404
+            response = Response({'order_info': compiled.serialize_rows(rows)[0],
+                                 'total_price': {'price': rows[0]['or_total_price']},
+                                 })
+        return set_validators(response, *validators)
 
     def put(self, request, pk, format=None):
         """
@@ -102,38 +380,59 @@ class OrderDetail(APIView):
         Employee can change all fields.
         """
         order = self.get_object(pk)
-        if request.user.groups.filter(name='customer'):
-            if not request.user == order.or_username:
+        if has_role(request.user, CUSTOMER):
+            if not request.user.id == order.or_username_id:
                 return Response(self.order_wrong(), status=status.HTTP_400_BAD_REQUEST)
-        elif request.user.groups.filter(name='employee'):
+        elif has_role(request.user, EMPLOYEE):
             pass
         else:
             return Response({'message': 'No permission'}, status=status.HTTP_403_FORBIDDEN)
+        if has_preconditions(request):
+            check_preconditions(request, *self.get_validators(pk)[1:])
 
         if not order.or_is_finished:
-            data = {'or_is_finished': True, 'or_finish_date': timezone.now()}
-            serializer = OrderSerializer(order, data=data, partial=True)
-            if serializer.is_valid():
-                serializer.save()
-                return Response(serializer.data, status.HTTP_200_OK)
+            now = timezone.now()
+            with transaction.atomic():
+                check_swapped(Order.compare_and_set(order.or_id, order.version, or_is_finished=True,
+                                                    or_finish_date=now, updated_at=now))
+                sales.record_order(order.or_id, now)
+                outbox.publish(outbox.ORDER_FINISHED, or_id=order.or_id, or_username=order.or_username_id,
+                               or_total_price=order.or_total_price, or_finish_date=now)
+            order.or_is_finished, order.or_finish_date, order.updated_at = True, now, now
+            order.version += 1
+            return Response(OrderSerializer(order).data, status.HTTP_200_OK)
         else:
             order_finished = {'message': 'Your order is already marked as finish. You cannot make any changes.'}
             return Response(order_finished, status=status.HTTP_400_BAD_REQUEST)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, pk, format=None):
-        if request.user.groups.filter(name='customer'):
+        if has_role(request.user, CUSTOMER):
             order = self.get_object(pk)
-            if not request.user == order.or_username:
+            if not request.user.id == order.or_username_id:
                 return Response(self.order_wrong(), status=status.HTTP_400_BAD_REQUEST)
-        elif request.user.groups.filter(name='employee'):
+        elif has_role(request.user, EMPLOYEE):
             order = self.get_object(pk)
-        order.delete()
+        if has_preconditions(request):
+            check_preconditions(request, *self.get_validators(pk)[1:])
+        if order.or_is_finished:
+            # Finished orders are in sales reports, their items can't be removed either
+            order_finished = {'message': 'Your order is already marked as finish. You cannot make any changes.'}
+            return Response(order_finished, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            # The version also changes when the order is finished in the meantime
+            check_swapped(Order.objects.filter(pk=order.pk, version=order.version).update(version=F('version') + 1))
+            # Items go with the order, their products back to stock
+            items = order.items_in_order.all()
+            stock.change({pr_id: -amount for pr_id, amount in items.values_list('pr_id', 'amount')})
+            items.delete()
+            order.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class OrderItemCreate(APIView):
     permission_classes = ((IsCustomerGroup | IsEmployeeGroup),)
+    throttle_rates = {'customer': '300/min', 'employee': '1200/min', 'ip': '1200/min'}
+    max_lines = 1000
 
     def order_wrong(self):
         return {'message': 'You cannot access an order which isnt yours.'}
@@ -141,26 +440,131 @@ class OrderItemCreate(APIView):
     def order_finished(self):
         return {'message': 'Your order is already marked as finish. You cannot make any changes.'}
 
+    def order_error(self, request, order):
+        """Response explaining why the user cannot change items of the order, None if they can."""
+        if has_role(request.user, CUSTOMER):
+            if not order.or_username_id == request.user.id:
+                return Response(self.order_wrong(), status=status.HTTP_400_BAD_REQUEST)
+        elif not has_role(request.user, EMPLOYEE):
+            return Response(self.order_wrong(), status=status.HTTP_400_BAD_REQUEST)
+        if order.or_is_finished:
+            return Response(self.order_finished(), status=status.HTTP_400_BAD_REQUEST)
+        return None
+
+    def validate_lines(self, data, partial=False):
+        """
+        Validate a list of lines against products fetched in one query.
+        Return amounts merged by product id and products, or raise errors reported per line.
+        """
+        if not isinstance(data, list) or not data:
+            raise ValidationError({'non_field_errors': ['Expected a non-empty list of items.']})
+        if len(data) > self.max_lines:
+            raise ValidationError({'non_field_errors': ['Too many items, at most {} allowed.'.format(self.max_lines)]})
+        serializer = OrderItemLineSerializer(data=data, many=True, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        lines = serializer.validated_data
+        products = Product.objects.in_bulk({line['pr_id'] for line in lines})
+        errors = [{} if line['pr_id'] in products else
+                  {'pr_id': ['Invalid pk "{}" - object does not exist.'.format(line['pr_id'])]} for line in lines]
+        if any(errors):
+            raise ValidationError(errors)
+        amounts = {}
+        for line in lines:
+            amounts[line['pr_id']] = amounts.get(line['pr_id'], 0) + line.get('amount', 0)
+        return lines, amounts, products
+
+    def existing_lines(self, order, lines, amounts, required):
+        existing = {item.pr_id_id: item for item in order.items_in_order.filter(pr_id__in=amounts)}
+        if required:
+            errors = [{} if line['pr_id'] in existing else {'pr_id': ['Product is not in the order.']}
+                      for line in lines]
+            if any(errors):
+                raise ValidationError(errors)
+        return existing
+
+    @idempotent
     def post(self, request, pk, format=None):
-        order = Order.objects.get(or_id=pk)
+        """Add one item, or a list of items. Items of products already in the order get the new amount."""
+        order = get_object_or_404(Order, or_id=pk)
+        error = self.order_error(request, order)
+        if error is not None:
+            return error
+        if isinstance(request.data, list):
+            return self.bulk_upsert(order, request.data)
+
         content = request.data
         content.update(or_id=order.or_id)
-        if request.user.groups.filter(name='customer'):
-            if not order.or_username == request.user:
-                return Response(self.order_wrong(), status=status.HTTP_400_BAD_REQUEST)
-        elif request.user.groups.filter(name='employee'):
-            pass
-        else:
-            return Response(self.order_wrong(), status=status.HTTP_400_BAD_REQUEST)
+        serializer = ProductsInOrdersSerializer(data=content)
+        if serializer.is_valid():
+            line = serializer.validated_data
+            with transaction.atomic():
+                # Compare-and-set first: it locks the order, so a concurrent request adding the same product gets
+                # the conflict instead of failing on the unique (order, product) constraint
+                check_swapped(Order.add_item_totals(order.or_id, line['amount'] * line['pr_id'].pr_price, 1,
+                                                    version=order.version))
+                item = serializer.save()
+                stock.reserve({item.pr_id_id: item.amount})
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        if not order.or_is_finished:
-            serializer = ProductsInOrdersSerializer(data=content)
-            if serializer.is_valid():
-                serializer.save()
-                return Response(serializer.data, status=status.HTTP_201_CREATED)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            return Response(self.order_finished(), status=status.HTTP_400_BAD_REQUEST)
+    def bulk_upsert(self, order, data):
+        lines, amounts, products = self.validate_lines(data)
+        # Lines are read outside the transaction, the version compared first in it proves they didn't change since
+        existing = self.existing_lines(order, lines, amounts, required=False)
+        created, updated, price_delta, now = [], [], 0, timezone.now()
+        reserved = {pr_id: amount - (existing[pr_id].amount if pr_id in existing else 0)
+                    for pr_id, amount in amounts.items()}
+        for pr_id, amount in amounts.items():
+            item = existing.get(pr_id)
+            if item is None:
+                created.append(ProductsInOrders(or_id=order, pr_id=products[pr_id], amount=amount))
+                price_delta += amount * products[pr_id].pr_price
+            else:
+                price_delta += (amount - item.amount) * products[pr_id].pr_price
+                item.amount, item.updated_at = amount, now
+                updated.append(item)
+        with transaction.atomic():
+            check_swapped(Order.add_item_totals(order.or_id, price_delta, len(created), version=order.version))
+            ProductsInOrders.objects.bulk_create(created)
+            ProductsInOrders.objects.bulk_update(updated, ['amount', 'updated_at'])
+            stock.change(reserved)
+        serializer = ProductsInOrdersSerializer(created + updated, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def patch(self, request, pk, format=None):
+        """Change amounts of a list of items, identified by product."""
+        order = get_object_or_404(Order, or_id=pk)
+        error = self.order_error(request, order)
+        if error is not None:
+            return error
+        lines, amounts, products = self.validate_lines(request.data)
+        existing = self.existing_lines(order, lines, amounts, required=True)
+        price_delta, now = 0, timezone.now()
+        reserved = {pr_id: amounts[pr_id] - item.amount for pr_id, item in existing.items()}
+        for pr_id, item in existing.items():
+            price_delta += (amounts[pr_id] - item.amount) * products[pr_id].pr_price
+            item.amount, item.updated_at = amounts[pr_id], now
+        with transaction.atomic():
+            check_swapped(Order.add_item_totals(order.or_id, price_delta, version=order.version))
+            ProductsInOrders.objects.bulk_update(existing.values(), ['amount', 'updated_at'])
+            stock.change(reserved)
+        serializer = ProductsInOrdersSerializer(existing.values(), many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def delete(self, request, pk, format=None):
+        """Remove a list of items, identified by product."""
+        order = get_object_or_404(Order, or_id=pk)
+        error = self.order_error(request, order)
+        if error is not None:
+            return error
+        lines, amounts, products = self.validate_lines(request.data, partial=True)
+        existing = self.existing_lines(order, lines, amounts, required=True)
+        price_delta = sum(item.amount * products[pr_id].pr_price for pr_id, item in existing.items())
+        with transaction.atomic():
+            check_swapped(Order.add_item_totals(order.or_id, -price_delta, -len(existing), version=order.version))
+            ProductsInOrders.objects.filter(pk__in=[item.pk for item in existing.values()]).delete()
+            stock.change({pr_id: -item.amount for pr_id, item in existing.items()})
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class OrderItemDetail(APIView):
@@ -172,28 +576,40 @@ class OrderItemDetail(APIView):
     def order_finished(self):
         return {'message': 'Your order is already marked as finish. You cannot make any changes.'}
 
-    def get_object(self, item):
+    def get_object(self, pk, item):
         try:
-            return ProductsInOrders.objects.get(pk=item)
+            return ProductsInOrders.objects.select_related('pr_id').get(pk=item, or_id=pk)
         except ProductsInOrders.DoesNotExist:
             raise Http404
 
     def put(self, request, pk, item, format=None):
-        item_exist = self.get_object(item)
+        item_exist = self.get_object(pk, item)
         order = Order.objects.get(or_id=pk)
 
-        if request.user.groups.filter(name='customer'):
-            if not request.user == order.or_username:
+        if has_role(request.user, CUSTOMER):
+            if not request.user.id == order.or_username_id:
                 return Response(self.order_wrong(), status=status.HTTP_400_BAD_REQUEST)
-        elif request.user.groups.filter(name='employee'):
+        elif has_role(request.user, EMPLOYEE):
             pass
         else:
             return Response({'message': 'No permission'}, status=status.HTTP_403_FORBIDDEN)
 
         if not order.or_is_finished:
+            old_price, old_amount = item_exist.line_price, item_exist.amount
             serializer = ProductsInOrdersSerializer(item_exist, data=request.data, partial=True)
             if serializer.is_valid():
-                serializer.save(update_fields=["amount"])
+                # Only the amount can change, the item stays in its order with its product
+                moved = {field: ['Cannot be changed, remove the item and add a new one instead.']
+                         for field in ('or_id', 'pr_id') if field in serializer.validated_data
+                         and serializer.validated_data[field].pk != getattr(item_exist, field + '_id')}
+                if moved:
+                    return Response(moved, status=status.HTTP_400_BAD_REQUEST)
+                item_exist.amount = serializer.validated_data.get('amount', old_amount)
+                with transaction.atomic():
+                    check_swapped(Order.add_item_totals(order.or_id, item_exist.line_price - old_price,
+                                                        version=order.version))
+                    item_exist.save(update_fields=['amount', 'updated_at'])
+                    stock.change({item_exist.pr_id_id: item_exist.amount - old_amount})
                 return Response(serializer.data, status.HTTP_200_OK)
         else:
             return Response(self.order_finished(), status=status.HTTP_400_BAD_REQUEST)
@@ -201,18 +617,21 @@ class OrderItemDetail(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, pk, item, format=None):
-        item_exist = self.get_object(item)
+        item_exist = self.get_object(pk, item)
         order = Order.objects.get(or_id=pk)
 
-        if request.user.groups.filter(name='customer'):
-            if not request.user == order.or_username:
+        if has_role(request.user, CUSTOMER):
+            if not request.user.id == order.or_username_id:
                 return Response(self.order_wrong(), status=status.HTTP_400_BAD_REQUEST)
-        elif request.user.groups.filter(name='employee'):
+        elif has_role(request.user, EMPLOYEE):
             pass
         else:
             return Response({'message': 'No permission'}, status=status.HTTP_403_FORBIDDEN)
 
         if order.or_is_finished:
             return Response(self.order_finished(), status=status.HTTP_400_BAD_REQUEST)
-        item_exist.delete()
+        with transaction.atomic():
+            check_swapped(Order.add_item_totals(order.or_id, -item_exist.line_price, -1, version=order.version))
+            item_exist.delete()
+            stock.change({item_exist.pr_id_id: -item_exist.amount})
         return Response(status=status.HTTP_204_NO_CONTENT)